@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+from git_command import parseSize
+from rate_limit import RateLimiter
+
+# Git operations and the direction of their transfer
+DIRECTIONS = {'clone': 'fetch', 'fetch': 'fetch', 'push': 'push'}
+
+_limiters = {'fetch': None, 'push': None}
+
+def parseRate(value):
+    '''
+    Parse a bandwidth given as number (bytes per second) or string with a
+    unit (e.g. "10 MiB" per second)
+
+    :param value: bandwidth
+
+    :return: bytes per second
+    :rtype:  float
+
+    :raises ValueError: if the given value is invalid
+    '''
+    rate = parseSize(value)
+    if rate <= 0:
+      raise ValueError('Bandwidth must be positive')
+    return rate
+
+
+def getBandwidthLimiters(config):
+    '''
+    Get the bandwidth limiters of a configuration (keys fetch-rate and push-rate).
+    The burst size is one second of transfer.
+
+    :param dict config: git or hoster configuration
+
+    :return: dictionary with the direction (fetch, push) as key and RateLimiter (None if unlimited) as value
+    :rtype:  dict
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    limiters = dict()
+    for direction in ['fetch', 'push']:
+      limiters[direction] = None
+      if config.get(direction + '-rate') != None:
+        rate = parseRate(config[direction + '-rate'])
+        limiters[direction] = RateLimiter(rate, rate)
+    return limiters
+
+
+def configureBandwidth(config):
+    '''
+    Configure the bandwidth budgets shared by all hosters
+
+    :param dict config: git configuration (keys fetch-rate, push-rate)
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    global _limiters
+    _limiters = getBandwidthLimiters(config)
+
+
+def getLimiters(operation, hoster):
+    '''
+    Get the limiters a git operation with a hoster has to pass (global budget
+    and the budget of the hoster)
+
+    :param str operation:     git operation (clone, fetch, push, ls-remote, local)
+    :param BaseHoster hoster: hoster of the remote repository
+
+    :return: list of RateLimiter objects (empty if unlimited)
+    :rtype:  list
+    '''
+    direction = DIRECTIONS.get(operation)
+    if direction == None:
+      return list()
+    limiters = [_limiters[direction], hoster.bandwidth_limiters.get(direction)]
+    return [limiter for limiter in limiters if limiter != None]
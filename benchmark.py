@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+from git_command import getGitRunner
+from plan import formatBytes
+from transfer import DEFAULT_PROFILE
+
+WORDS = ['mirror', 'git', 'push', 'fetch', 'branch', 'tag', 'commit', 'object', 'pack', 'delta', 'tree', 'blob']
+
+def createSyntheticRepository(path, commits=100, refs=1, object_size=65536, seed=0):
+  '''
+  Create a bare repository with generated content (using git fast-import)
+
+  :param str path:        path of the bare repository to be created
+  :param int commits:     number of commits per branch
+  :param int refs:        number of branches (each branch also gets a tag)
+  :param int object_size: approximate size of each file in bytes
+  :param int seed:        seed of the random content generator
+
+  :raises RuntimeError: if the repository could not be created
+  '''
+  generator = random.Random(seed)
+  subprocess.run(['git', 'init', '--quiet', '--bare', path], check = True)
+
+  stream = list()
+  mark = 0
+  for ref in range(refs):
+    parent = None
+    for commit in range(commits):
+      # Half random words (compressible), half random bytes (incompressible)
+      text = ' '.join(generator.choice(WORDS) for _i in range(object_size // 14)).encode()
+      data = text + os.urandom(object_size // 2)
+      mark += 1
+      blob_mark = mark
+      stream.append(b'blob\nmark :%d\ndata %d\n' % (blob_mark, len(data)) + data + b'\n')
+
+      mark += 1
+      message = b'Commit %d on branch %d' % (commit, ref)
+      header = b'commit refs/heads/branch-%d\nmark :%d\ncommitter Mirror <mirror@example.com> %d +0000\ndata %d\n' % \
+        (ref, mark, 1500000000 + commit, len(message))
+      body = header + message + b'\n'
+      if parent != None:
+        body += b'from :%d\n' % parent
+      body += b'M 100644 :%d file-%d\n\n' % (blob_mark, commit % 10)
+      stream.append(body)
+      parent = mark
+    stream.append(b'reset refs/tags/v%d\nfrom :%d\n\n' % (ref, parent))
+
+  proc = subprocess.run(['git', 'fast-import', '--quiet'], cwd = path, input = b''.join(stream),
+    stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+  if proc.returncode != 0:
+    raise RuntimeError('Creating synthetic repository failed: ' + proc.stderr.decode(errors = 'replace'))
+  subprocess.run(['git', 'symbolic-ref', 'HEAD', 'refs/heads/branch-0'], cwd = path, check = True)
+
+
+def benchmarkTransferProfiles(profiles, commits=100, refs=4, object_size=65536):
+  '''
+  Measure the throughput of fetching and pushing with each transfer profile
+  against a synthetic bare repository on the local disk (file:// transport)
+
+  :param dict profiles:   transfer profiles (name -> TransferProfile)
+  :param int commits:     number of commits per branch of the synthetic repository
+  :param int refs:        number of branches of the synthetic repository
+  :param int object_size: approximate size of each file in bytes
+
+  :return: list of results (profile name, bytes fetched, fetch duration, bytes pushed, push duration)
+  :rtype:  list
+  '''
+  results = list()
+  runner = getGitRunner()
+  directory = tempfile.mkdtemp(prefix = 'git-mirror-benchmark-')
+  try:
+    source = os.path.join(directory, 'source.git')
+    createSyntheticRepository(source, commits, refs, object_size)
+
+    candidates = [('default', DEFAULT_PROFILE)] + sorted(profiles.items())
+    for name, profile in candidates:
+      cache = os.path.join(directory, name, 'cache.git')
+      destination = os.path.join(directory, name, 'destination.git')
+      subprocess.run(['git', 'init', '--quiet', '--bare', destination], check = True)
+
+      fetch = runner.run('clone', profile.getConfigArgs() + ['clone', '--mirror', '--progress', 'file://' + source, cache])
+      push = runner.run('push', profile.getConfigArgs() + ['push', '--mirror', '--progress', 'file://' + destination],
+        cwd = cache)
+      results.append((name, fetch.bytes, fetch.duration, push.bytes, push.duration))
+      shutil.rmtree(os.path.join(directory, name))
+  finally:
+    shutil.rmtree(directory, ignore_errors = True)
+  return results
+
+
+def formatTransferResults(results):
+  '''
+  Format the results of benchmarkTransferProfiles as a table
+
+  :param list results: benchmark results
+
+  :return: formatted table
+  :rtype:  str
+  '''
+  lines = ['%-20s %14s %14s %14s %14s' % ('profile', 'fetched', 'fetch rate', 'pushed', 'push rate')]
+  for name, fetch_bytes, fetch_duration, push_bytes, push_duration in results:
+    lines.append('%-20s %14s %14s %14s %14s' % (name,
+      formatBytes(fetch_bytes), formatBytes(fetch_bytes / max(fetch_duration, 0.001)) + '/s',
+      formatBytes(push_bytes), formatBytes(push_bytes / max(push_duration, 0.001)) + '/s'))
+  return '\n'.join(lines)
+
+
+def benchmarkRun(repositories=20, commits=10, refs=1, object_size=16384, source='gitlab', destinations=['github', 'bitbucket'],
+  workers=1, runs=2, changed=0, verbose=False, push_workers=None):
+  '''
+  Measure Task.run end to end and per phase against local stand-ins of the
+  hoster APIs (see FakeHosterServer). No network access is needed.
+
+  :param int repositories: number of repositories of the synthetic source organization
+  :param int commits:      number of commits per branch
+  :param int refs:         number of branches per repository
+  :param int object_size:  approximate size of each file in bytes
+  :param str source:       source hoster type (github, gitlab, bitbucket)
+  :param list destinations: destination hoster types
+  :param int workers:      number of workers of the task
+  :param int runs:         number of consecutive runs (the first one creates all mirrors)
+  :param int changed:      number of repositories changed on the source before each following run
+  :param bool verbose:     print the output of the task runs
+  :param int push_workers: number of push workers (fetch and push pipelined, disabled if None)
+
+  :return: list of results per run (dict with timings, API calls and requests)
+  :rtype:  list
+  '''
+  from fake_hoster import FakeHosterServer
+  from hoster import getHosterInstance
+  from repo import getCachePath, setCachePath
+  from state import StateStore
+  from task import getTaskInstance
+
+  results = list()
+  directory = tempfile.mkdtemp(prefix = 'git-mirror-benchmark-')
+  previous_cache_path = getCachePath()
+  server = FakeHosterServer(os.path.join(directory, 'remote'))
+  try:
+    server.start()
+    names = server.createSyntheticOrganization(source, 'source-org', repositories, commits, refs, object_size)
+    setCachePath(os.path.join(directory, 'cache'))
+
+    hosters = {'source': getHosterInstance(server.getHosterConfig(source, 'source', 'source-org'))}
+    for i, hoster_type in enumerate(destinations):
+      name = 'destination-' + str(i) + '-' + hoster_type
+      hosters[name] = getHosterInstance(server.getHosterConfig(hoster_type, name, 'mirror-org'))
+    config = {
+      'name': 'benchmark',
+      'source': 'source',
+      'destinations': [name for name in hosters if name != 'source'],
+      'sync': 'all',
+      'delete': True,
+      'workers': workers
+    }
+    if push_workers != None:
+      config['push-workers'] = push_workers
+    task = getTaskInstance(config, hosters, StateStore(os.path.join(getCachePath(), 'state.json')))
+
+    for run in range(runs):
+      if run > 0:
+        for name in names[:changed]:
+          server.touchRepository(source, 'source-org', name)
+      for hoster in hosters.values():
+        hoster.api_calls = 0
+        hoster.api_time = 0.0
+      requests_before = server.getRequestCount()
+      bytes_before = dict(server.response_bytes)
+
+      task.run(verbose)
+
+      requests_after = server.getRequestCount()
+      results.append({
+        'run': run + 1,
+        'timings': dict(task.timings),
+        'api_calls': {name: hoster.api_calls for name, hoster in hosters.items()},
+        'api_time': sum(hoster.api_time for hoster in hosters.values()),
+        'requests': {key: requests_after[key] - requests_before[key] for key in requests_after},
+        'response_bytes': {key: server.response_bytes[key] - bytes_before[key] for key in bytes_before}
+      })
+  finally:
+    server.stop()
+    setCachePath(previous_cache_path)
+    shutil.rmtree(directory, ignore_errors = True)
+  return results
+
+
+def formatRunResults(results):
+  '''
+  Format the results of benchmarkRun as a table
+
+  :param list results: benchmark results
+
+  :return: formatted table
+  :rtype:  str
+  '''
+  phases = ['total', 'list', 'resolve', 'probe', 'compare', 'fetch', 'push', 'sync', 'delete']
+  lines = ['%-5s' % 'run' + ''.join('%10s' % phase for phase in phases) + '%10s%10s%12s' % ('API calls', 'git reqs', 'API bytes')]
+  for result in results:
+    api_bytes = sum(value for key, value in result['response_bytes'].items() if key != 'git')
+    lines.append('%-5d' % result['run'] + ''.join('%9.2fs' % result['timings'].get(phase, 0.0) for phase in phases) +
+      '%10d%10d%12s' % (sum(result['api_calls'].values()), result['requests']['git'], formatBytes(api_bytes)))
+  return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+  import argparse
+  import json
+
+  parser = argparse.ArgumentParser(prog='benchmark.py',
+            description='Measures git-mirror against local stand-ins of the hoster APIs (no network access needed).')
+  subparsers = parser.add_subparsers(dest='benchmark')
+  subparsers.required = True
+
+  run_parser = subparsers.add_parser('run', help='time Task.run end to end and per phase')
+  run_parser.add_argument('--repositories', type=int, default=20, help='number of repositories of the source organization')
+  run_parser.add_argument('--source', default='gitlab', choices=['github', 'gitlab', 'bitbucket'], help='source hoster type')
+  run_parser.add_argument('--destinations', default='github,bitbucket', help='comma separated destination hoster types')
+  run_parser.add_argument('--workers', type=int, default=1, help='number of workers of the task')
+  run_parser.add_argument('--push-workers', type=int, help='number of push workers (pipelines fetch and push)')
+  run_parser.add_argument('--runs', type=int, default=2, help='number of consecutive runs')
+  run_parser.add_argument('--changed', type=int, default=0, help='repositories changed before each following run')
+
+  transfer_parser = subparsers.add_parser('transfer', help='measure the throughput of the transfer profiles of a configuration')
+  transfer_parser.add_argument('-c', '--config', metavar='config.json', type=argparse.FileType('r'), help='configuration file')
+
+  for subparser in [run_parser, transfer_parser]:
+    subparser.add_argument('--commits', type=int, default=10, help='number of commits per branch')
+    subparser.add_argument('--refs', type=int, default=1, help='number of branches per repository')
+    subparser.add_argument('--object-size', type=int, default=16384, help='approximate size of each file in bytes')
+    subparser.add_argument('--json', action='store_true', help='print the results as JSON')
+  args = parser.parse_args()
+
+  if args.benchmark == 'run':
+    results = benchmarkRun(args.repositories, args.commits, args.refs, args.object_size, args.source,
+      args.destinations.split(','), args.workers, args.runs, args.changed, push_workers = args.push_workers)
+    print(json.dumps(results, indent = 2) if args.json else formatRunResults(results))
+  else:
+    from transfer import getTransferProfiles
+    profiles = dict()
+    if args.config != None:
+      profiles = getTransferProfiles(json.load(args.config).get('transfer-profiles', dict()))
+    results = benchmarkTransferProfiles(profiles, args.commits, args.refs, args.object_size)
+    print(json.dumps(results, indent = 2) if args.json else formatTransferResults(results))
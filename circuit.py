@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import threading
+import time
+
+class CircuitOpenError(ConnectionError):
+  '''
+  Raised instead of calling a hoster whose circuit breaker is open
+  '''
+  pass
+
+
+class CircuitBreaker():
+
+  def __init__(self, name, failures=5, latency=None, open_duration=60.0):
+    '''
+    Initialize a circuit breaker shared between threads. It opens after the
+    given number of consecutive failures (or calls slower than the latency
+    limit). While open, calls fail immediately. After open_duration seconds a
+    single call is let through as probe: it closes the breaker on success and
+    opens it again on failure.
+
+    :param str name:            name used in error messages (e.g. hoster name)
+    :param int failures:        consecutive failures opening the breaker
+    :param float latency:       calls slower than this many seconds count as failures (disabled if None)
+    :param float open_duration: seconds until a probe call is let through
+
+    :raises ValueError: if the given values are invalid
+    '''
+    if failures < 1 or open_duration < 0 or (latency != None and latency <= 0):
+      raise ValueError('Invalid circuit breaker configuration of \'' + name + '\'')
+    self.name = name
+    self.failures = failures
+    self.latency = latency
+    self.open_duration = open_duration
+    self.state = 'closed'
+    self._failed = 0
+    self._opened_at = None
+    self._probe_at = None
+    self._lock = threading.Lock()
+
+
+  def isAvailable(self):
+    '''
+    Check if calls are let through (without starting a probe)
+
+    :return: False if the breaker is open and no probe is due
+    :rtype:  bool
+    '''
+    with self._lock:
+      return self.state == 'closed' or self._isProbeDue(time.time())
+
+
+  def acquire(self):
+    '''
+    Check if a call may be made now. In state open, this call becomes the
+    probe if one is due.
+
+    :raises CircuitOpenError: if the breaker is open
+    '''
+    with self._lock:
+      now = time.time()
+      if self.state == 'closed':
+        return
+      if self._isProbeDue(now):
+        self.state = 'half-open'
+        self._probe_at = now
+        return
+    raise CircuitOpenError('Hoster \'' + self.name + '\' is unavailable (circuit breaker open)')
+
+
+  def recordSuccess(self, duration=0.0):
+    '''
+    Record a successful call
+
+    :param float duration: duration of the call in seconds
+    '''
+    if self.latency != None and duration > self.latency:
+      self.recordFailure()
+      return
+    with self._lock:
+      self._failed = 0
+      self.state = 'closed'
+
+
+  def recordFailure(self):
+    '''
+    Record a failed (or too slow) call
+    '''
+    with self._lock:
+      self._failed += 1
+      if self.state == 'half-open' or self._failed >= self.failures:
+        self.state = 'open'
+        self._opened_at = time.time()
+        self._probe_at = None
+
+
+  def _isProbeDue(self, now):
+    '''
+    Check if a probe call is due: the breaker is open for open_duration
+    seconds and no probe is running (or the last one did not report back)
+    '''
+    if self.state == 'open':
+      return now >= self._opened_at + self.open_duration
+    return self.state == 'half-open' and now >= self._probe_at + self.open_duration
+
+
+def getCircuitBreaker(name, config, latency=True):
+    '''
+    Get a circuit breaker of a hoster configuration
+
+    :param str name:     breaker name
+    :param dict config:  hoster configuration
+    :param bool latency: whether the latency limit (circuit-latency) applies
+
+    :return: circuit breaker (None if disabled with circuit-failures 0)
+    :rtype:  CircuitBreaker
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    failures = int(config.get('circuit-failures', 5))
+    if failures == 0:
+      return None
+    max_latency = None
+    if latency and config.get('circuit-latency') != None:
+      max_latency = float(config['circuit-latency'])
+    return CircuitBreaker(name, failures, max_latency, float(config.get('circuit-open-duration', 60)))
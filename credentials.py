@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import threading
+import time
+
+class Credential():
+
+  def __init__(self, user, password):
+    '''
+    Initialize an API credential and its rate limit status
+
+    :param str user:     Username for the git service
+    :param str password: Password or access token (in plain text)
+    '''
+    self.user = user
+    self.password = password
+    self.remaining = None
+    self.reset_at = None
+    self.requests = 0
+
+
+  def isExhausted(self, now):
+    '''
+    :param float now: current UNIX timestamp
+
+    :return: True if the rate limit is used up until the reset time
+    :rtype:  bool
+    '''
+    return self.remaining != None and self.remaining <= 0 and self.reset_at != None and self.reset_at > now
+
+
+class CredentialPool():
+
+  def __init__(self, credentials, max_wait=300):
+    '''
+    Initialize a pool of credentials shared between threads. Requests are
+    distributed by the remaining rate limit of each credential and exhausted
+    credentials rest until their reset time.
+
+    :param list credentials: Credential objects (the first one is used for git and user namespaces)
+    :param float max_wait:   maximum time in seconds to wait for a reset if all credentials are exhausted
+
+    :raises ValueError: if no credentials are given
+    '''
+    if len(credentials) == 0:
+      raise ValueError('A credential pool needs at least one credential')
+    self.credentials = list(credentials)
+    self.max_wait = max_wait
+    self._lock = threading.Lock()
+
+
+  def __len__(self):
+    return len(self.credentials)
+
+
+  def acquire(self, primary=False):
+    '''
+    Get the credential with the most remaining requests. If all credentials are
+    exhausted, wait until the first one is reset (at most max_wait seconds).
+
+    :param bool primary: use the first credential (e.g. for the user namespace of its account)
+
+    :return: credential to be used for the next request
+    :rtype:  Credential
+    '''
+    pool = self.credentials[:1] if primary else self.credentials
+    waited = 0.0
+    while True:
+      with self._lock:
+        now = time.time()
+        available = [credential for credential in pool if not credential.isExhausted(now)]
+        if len(available) > 0 or waited >= self.max_wait:
+          candidates = available if len(available) > 0 else pool
+          # Unknown headroom first (probes the limit), then the least used one on ties
+          credential = max(candidates, key = lambda c: (c.remaining if c.remaining != None else float('inf'), -c.requests))
+          credential.requests += 1
+          if credential.remaining != None:
+            credential.remaining -= 1 # Estimate until the response headers arrive
+          return credential
+        delay = min(min(credential.reset_at for credential in pool) - now, self.max_wait - waited)
+      delay = max(delay, 0.1)
+      time.sleep(delay)
+      waited += delay
+
+
+  def update(self, credential, response):
+    '''
+    Update the rate limit status of a credential from the response headers
+    (X-RateLimit-* of GitHub and Bitbucket, RateLimit-* of GitLab)
+
+    :param Credential credential:     credential used for the request
+    :param requests.Response response: response of the request
+
+    :return: True if the request has been rejected because of the rate limit
+    :rtype:  bool
+    '''
+    headers = response.headers
+    remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+    reset = headers.get('X-RateLimit-Reset', headers.get('RateLimit-Reset'))
+    retry_after = headers.get('Retry-After')
+    limited = response.status_code == 429 or (response.status_code == 403 and (remaining == '0' or retry_after != None))
+
+    with self._lock:
+      try:
+        if remaining != None:
+          credential.remaining = int(remaining)
+        if reset != None:
+          credential.reset_at = float(reset)
+      except ValueError:
+        pass # Unknown header format
+      if limited:
+        credential.remaining = 0
+        if retry_after != None and retry_after.isdigit():
+          credential.reset_at = time.time() + int(retry_after)
+        elif credential.reset_at == None or credential.reset_at <= time.time():
+          credential.reset_at = time.time() + 60
+    return limited
+
+
+def getCredentialPool(config):
+    '''
+    Get the credential pool of a hoster configuration (user/password and the
+    optional list 'credentials' of further user/password objects)
+
+    :param dict config: hoster configuration
+
+    :return: credential pool
+    :rtype:  CredentialPool
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    credentials = [Credential(config['user'], config['password'])]
+    for entry in config.get('credentials', list()):
+      if 'password' not in entry:
+        raise ValueError('Missing property \'password\' of a credential of hoster \'' + config['name'] + '\'')
+      credentials.append(Credential(entry.get('user', config['user']), entry['password']))
+    return CredentialPool(credentials, float(config.get('rate-limit-max-wait', 300)))
@@ -0,0 +1,977 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+
+API_VERSIONS = {'github': 3, 'gitlab': 4, 'bitbucket': 2}
+
+# URL fields of the GitHub payload which git-mirror does not need (makes the payload realistically large)
+GITHUB_URL_FIELDS = ['archive_url', 'assignees_url', 'blobs_url', 'branches_url', 'collaborators_url', 'comments_url',
+  'commits_url', 'compare_url', 'contents_url', 'contributors_url', 'deployments_url', 'downloads_url', 'events_url',
+  'forks_url', 'git_commits_url', 'git_refs_url', 'git_tags_url', 'hooks_url', 'issue_comment_url', 'issue_events_url',
+  'issues_url', 'keys_url', 'labels_url', 'languages_url', 'merges_url', 'milestones_url', 'notifications_url',
+  'pulls_url', 'releases_url', 'stargazers_url', 'statuses_url', 'subscribers_url', 'subscription_url', 'tags_url',
+  'teams_url', 'trees_url']
+
+# Fields of the simple GitLab project representation (simple=true, no visibility)
+GITLAB_SIMPLE_FIELDS = ['id', 'name', 'name_with_namespace', 'path', 'path_with_namespace', 'description',
+  'default_branch', 'http_url_to_repo', 'ssh_url_to_repo', 'web_url', 'readme_url', 'avatar_url', 'created_at',
+  'last_activity_at', 'topics', 'tag_list', 'namespace', 'forks_count', 'star_count']
+
+class FakeHosterServer():
+
+  def __init__(self, root, rate_limit=5000, search_rate_limit=None):
+    '''
+    Initialize a local stand-in for the GitHub, GitLab and Bitbucket APIs.
+    The repositories are bare repositories on the local disk which are served
+    over HTTP with git http-backend.
+
+    API base URLs (see getHosterConfig):
+      GitHub:    <url>/github
+      GitLab:    <url>/gitlab/api/v4
+      Bitbucket: <url>/bitbucket
+
+    :param str root:              directory holding the bare repositories
+    :param int rate_limit:        API requests per hour, hoster and credential
+    :param int search_rate_limit: GitHub search requests per minute (unlimited if None)
+    '''
+    self.root = root
+    self.rate_limit = rate_limit
+    self.search_rate_limit = search_rate_limit
+    self.repositories = {hoster: dict() for hoster in API_VERSIONS}
+    self.namespaces = dict()
+    self.requests = {hoster: 0 for hoster in list(API_VERSIONS) + ['git']}
+    self.response_bytes = {hoster: 0 for hoster in list(API_VERSIONS) + ['git']}
+    self._rate_limits = dict()
+    self._next_id = 1
+    self._lock = threading.RLock()
+
+    self._server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeHosterHandler)
+    self._server.daemon_threads = True
+    self._server.fake = self
+    self.url = 'http://127.0.0.1:' + str(self._server.server_address[1])
+    self._thread = None
+
+
+  def start(self):
+    '''
+    Start serving requests in a background thread
+    '''
+    os.makedirs(self.root, exist_ok=True)
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+
+
+  def stop(self):
+    '''
+    Stop serving requests
+    '''
+    self._server.shutdown()
+    self._server.server_close()
+
+
+  def getHosterConfig(self, hoster, name, organization):
+    '''
+    Get a git-mirror hoster configuration pointing to this server
+
+    :param str hoster:       hoster type (github, gitlab, bitbucket)
+    :param str name:         hoster name
+    :param str organization: organization (owner) of the repositories
+
+    :return: hoster configuration
+    :rtype:  dict
+    '''
+    config = {
+      'name': name,
+      'type': hoster,
+      'api-version': API_VERSIONS[hoster],
+      'user': 'mirror',
+      'password': 'mirror',
+      'organization': organization,
+      'api-url': self.getApiUrl(hoster)
+    }
+    if hoster == 'gitlab':
+      config['domain'] = 'gitlab.example.com'
+      self._getNamespaceId(organization) # Groups exist before their first project
+    return config
+
+
+  def getApiUrl(self, hoster):
+    '''
+    Get the API base URL of the given hoster type
+    '''
+    if hoster == 'gitlab':
+      return self.url + '/gitlab/api/v4'
+    return self.url + '/' + hoster
+
+
+  def addRepository(self, hoster, owner, name, visibility='public', description='', website=None):
+    '''
+    Register a repository. An empty bare repository is created if none exists yet.
+
+    :param str hoster:      hoster type (github, gitlab, bitbucket)
+    :param str owner:       owner (organization or user) of the repository
+    :param str name:        repository name
+    :param str visibility:  repository visibility (public, internal, private)
+    :param str description: repository description
+    :param str website:     repository website
+
+    :return: repository record
+    :rtype:  dict
+    '''
+    with self._lock:
+      if self._findRepository(hoster, owner, name) != None:
+        raise ValueError('Repository \'' + name + '\' already exists')
+      path = self.getRepositoryPath(hoster, owner, name)
+      if not os.path.isdir(path):
+        subprocess.run(['git', 'init', '--quiet', '--bare', path], check=True)
+      self._getNamespaceId(owner)
+      record = {
+        'id': self._next_id,
+        'uuid': '{' + str(uuid.uuid4()) + '}',
+        'owner': owner,
+        'name': name,
+        'visibility': visibility,
+        'description': description,
+        'website': website,
+        'topics': list(),
+        'activity': time.time(),
+        'path': path
+      }
+      self._next_id += 1
+      self.repositories[hoster][record['id']] = record
+      return record
+
+
+  def getRepositoryPath(self, hoster, owner, name):
+    '''
+    Get the path of the bare repository on the local disk
+    '''
+    return os.path.join(self.root, hoster, owner, name + '.git')
+
+
+  def getGitUrl(self, hoster, owner, name):
+    '''
+    Get the HTTP URL of a repository
+    '''
+    return self.url + '/git/' + hoster + '/' + quote(owner) + '/' + quote(name) + '.git'
+
+
+  def touchRepository(self, hoster, owner, name):
+    '''
+    Add a commit to the default branch of a repository and update its activity timestamp
+    '''
+    record = self._findRepository(hoster, owner, name)
+    if record == None:
+      raise LookupError('Repository \'' + name + '\' not found')
+
+    def git(args, input=None):
+      return subprocess.run(['git'] + args, cwd = record['path'], input = input, check = True,
+        stdout = subprocess.PIPE, universal_newlines = True).stdout.strip()
+
+    head = git(['symbolic-ref', 'HEAD'])
+    blob = git(['hash-object', '-w', '--stdin'], 'change ' + str(time.time()) + '\n')
+    tree = git(['mktree'], '100644 blob ' + blob + '\tchange\n')
+    args = ['commit-tree', tree, '-m', 'Change']
+    parent = subprocess.run(['git', 'rev-parse', '--verify', '--quiet', head], cwd = record['path'],
+      stdout = subprocess.PIPE, universal_newlines = True).stdout.strip()
+    if parent:
+      args += ['-p', parent]
+    commit = subprocess.run(['git', '-c', 'user.name=Mirror', '-c', 'user.email=mirror@example.com'] + args,
+      cwd = record['path'], check = True, stdout = subprocess.PIPE, universal_newlines = True).stdout.strip()
+    git(['update-ref', head, commit])
+    record['activity'] = time.time()
+
+
+  def createSyntheticOrganization(self, hoster, owner, count, commits=10, refs=1, object_size=16384):
+    '''
+    Create an organization with synthetic repositories
+
+    :param str hoster:      hoster type (github, gitlab, bitbucket)
+    :param str owner:       organization name
+    :param int count:       number of repositories
+    :param int commits:     number of commits per branch
+    :param int refs:        number of branches per repository (each with a tag)
+    :param int object_size: approximate size of each file in bytes
+
+    :return: names of the created repositories
+    :rtype:  list
+    '''
+    from benchmark import createSyntheticRepository
+
+    names = list()
+    width = len(str(count))
+    for i in range(count):
+      name = 'repo-' + str(i).zfill(width)
+      path = self.getRepositoryPath(hoster, owner, name)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      createSyntheticRepository(path, commits, refs, object_size, seed = i)
+      self.addRepository(hoster, owner, name, ['public', 'private'][i % 2], 'Synthetic repository ' + str(i))
+      names.append(name)
+    return names
+
+
+  def getRequestCount(self):
+    '''
+    Get the number of requests per hoster type (and git)
+
+    :rtype: dict
+    '''
+    with self._lock:
+      return dict(self.requests)
+
+
+  def _findRepository(self, hoster, owner, name):
+    with self._lock:
+      for record in self.repositories[hoster].values():
+        if record['owner'] == owner and record['name'] == name:
+          return record
+    return None
+
+
+  def _findRepositoryById(self, hoster, identifier):
+    with self._lock:
+      for record in self.repositories[hoster].values():
+        if str(record['id']) == identifier or record['uuid'] == identifier:
+          return record
+    return None
+
+
+  def _listRepositories(self, hoster, owner):
+    with self._lock:
+      return sorted([record for record in self.repositories[hoster].values() if record['owner'] == owner],
+        key = lambda record: record['id'])
+
+
+  def _deleteRepository(self, hoster, record):
+    with self._lock:
+      self.repositories[hoster].pop(record['id'], None)
+    shutil.rmtree(record['path'], ignore_errors=True)
+
+
+  def _updateRemoteMirror(self, record, mirror):
+    '''
+    Push a repository to a remote mirror (like GitLab does in the background)
+    '''
+    proc = subprocess.run(['git', 'push', '--mirror', mirror['url']], cwd = record['path'],
+      stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+    with self._lock:
+      mirror['last_update_at'] = time.time()
+      if proc.returncode == 0:
+        mirror['update_status'] = 'finished'
+        mirror['last_successful_update_at'] = mirror['last_update_at']
+        mirror['last_error'] = None
+      else:
+        mirror['update_status'] = 'failed'
+        mirror['last_error'] = proc.stderr.decode(errors = 'replace').strip()
+
+
+  def _getNamespaceId(self, owner):
+    with self._lock:
+      if owner not in self.namespaces:
+        self.namespaces[owner] = len(self.namespaces) + 1
+      return self.namespaces[owner]
+
+
+  def _consumeRateLimit(self, bucket, limit, period):
+    '''
+    Consume one request of the given rate limit bucket
+
+    :return: limit, remaining requests and reset time (remaining is -1 if the limit is exceeded)
+    :rtype:  Tuple[int, int, int]
+    '''
+    with self._lock:
+      now = time.time()
+      reset, used = self._rate_limits.get(bucket, (now + period, 0))
+      if now >= reset:
+        reset, used = now + period, 0
+      used += 1
+      self._rate_limits[bucket] = (reset, used)
+      return limit, limit - used, int(reset)
+
+
+class _FakeHosterHandler(BaseHTTPRequestHandler):
+
+  def log_message(self, format, *args):
+    pass # Keep the benchmark output clean
+
+
+  def do_GET(self):
+    self._dispatch('GET')
+
+
+  def do_POST(self):
+    self._dispatch('POST')
+
+
+  def do_PUT(self):
+    self._dispatch('PUT')
+
+
+  def do_PATCH(self):
+    self._dispatch('PATCH')
+
+
+  def do_DELETE(self):
+    self._dispatch('DELETE')
+
+
+  def _dispatch(self, method):
+    fake = self.server.fake
+    url = urlsplit(self.path)
+    self.route = unquote(url.path)
+    self.query = dict(parse_qsl(url.query, keep_blank_values=True))
+    self.raw_query = url.query
+    self.body = self._readBody()
+    self.response_headers = dict()
+
+    try:
+      if self.route.startswith('/git/'):
+        hoster = 'git'
+        self._handleGit(method, url.query)
+        return
+      hoster = self.route.split('/')[1]
+      if hoster not in API_VERSIONS:
+        self._sendJson(404, {'message': 'Not Found'})
+        return
+      with fake._lock:
+        fake.requests[hoster] += 1
+      if not self._checkRateLimit(hoster):
+        return
+      getattr(self, '_handle' + hoster.capitalize())(method)
+    except LookupError:
+      self._sendJson(404, {'message': 'Not Found', 'error': 'Not Found'})
+
+
+  def _readBody(self):
+    if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+      chunks = list()
+      while True:
+        size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+        if size == 0:
+          self.rfile.readline()
+          break
+        chunks.append(self.rfile.read(size))
+        self.rfile.readline()
+      return b''.join(chunks)
+    length = int(self.headers.get('Content-Length', 0))
+    return self.rfile.read(length) if length > 0 else b''
+
+
+  def _getValues(self):
+    '''
+    Get the request values (JSON or form encoded body)
+    '''
+    if len(self.body) == 0:
+      return dict()
+    if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+      return dict(parse_qsl(self.body.decode(), keep_blank_values=True))
+    try:
+      return json.loads(self.body.decode())
+    except ValueError:
+      return dict(parse_qsl(self.body.decode(), keep_blank_values=True))
+
+
+  def _checkRateLimit(self, hoster):
+    fake = self.server.fake
+    # Every credential has its own rate limit
+    credential = self.headers.get('Private-Token', self.headers.get('Authorization', ''))
+    if hoster == 'github' and self.route.startswith('/github/search/') and fake.search_rate_limit != None:
+      limit, remaining, reset = fake._consumeRateLimit('github-search:' + credential, fake.search_rate_limit, 60)
+    else:
+      limit, remaining, reset = fake._consumeRateLimit(hoster + ':' + credential, fake.rate_limit, 3600)
+
+    prefix = 'RateLimit-' if hoster == 'gitlab' else 'X-RateLimit-'
+    self.response_headers[prefix + 'Limit'] = str(limit)
+    self.response_headers[prefix + 'Remaining'] = str(max(remaining, 0))
+    self.response_headers[prefix + 'Reset'] = str(reset)
+    if remaining < 0:
+      if hoster == 'github':
+        self._sendJson(403, {'message': 'API rate limit exceeded'})
+      else:
+        self._sendJson(429, {'message': 'Rate limit exceeded', 'error': 'Rate limit exceeded'})
+      return False
+    return True
+
+
+  def _sendJson(self, status, data, headers=dict()):
+    body = json.dumps(data).encode() if data != None else b''
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    for key, value in list(self.response_headers.items()) + list(headers.items()):
+      self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(body)
+    hoster = self.route.split('/')[1]
+    with self.server.fake._lock:
+      if hoster in self.server.fake.response_bytes:
+        self.server.fake.response_bytes[hoster] += len(body)
+
+
+  def _paginate(self, items, default_size, maximum_size, size_param, page_param='page'):
+    '''
+    Get the items of the requested page
+
+    :return: items of the page, current page, number of pages
+    :rtype:  Tuple[list, int, int]
+    '''
+    size = min(int(self.query.get(size_param, default_size)), maximum_size)
+    page = max(int(self.query.get(page_param, 1)), 1)
+    pages = max((len(items) + size - 1) // size, 1)
+    return items[(page - 1) * size:page * size], page, pages
+
+
+  def _getPageUrl(self, page):
+    query = dict(self.query)
+    query['page'] = str(page)
+    return self.server.fake.url + quote(self.route) + '?' + urlencode(query)
+
+
+  def _getLinkHeader(self, page, pages):
+    links = list()
+    if page < pages:
+      links.append('<' + self._getPageUrl(page + 1) + '>; rel="next"')
+      links.append('<' + self._getPageUrl(pages) + '>; rel="last"')
+    if page > 1:
+      links.append('<' + self._getPageUrl(page - 1) + '>; rel="prev"')
+      links.append('<' + self._getPageUrl(1) + '>; rel="first"')
+    return {'Link': ', '.join(links)} if len(links) > 0 else dict()
+
+
+  def _formatTime(self, timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+  # GitHub API
+
+  def _handleGithub(self, method):
+    fake = self.server.fake
+    parts = self.route.split('/')[2:]
+
+    if method == 'GET' and len(parts) == 3 and parts[0] == 'orgs' and parts[2] == 'repos':
+      self._sendGithubList(parts[1])
+    elif method == 'GET' and parts == ['user', 'repos']:
+      self._sendGithubList(self._getGithubUser())
+    elif method == 'GET' and parts == ['search', 'repositories']:
+      self._sendGithubSearch()
+    elif method == 'POST' and parts == ['graphql']:
+      self._sendGithubGraphql()
+    elif method == 'POST' and (parts == ['user', 'repos'] or (len(parts) == 3 and parts[0] == 'orgs' and parts[2] == 'repos')):
+      owner = self._getGithubUser() if parts[0] == 'user' else parts[1]
+      values = self._getValues()
+      if fake._findRepository('github', owner, values['name']) != None:
+        self._sendJson(422, {'message': 'Repository creation failed.'})
+        return
+      record = fake.addRepository('github', owner, values['name'], 'private' if values.get('private') else 'public',
+        values.get('description'), values.get('homepage'))
+      self._sendJson(201, self._getGithubRepository(record))
+    elif len(parts) == 3 and parts[0] == 'repos':
+      record = fake._findRepository('github', parts[1], parts[2])
+      if record == None:
+        raise LookupError()
+      if method == 'GET':
+        self._sendJson(200, self._getGithubRepository(record))
+      elif method == 'PATCH':
+        values = self._getValues()
+        record['description'] = values.get('description', record['description'])
+        record['website'] = values.get('homepage', record['website'])
+        if 'private' in values:
+          record['visibility'] = 'private' if values['private'] else 'public'
+        self._sendJson(200, self._getGithubRepository(record))
+      elif method == 'DELETE':
+        fake._deleteRepository('github', record)
+        self._sendJson(204, None)
+      else:
+        self._sendJson(405, {'message': 'Method Not Allowed'})
+    else:
+      self._sendJson(404, {'message': 'Not Found'})
+
+
+  def _getGithubUser(self):
+    # The token is used as user name (see FakeHosterServer.getHosterConfig)
+    authorization = self.headers.get('Authorization', '')
+    return authorization.split(' ', 1)[-1]
+
+
+  def _sendGithubList(self, owner):
+    records = self.server.fake._listRepositories('github', owner)
+    visibility = self.query.get('type', self.query.get('visibility', 'all'))
+    if visibility in ['public', 'private']:
+      records = [record for record in records if record['visibility'] == visibility]
+    if self.query.get('sort') in ['pushed', 'updated']:
+      records.sort(key = lambda record: record['activity'], reverse = self.query.get('direction', 'desc') == 'desc')
+    items, page, pages = self._paginate(records, 30, 100, 'per_page')
+    self._sendJson(200, [self._getGithubRepository(record) for record in items], self._getLinkHeader(page, pages))
+
+
+  def _sendGithubSearch(self):
+    terms = list()
+    owner = None
+    for term in self.query.get('q', '').split():
+      if term.startswith('org:') or term.startswith('user:'):
+        owner = term.split(':', 1)[1]
+      else:
+        terms.append(term.lower())
+    records = list()
+    for record in self.server.fake._listRepositories('github', owner):
+      if all(term in record['name'].lower() for term in terms):
+        records.append(record)
+    items, page, pages = self._paginate(records, 30, 100, 'per_page')
+    data = {'total_count': len(records), 'incomplete_results': False, 'items': [self._getGithubRepository(record) for record in items]}
+    self._sendJson(200, data, self._getLinkHeader(page, pages))
+
+
+  def _sendGithubGraphql(self):
+    # Only the queries of GitHubHoster are supported
+    values = self._getValues()
+    query = values.get('query', '')
+    variables = values.get('variables') or dict()
+    if query.startswith('query ListRepositories'):
+      self._sendGithubGraphqlList(query, variables)
+      return
+    if query.startswith('query GetRepository'):
+      record = self.server.fake._findRepository('github', variables['owner'], variables['name'])
+      if record == None:
+        self._sendJson(200, {'data': {'repository': None}, 'errors': [{'type': 'NOT_FOUND', 'path': ['repository'],
+          'message': 'Could not resolve to a Repository with the name \'' + variables['name'] + '\'.'}]})
+      else:
+        self._sendJson(200, {'data': {'repository': self._getGithubGraphqlRepository(record)}})
+      return
+    data = dict()
+    pattern = r'(\w+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\)'
+    for alias, owner, name in re.findall(pattern, query):
+      record = self.server.fake._findRepository('github', json.loads(owner), json.loads(name))
+      if record == None:
+        data[alias] = None
+        continue
+      nodes = {'heads': list(), 'tags': list()}
+      output = subprocess.run(['git', 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads', 'refs/tags'],
+        cwd = record['path'], capture_output = True, text = True).stdout
+      for line in output.splitlines():
+        oid, ref = line.split(' ', 1)
+        kind = ref.split('/')[1]
+        nodes[kind].append({'name': ref.split('/', 2)[2], 'target': {'oid': oid}})
+      data[alias] = {kind: {'pageInfo': {'hasNextPage': len(nodes[kind]) > 100}, 'nodes': nodes[kind][:100]} for kind in nodes}
+    self._sendJson(200, {'data': data})
+
+
+  def _sendGithubGraphqlList(self, query, variables):
+    owner = variables.get('owner', self._getGithubUser())
+    records = self.server.fake._listRepositories('github', owner)
+    if variables.get('privacy') != None:
+      records = [record for record in records if (record['visibility'] == 'public') == (variables['privacy'] == 'PUBLIC')]
+    order = variables.get('orderBy') or dict()
+    if order.get('field') == 'PUSHED_AT':
+      records.sort(key = lambda record: record['activity'], reverse = order.get('direction') == 'DESC')
+    offset = int(variables.get('cursor') or 0)
+    nodes = [self._getGithubGraphqlRepository(record) for record in records[offset:offset + 100]]
+    connection = {'pageInfo': {'hasNextPage': offset + 100 < len(records), 'endCursor': str(offset + len(nodes))}, 'nodes': nodes}
+    key = 'viewer' if 'viewer {' in query else 'organization'
+    self._sendJson(200, {'data': {key: {'repositories': connection}}})
+
+
+  def _getGithubGraphqlRepository(self, record):
+    # The URL is the one of the git repository (the clone URL is derived from it)
+    fake = self.server.fake
+    return {
+      'databaseId': record['id'],
+      'name': record['name'],
+      'visibility': record['visibility'].upper(),
+      'description': record['description'],
+      'homepageUrl': record['website'],
+      'url': fake.getGitUrl('github', record['owner'], record['name'])[:-4],
+      'sshUrl': 'git@github.example.com:' + record['owner'] + '/' + record['name'] + '.git',
+      'pushedAt': self._formatTime(record['activity']),
+      'repositoryTopics': {'nodes': [{'topic': {'name': topic}} for topic in record['topics']]}
+    }
+
+
+  def _getGithubRepository(self, record):
+    fake = self.server.fake
+    html_url = fake.url + '/' + record['owner'] + '/' + record['name']
+    data = {
+      'id': record['id'],
+      'node_id': 'R_' + str(record['id']),
+      'name': record['name'],
+      'full_name': record['owner'] + '/' + record['name'],
+      'private': record['visibility'] != 'public',
+      'visibility': record['visibility'],
+      'owner': {'login': record['owner'], 'id': fake._getNamespaceId(record['owner']), 'type': 'Organization'},
+      'html_url': html_url,
+      'description': record['description'],
+      'homepage': record['website'],
+      'clone_url': fake.getGitUrl('github', record['owner'], record['name']),
+      'ssh_url': 'git@github.example.com:' + record['owner'] + '/' + record['name'] + '.git',
+      'pushed_at': self._formatTime(record['activity']),
+      'updated_at': self._formatTime(record['activity']),
+      'topics': record['topics'],
+      'default_branch': 'master'
+    }
+    for field in GITHUB_URL_FIELDS:
+      data[field] = fake.url + '/github/repos/' + record['owner'] + '/' + record['name'] + '/' + field[:-4] + '{/id}'
+    return data
+
+
+  # GitLab API
+
+  def _handleGitlab(self, method):
+    fake = self.server.fake
+    parts = self.route.split('/')[4:]
+
+    if method == 'GET' and len(parts) == 3 and parts[0] in ['groups', 'users'] and parts[2] == 'projects':
+      records = fake._listRepositories('gitlab', parts[1])
+      if 'visibility' in self.query:
+        records = [record for record in records if record['visibility'] == self.query['visibility']]
+      if 'search' in self.query:
+        records = [record for record in records if self.query['search'].lower() in record['name'].lower()]
+      if 'topic' in self.query:
+        topics = self.query['topic'].lower().split(',')
+        records = [record for record in records if all(topic in [t.lower() for t in record['topics']] for topic in topics)]
+      if 'last_activity_after' in self.query:
+        after = datetime.fromisoformat(self.query['last_activity_after'].replace('Z', '+00:00')).timestamp()
+        records = [record for record in records if record['activity'] > after]
+      items, page, pages = self._paginate(records, 20, 100, 'per_page')
+      headers = self._getLinkHeader(page, pages)
+      headers['X-Total'] = str(len(records))
+      headers['X-Next-Page'] = str(page + 1) if page < pages else ''
+      simple = self.query.get('simple') == 'true'
+      self._sendJson(200, [self._getGitlabProject(record, simple) for record in items], headers)
+    elif method == 'GET' and parts == ['namespaces']:
+      search = self.query.get('search', '')
+      namespaces = [{'id': namespace_id, 'name': owner, 'path': owner, 'full_path': owner, 'kind': 'group'}
+        for owner, namespace_id in sorted(fake.namespaces.items()) if search in owner]
+      self._sendJson(200, namespaces)
+    elif method == 'POST' and parts == ['projects']:
+      values = self._getValues()
+      owners = [owner for owner, namespace_id in fake.namespaces.items() if str(namespace_id) == str(values.get('namespace_id'))]
+      if len(owners) == 0:
+        self._sendJson(404, {'message': '404 Namespace Not Found'})
+        return
+      if fake._findRepository('gitlab', owners[0], values['name']) != None:
+        self._sendJson(400, {'message': {'name': ['has already been taken']}})
+        return
+      record = fake.addRepository('gitlab', owners[0], values['name'], values.get('visibility', 'private'),
+        values.get('description'))
+      self._sendJson(201, self._getGitlabProject(record))
+    elif len(parts) == 2 and parts[0] == 'projects':
+      record = fake._findRepositoryById('gitlab', parts[1])
+      if record == None:
+        raise LookupError()
+      if method == 'GET':
+        self._sendJson(200, self._getGitlabProject(record))
+      elif method == 'PUT':
+        values = self._getValues()
+        record['description'] = values.get('description', record['description'])
+        record['visibility'] = values.get('visibility', record['visibility'])
+        self._sendJson(200, self._getGitlabProject(record))
+      elif method == 'DELETE':
+        fake._deleteRepository('gitlab', record)
+        self._sendJson(202, {'message': '202 Accepted'})
+      else:
+        self._sendJson(405, {'message': '405 Method Not Allowed'})
+    elif len(parts) >= 3 and parts[0] == 'projects' and parts[2] == 'remote_mirrors':
+      record = fake._findRepositoryById('gitlab', parts[1])
+      if record == None:
+        raise LookupError()
+      self._handleGitlabRemoteMirrors(method, record, parts[3:])
+    else:
+      self._sendJson(404, {'message': '404 Not Found'})
+
+
+  def _handleGitlabRemoteMirrors(self, method, record, parts):
+    fake = self.server.fake
+    mirrors = record.setdefault('mirrors', list())
+    if method == 'GET' and len(parts) == 0:
+      self._sendJson(200, [self._getGitlabRemoteMirror(mirror) for mirror in mirrors])
+      return
+    if method == 'POST' and len(parts) == 0:
+      values = self._getValues()
+      mirror = {'id': max([m['id'] for m in mirrors] + [0]) + 1, 'url': values['url'], 'enabled': str(values.get('enabled')).lower() == 'true',
+        'update_status': 'none', 'last_update_at': None, 'last_successful_update_at': None, 'last_error': None}
+      mirrors.append(mirror)
+      self._sendJson(201, self._getGitlabRemoteMirror(mirror))
+      return
+
+    matches = [mirror for mirror in mirrors if len(parts) > 0 and str(mirror['id']) == parts[0]]
+    if len(matches) == 0:
+      raise LookupError()
+    mirror = matches[0]
+    if method == 'PUT' and len(parts) == 1:
+      values = self._getValues()
+      mirror['url'] = values.get('url', mirror['url'])
+      if 'enabled' in values:
+        mirror['enabled'] = str(values['enabled']).lower() == 'true'
+      self._sendJson(200, self._getGitlabRemoteMirror(mirror))
+    elif method == 'DELETE' and len(parts) == 1:
+      mirrors.remove(mirror)
+      self._sendJson(204, None)
+    elif method == 'POST' and parts[1:] == ['sync']:
+      if not mirror['enabled']:
+        self._sendJson(400, {'message': 'Mirror is disabled'})
+        return
+      mirror['update_status'] = 'started'
+      threading.Thread(target=fake._updateRemoteMirror, args=(record, mirror), daemon=True).start()
+      self._sendJson(204, None)
+    else:
+      self._sendJson(405, {'message': '405 Method Not Allowed'})
+
+
+  def _getGitlabRemoteMirror(self, mirror):
+    url = urlsplit(mirror['url'])
+    netloc = url.netloc.rsplit('@', 1)[-1]
+    if '@' in url.netloc:
+      netloc = '*****:*****@' + netloc
+    return {
+      'id': mirror['id'],
+      'url': url._replace(netloc = netloc).geturl(),
+      'enabled': mirror['enabled'],
+      'update_status': mirror['update_status'],
+      'last_update_at': self._formatTime(mirror['last_update_at']) if mirror['last_update_at'] != None else None,
+      'last_update_started_at': None,
+      'last_successful_update_at': self._formatTime(mirror['last_successful_update_at'])
+        if mirror['last_successful_update_at'] != None else None,
+      'last_error': mirror['last_error'],
+      'only_protected_branches': False,
+      'keep_divergent_refs': False
+    }
+
+
+  def _getGitlabProject(self, record, simple=False):
+    fake = self.server.fake
+    web_url = fake.url + '/' + record['owner'] + '/' + record['name']
+    project = {
+      'id': record['id'],
+      'name': record['name'],
+      'name_with_namespace': record['owner'] + ' / ' + record['name'],
+      'path': record['name'],
+      'path_with_namespace': record['owner'] + '/' + record['name'],
+      'description': record['description'],
+      'visibility': record['visibility'],
+      'default_branch': 'master',
+      'http_url_to_repo': fake.getGitUrl('gitlab', record['owner'], record['name']),
+      'ssh_url_to_repo': 'git@gitlab.example.com:' + record['owner'] + '/' + record['name'] + '.git',
+      'web_url': web_url,
+      'readme_url': web_url + '/-/blob/master/README.md',
+      'avatar_url': None,
+      'created_at': self._formatTime(record['activity']),
+      'last_activity_at': self._formatTime(record['activity']),
+      'topics': record['topics'],
+      'tag_list': record['topics'],
+      'namespace': {'id': fake._getNamespaceId(record['owner']), 'name': record['owner'], 'path': record['owner'],
+        'kind': 'group', 'full_path': record['owner'], 'web_url': fake.url + '/groups/' + record['owner']},
+      '_links': {key: fake.url + '/gitlab/api/v4/projects/' + str(record['id']) + '/' + key
+        for key in ['issues', 'merge_requests', 'repo_branches', 'labels', 'events', 'members']},
+      'issues_enabled': False,
+      'merge_requests_enabled': False,
+      'wiki_enabled': False,
+      'jobs_enabled': False,
+      'snippets_enabled': False,
+      'open_issues_count': 0,
+      'forks_count': 0,
+      'star_count': 0
+    }
+    if simple:
+      return {key: project[key] for key in GITLAB_SIMPLE_FIELDS}
+    return project
+
+
+  # Bitbucket API
+
+  def _handleBitbucket(self, method):
+    fake = self.server.fake
+    parts = self.route.split('/')[3:]
+
+    if len(parts) == 2 and parts[0] == 'repositories' and method == 'GET':
+      records = fake._listRepositories('bitbucket', parts[1])
+      for clause in re.split(r'\s+AND\s+', self.query.get('q', '')):
+        names = [json.loads(name) for name in re.findall(r'name\s*=\s*("(?:[^"\\]|\\.)*")', clause)]
+        if len(names) > 0:
+          records = [record for record in records if record['name'] in names]
+        elif re.match(r'^is_private\s*=\s*true$', clause.strip()):
+          records = [record for record in records if record['visibility'] != 'public']
+      if self.query.get('sort') in ['updated_on', '-updated_on']:
+        records.sort(key = lambda record: record['activity'], reverse = self.query['sort'].startswith('-'))
+      items, page, pages = self._paginate(records, 10, 100, 'pagelen')
+      data = {'pagelen': len(items), 'size': len(records), 'page': page,
+        'values': [self._getBitbucketRepository(record) for record in items]}
+      if page < pages:
+        data['next'] = self._getPageUrl(page + 1)
+      self._sendJson(200, self._selectFields(data))
+    elif len(parts) == 3 and parts[0] == 'repositories':
+      record = fake._findRepositoryById('bitbucket', parts[2])
+      if record == None:
+        for candidate in fake._listRepositories('bitbucket', parts[1]):
+          if self._getBitbucketSlug(candidate['name']) == parts[2]:
+            record = candidate
+      if method == 'POST':
+        if record != None:
+          self._sendJson(400, {'type': 'error', 'error': {'message': 'Repository already exists.'}})
+          return
+        values = self._getValues()
+        record = fake.addRepository('bitbucket', parts[1], values.get('name', parts[2]),
+          'private' if values.get('is_private') else 'public', values.get('description'), values.get('website'))
+        self._sendJson(200, self._getBitbucketRepository(record))
+      elif record == None:
+        raise LookupError()
+      elif method == 'GET':
+        self._sendJson(200, self._selectFields(self._getBitbucketRepository(record)))
+      elif method == 'PUT':
+        values = self._getValues()
+        record['description'] = values.get('description', record['description'])
+        record['website'] = values.get('website', record['website'])
+        if 'is_private' in values:
+          record['visibility'] = 'private' if values['is_private'] else 'public'
+        self._sendJson(200, self._getBitbucketRepository(record))
+      elif method == 'DELETE':
+        fake._deleteRepository('bitbucket', record)
+        self._sendJson(204, None)
+      else:
+        self._sendJson(405, {'type': 'error', 'error': {'message': 'Method Not Allowed'}})
+    else:
+      self._sendJson(404, {'type': 'error', 'error': {'message': 'Resource not found'}})
+
+
+  def _selectFields(self, data):
+    '''
+    Reduce a response to the dotted paths of the fields parameter (partial
+    responses, lists apply the path to each element)
+    '''
+    if 'fields' not in self.query:
+      return data
+    def select(value, path):
+      if isinstance(value, list):
+        return [select(item, path) for item in value]
+      if len(path) == 0 or not isinstance(value, dict) or path[0] not in value:
+        return value
+      return {path[0]: select(value[path[0]], path[1:])}
+    def merge(target, value):
+      for key, item in value.items():
+        if isinstance(target.get(key), dict) and isinstance(item, dict):
+          merge(target[key], item)
+        elif isinstance(target.get(key), list) and isinstance(item, list):
+          for existing, other in zip(target[key], item):
+            if isinstance(existing, dict) and isinstance(other, dict):
+              merge(existing, other)
+        else:
+          target[key] = item
+    result = dict()
+    for field in self.query['fields'].split(','):
+      path = field.strip().split('.')
+      if path[0] in data:
+        merge(result, select(data, path))
+    return result
+
+
+  def _getBitbucketSlug(self, name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+  def _getBitbucketRepository(self, record):
+    fake = self.server.fake
+    git_url = fake.getGitUrl('bitbucket', record['owner'], record['name'])
+    api_url = fake.url + '/bitbucket/2.0/repositories/' + record['owner'] + '/' + self._getBitbucketSlug(record['name'])
+    return {
+      'type': 'repository',
+      'uuid': record['uuid'],
+      'name': record['name'],
+      'slug': self._getBitbucketSlug(record['name']),
+      'full_name': record['owner'] + '/' + self._getBitbucketSlug(record['name']),
+      'is_private': record['visibility'] != 'public',
+      'description': record['description'],
+      'website': record['website'],
+      'scm': 'git',
+      'created_on': self._formatTime(record['activity']),
+      'updated_on': self._formatTime(record['activity']),
+      'mainbranch': {'type': 'branch', 'name': 'master'},
+      'owner': {'type': 'team', 'username': record['owner'], 'display_name': record['owner']},
+      'links': {
+        'clone': [
+          {'name': 'https', 'href': git_url.replace('://', '://mirror@', 1)},
+          {'name': 'ssh', 'href': 'git@bitbucket.example.com:' + record['owner'] + '/' + record['name'] + '.git'}
+        ],
+        'self': {'href': api_url},
+        'html': {'href': fake.url + '/' + record['owner'] + '/' + record['name']},
+        'commits': {'href': api_url + '/commits'},
+        'forks': {'href': api_url + '/forks'},
+        'watchers': {'href': api_url + '/watchers'},
+        'downloads': {'href': api_url + '/downloads'},
+        'pullrequests': {'href': api_url + '/pullrequests'}
+      },
+      'has_issues': False,
+      'has_wiki': False,
+      'fork_policy': 'allow_forks'
+    }
+
+
+  # git http-backend
+
+  def _handleGit(self, method, query):
+    fake = self.server.fake
+    path_info = self.route[len('/git'):]
+    env = {
+      'PATH': os.environ.get('PATH', ''),
+      'GIT_PROJECT_ROOT': fake.root,
+      'GIT_HTTP_EXPORT_ALL': '1',
+      'REMOTE_USER': 'mirror',
+      'REMOTE_ADDR': '127.0.0.1',
+      'PATH_INFO': path_info,
+      'QUERY_STRING': query,
+      'REQUEST_METHOD': method,
+      'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+      'CONTENT_LENGTH': str(len(self.body))
+    }
+    if 'Content-Encoding' in self.headers:
+      env['HTTP_CONTENT_ENCODING'] = self.headers['Content-Encoding']
+    if 'Git-Protocol' in self.headers:
+      env['GIT_PROTOCOL'] = self.headers['Git-Protocol']
+
+    with fake._lock:
+      fake.requests['git'] += 1
+    proc = subprocess.run(['git', 'http-backend'], input = self.body, env = env, stdout = subprocess.PIPE,
+      stderr = subprocess.DEVNULL)
+
+    header_end = proc.stdout.find(b'\r\n\r\n')
+    separator = 4
+    if header_end < 0:
+      header_end = proc.stdout.find(b'\n\n')
+      separator = 2
+    headers = proc.stdout[:header_end].decode(errors = 'replace').splitlines()
+    body = proc.stdout[header_end + separator:]
+
+    status = 200
+    response_headers = list()
+    for line in headers:
+      key, _sep, value = line.partition(':')
+      if key.lower() == 'status':
+        status = int(value.strip().split(' ')[0])
+      elif len(key) > 0:
+        response_headers.append((key, value.strip()))
+
+    if method == 'POST' and path_info.endswith('/git-receive-pack') and status == 200:
+      parts = path_info.strip('/').split('/')
+      record = fake._findRepository(parts[0], '/'.join(parts[1:-2]), parts[-2][:-len('.git')])
+      if record != None:
+        record['activity'] = time.time()
+
+    self.send_response(status)
+    for key, value in response_headers:
+      self.send_header(key, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    with fake._lock:
+      fake.response_bytes['git'] += len(body)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import random
+import threading
+import time
+from git_command import isTransportError
+
+class PushPolicy():
+
+  def __init__(self, concurrency=None, retries=2, retry_delay=5.0):
+    '''
+    Initialize the push policy of a destination hoster. The concurrency limit
+    is shared by all repositories pushed to the hoster.
+
+    :param int concurrency:   maximum number of concurrent pushes (unlimited if None)
+    :param int retries:       number of retries of a failed push
+    :param float retry_delay: delay in seconds before the first retry (doubled for every further retry)
+
+    :raises ValueError: if the given values are invalid
+    '''
+    if concurrency != None and concurrency < 1:
+      raise ValueError('Push concurrency must be at least 1')
+    if retries < 0 or retry_delay < 0:
+      raise ValueError('Push retries and retry delay must not be negative')
+    self.concurrency = concurrency
+    self.retries = retries
+    self.retry_delay = retry_delay
+    self._semaphore = None
+    if concurrency != None:
+      self._semaphore = threading.BoundedSemaphore(concurrency)
+
+
+  def run(self, destination, push, cancel=None):
+    '''
+    Run a push to the destination within the concurrency limit and retry it
+    on transport failures (see git_command.isTransportError)
+
+    :param str destination:        destination hoster name
+    :param push:                   function running the push (returns GitResult, raises GitError)
+    :param threading.Event cancel: no further attempts are made once this event is set
+
+    :return: result of the push (never raises except KeyboardInterrupt)
+    :rtype:  PushResult
+    '''
+    result = PushResult(destination)
+    start = time.time()
+    while True:
+      result.attempts += 1
+      try:
+        if self._semaphore != None:
+          with self._semaphore:
+            git_result = push()
+        else:
+          git_result = push()
+        result.bytes = git_result.bytes
+        result.error = None
+        break
+      except KeyboardInterrupt as e:
+        raise e
+      except Exception as e:
+        result.error = e
+        if not isTransportError(e):
+          break # Rejected pushes (hooks, protected branches, HTTP 4xx) fail the same way again
+      if result.attempts > self.retries:
+        break
+      if cancel != None:
+        if cancel.wait(self.getRetryDelay(result.attempts)):
+          break
+      else:
+        time.sleep(self.getRetryDelay(result.attempts))
+    result.duration = time.time() - start
+    return result
+
+
+  def getRetryDelay(self, attempt):
+    '''
+    Get the delay before the next attempt (exponential backoff with jitter)
+
+    :param int attempt: number of the failed attempt (starting at 1)
+
+    :return: delay in seconds
+    :rtype:  float
+    '''
+    delay = self.retry_delay * 2 ** (attempt - 1)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class PushResult():
+
+  def __init__(self, destination):
+    '''
+    Initialize the result of pushing a repository to one destination
+
+    :param str destination: destination hoster name
+    '''
+    self.destination = destination
+    self.bytes = 0
+    self.duration = 0.0
+    self.attempts = 0
+    self.error = None
+
+
+  def isSuccessful(self):
+    '''
+    :return: True if the push has succeeded (possibly after retries)
+    :rtype:  bool
+    '''
+    return self.error == None
+
+
+DEFAULT_PUSH_POLICY = PushPolicy()
+
+def getPushPolicy(config):
+    '''
+    Get the push policy of a hoster configuration
+
+    :param dict config: hoster configuration
+
+    :return: push policy
+    :rtype:  PushPolicy
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    if not any(key in config for key in ['push-concurrency', 'push-retries', 'push-retry-delay']):
+      return DEFAULT_PUSH_POLICY
+    concurrency = config.get('push-concurrency')
+    if concurrency != None:
+      concurrency = int(concurrency)
+    return PushPolicy(concurrency, int(config.get('push-retries', 2)), float(config.get('push-retry-delay', 5.0)))
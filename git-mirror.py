@@ -8,9 +8,16 @@
 import argparse
 import ipaddress
 import json
+import sys
 
+from bandwidth import configureBandwidth
+from git_command import configureGitRunner
 from hoster import getHosterInstance
+from repo import getCachePath
+from shard import getShard
+from state import StateStore
 from task import getTaskInstance
+from transfer import getTransferProfiles
 
 parser = argparse.ArgumentParser(prog='git-mirror.py',
           description='Mirrors repositories between GitLab, GitHub and Bitbucket w/o direct access to the GitLab Server.')
@@ -18,9 +25,24 @@ parser.add_argument('-v', '--verbose', action="store_true",
                    help='prints more output to the console')
 parser.add_argument('-c', '--config', metavar='config.json', nargs=1, type=argparse.FileType('r'),
                    default='config.json', help='path to the configuration file')
+parser.add_argument('-n', '--dry-run', action="store_true",
+                   help='prints what would be done including cost estimates without changing anything')
+parser.add_argument('--verify', action="store_true",
+                   help='compares the refs of all mirrors with the source, pushes drifted mirrors and prints a JSON report')
+parser.add_argument('--benchmark', action="store_true",
+                   help='measures the throughput of all transfer profiles against a local repository and exits')
+parser.add_argument('--profile', metavar='stacks.txt',
+                   help='samples the run and writes collapsed stacks (for flame graphs) to this file')
+parser.add_argument('--node', metavar='name',
+                   help='node name of this instance when repositories are sharded between several instances')
 parser.add_argument('--version', action='version', version='%(prog)s 1.1.0')
 args = parser.parse_args()
 
+# The JSON report of --verify is the only output on stdout, verbose output goes to stderr
+report_output = sys.stdout
+if args.verify:
+  sys.stdout = sys.stderr
+
 try:
   # Read configuration file
   if (type(args.config) is list):
@@ -31,28 +53,59 @@ try:
   if 'hoster' not in data:
     raise ValueError('Configuration file does not contain any hoster')
 
+  configureGitRunner(data.get('git', dict()), getCachePath() + '/locks')
+  configureBandwidth(data.get('git', dict()))
+  profiles = getTransferProfiles(data.get('transfer-profiles', dict()))
+
+  if args.benchmark:
+    from benchmark import benchmarkTransferProfiles, formatTransferResults
+    print(formatTransferResults(benchmarkTransferProfiles(profiles)))
+    exit(0)
+
   hoster = dict()
   for config in data['hoster']:
     if 'name' not in config:
       raise ValueError('Not all hoster in the configuration file have a name assigned')
-    hoster[config['name']] = getHosterInstance(config)
+    hoster[config['name']] = getHosterInstance(config, profiles)
     if args.verbose:
       print('Hoster ' + config['name'] + ' loaded')
 
+  state = StateStore(getCachePath() + '/state.json')
+  shard = getShard(data.get('sharding', dict()), args.node)
+
   tasks = list()
   for config in data['tasks']:
-    tasks.append(getTaskInstance(config, hoster))
+    tasks.append(getTaskInstance(config, hoster, state, profiles, shard))
     if args.verbose:
       print('Task ' + config['name'] + ' prepared')
 
 
 
+  if args.verify:
+    reports = [task.verify(args.verbose, not args.dry_run) for task in tasks]
+    print(json.dumps([report.toDict() for report in reports], indent = 2), file = report_output)
+    exit(0 if all(report.isHealthy() for report in reports) else 1)
+
+  profiler = None
+  if args.profile != None:
+    from profiler import SamplingProfiler
+    profiler = SamplingProfiler()
+    profiler.start()
+
   for task in tasks:
     # TODO: Run tasks asynchonously
+    if args.dry_run:
+      print(task.plan(args.verbose).format())
+      continue
     if args.verbose:
       print('Run task ' + task.name + '...')
     task.run(args.verbose)
     if args.verbose:
       print('-----------')
+
+  if profiler != None:
+    profiler.stop()
+    profiler.writeCollapsed(args.profile)
+    print(profiler.formatSummary())
 except KeyboardInterrupt:
   print('KeyboardInterrupt received! Mirroring stopped.')
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import fcntl
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+DEFAULT_TIMEOUTS = {
+  'clone': 3600,
+  'fetch': 3600,
+  'push': 3600,
+  'ls-remote': 120,
+  'local': 600
+}
+
+IO_CLASSES = {'best-effort': '2', 'idle': '3'}
+
+# Error output of git caused by the connection or the server (not by the repository or the request)
+TRANSPORT_ERROR_PATTERN = re.compile(r'Could not resolve host|Connection refused|Connection timed out|Connection reset|' +
+  r'Failed to connect|Operation timed out|Network is unreachable|ssh: connect to host|SSL|gnutls|' +
+  r'returned error: 5\d\d|HTTP 5\d\d|unexpected disconnect|early EOF', re.IGNORECASE)
+
+# Error output of git for rejected HTTP requests (e.g. 413 for pushes exceeding a size limit)
+CLIENT_ERROR_PATTERN = re.compile(r'returned error: 4\d\d|HTTP 4\d\d')
+
+# Seconds between the checks of the cancel event of a running git process
+CANCEL_POLL_INTERVAL = 0.5
+
+# Seconds to wait for the output of a killed git process (its children may keep the pipes open)
+KILL_WAIT = 1.0
+
+UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+PROGRESS_PATTERN = re.compile(r'(Receiving|Writing) objects:\s+\d+% \((\d+)/(\d+)\)(?:, ([\d.]+) (bytes|KiB|MiB|GiB|TiB))?')
+
+class GitError(ConnectionError):
+
+  def __init__(self, message, operation, returncode, stderr):
+    '''
+    Initialize a git error
+
+    :param str message:    error message
+    :param str operation:  git operation (clone, fetch, push, ls-remote, local)
+    :param int returncode: exit code of the git process (None if it has been killed)
+    :param str stderr:     captured error output of the git process
+    '''
+    super().__init__(message)
+    self.operation = operation
+    self.returncode = returncode
+    self.stderr = stderr
+
+
+class GitTimeoutError(GitError):
+  pass
+
+
+class GitCancelledError(GitError):
+  '''
+  Raised if a git process has been killed or not started because of GitRunner.cancel
+  '''
+  pass
+
+
+class GitResult():
+
+  def __init__(self, operation, returncode, stdout, stderr, duration):
+    '''
+    Initialize the result of a git invocation
+
+    :param str operation:  git operation (clone, fetch, push, ls-remote, local)
+    :param int returncode: exit code of the git process
+    :param str stdout:     captured output
+    :param str stderr:     captured error output (progress output with carriage returns)
+    :param float duration: duration in seconds
+    '''
+    self.operation = operation
+    self.returncode = returncode
+    self.stdout = stdout
+    self.stderr = stderr
+    self.duration = duration
+    self.objects, self.bytes = parseProgress(stderr)
+
+
+class GitRunner():
+
+  def __init__(self, timeouts=dict(), max_processes=8, lock_path='/tmp/git-mirror/locks', nice=0, io_class=None):
+    '''
+    Initialize a git runner. It runs git processes with a timeout per
+    operation and limits the number of concurrent git processes on the
+    machine (shared between all git-mirror processes using the same lock path).
+
+    :param dict timeouts:      timeout in seconds per operation (overrides the defaults)
+    :param int max_processes:  maximum number of concurrent git processes
+    :param str lock_path:      directory holding the lock files of the process slots
+    :param int nice:           CPU niceness of the git processes (0 to 19)
+    :param str io_class:       I/O scheduling class of the git processes (best-effort, idle or None)
+    '''
+    if max_processes < 1:
+      raise ValueError('Maximum number of git processes must be at least 1')
+    if nice < 0 or nice > 19:
+      raise ValueError('Niceness of git processes must be between 0 and 19')
+    if io_class != None and io_class not in IO_CLASSES:
+      raise ValueError('I/O class must be one of ' + ', '.join(IO_CLASSES))
+    self.timeouts = dict(DEFAULT_TIMEOUTS)
+    self.timeouts.update(timeouts)
+    self.max_processes = max_processes
+    self.lock_path = lock_path
+    self.nice = nice
+    self.io_class = io_class
+    self._processes = dict() # Running processes with their cancel event
+    self._lock = threading.Lock()
+
+
+  def run(self, operation, args, cwd=None, input=None, env=None, cancel=None):
+    '''
+    Run git and wait until it has finished
+
+    :param str operation: git operation (clone, fetch, push, ls-remote, local)
+    :param list args:     git arguments (without the git executable)
+    :param str cwd:       working directory
+    :param str input:     data sent to stdin
+    :param dict env:      additional environment variables
+    :param threading.Event cancel: event of a group of git processes (see cancel)
+
+    :return: result of the git process
+    :rtype:  GitResult
+
+    :raises GitTimeoutError:   if the process did not finish within the timeout of the operation
+    :raises GitCancelledError: if the process has been cancelled
+    :raises GitError:          if the process has failed
+    '''
+    if env != None:
+      env = dict(os.environ, **env)
+    timeout = self.timeouts.get(operation)
+
+    slot = self._acquireSlot(cancel)
+    if slot == None:
+      raise GitCancelledError('git ' + operation + ' cancelled', operation, None, '')
+    try:
+      start = time.time()
+      proc = subprocess.Popen(self._getPriorityCommand() + ['git'] + args, cwd = cwd, env = env, universal_newlines = True,
+        stdin = subprocess.PIPE if input != None else subprocess.DEVNULL,
+        stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+      with self._lock:
+        self._processes[proc] = cancel
+      try:
+        if cancel != None and cancel.is_set():
+          proc.kill() # Cancelled while starting
+        stdout, stderr = self._communicate(proc, input, timeout, cancel)
+      except subprocess.TimeoutExpired:
+        stdout, stderr = self._kill(proc)
+        raise GitTimeoutError('git ' + operation + ' timed out after ' + str(timeout) + ' seconds',
+          operation, None, maskCredentials(stderr))
+      except BaseException as e:
+        self._kill(proc)
+        raise e
+      finally:
+        with self._lock:
+          self._processes.pop(proc, None)
+    finally:
+      self._releaseSlot(slot)
+
+    stderr = maskCredentials(stderr)
+    if cancel != None and cancel.is_set():
+      raise GitCancelledError('git ' + operation + ' cancelled', operation, proc.returncode, stderr)
+    if proc.returncode != 0:
+      raise GitError('git ' + operation + ' failed (exit ' + str(proc.returncode) + '): ' + getErrorLine(stderr),
+        operation, proc.returncode, stderr)
+    return GitResult(operation, proc.returncode, stdout, stderr, time.time() - start)
+
+
+  def cancel(self, cancel):
+    '''
+    Kill the running git processes of a cancel event. Processes with this
+    event are not started anymore.
+
+    :param threading.Event cancel: cancel event passed to run
+    '''
+    cancel.set()
+    with self._lock:
+      processes = [proc for proc, event in self._processes.items() if event is cancel]
+    for proc in processes:
+      proc.kill()
+
+
+  def _communicate(self, proc, input, timeout, cancel):
+    '''
+    Wait for a git process like Popen.communicate. A cancelled process is not
+    waited for until its children (e.g. git-remote-https) close the pipes.
+
+    :raises subprocess.TimeoutExpired: if the process did not finish within the timeout
+    '''
+    if cancel == None:
+      return proc.communicate(input, timeout = timeout)
+    deadline = time.time() + timeout if timeout != None else None
+    while True:
+      wait = CANCEL_POLL_INTERVAL
+      if deadline != None:
+        wait = max(min(wait, deadline - time.time()), 0)
+      try:
+        return proc.communicate(input, timeout = wait)
+      except subprocess.TimeoutExpired as e:
+        if cancel.is_set():
+          return self._kill(proc)
+        if deadline != None and time.time() >= deadline:
+          raise e
+
+
+  def _kill(self, proc):
+    '''
+    Kill a git process and collect its remaining output. Children of git
+    (e.g. git-remote-https blocked on a hanging server) may keep the pipes
+    open: they are closed after KILL_WAIT seconds instead of waiting for them.
+
+    :return: stdout and stderr (empty if not available)
+    :rtype:  tuple
+    '''
+    proc.kill()
+    proc.wait()
+    try:
+      return proc.communicate(timeout = KILL_WAIT)
+    except subprocess.TimeoutExpired:
+      for pipe in [proc.stdin, proc.stdout, proc.stderr]:
+        if pipe != None:
+          pipe.close()
+      return '', ''
+
+
+  def _getPriorityCommand(self):
+    '''
+    Get the command prefix lowering the CPU and I/O priority of git
+    (nice and ionice replace themselves with git, the process id stays the same)
+
+    :rtype: list
+    '''
+    command = list()
+    if self.io_class != None and shutil.which('ionice') != None:
+      command += ['ionice', '-c', IO_CLASSES[self.io_class]]
+    if self.nice > 0 and shutil.which('nice') != None:
+      command += ['nice', '-n', str(self.nice)]
+    return command
+
+
+  def _acquireSlot(self, cancel=None):
+    '''
+    Wait for a free git process slot
+
+    :param threading.Event cancel: stop waiting once this event is set
+
+    :return: opened and locked slot file (None if cancelled)
+    '''
+    os.makedirs(self.lock_path, exist_ok=True)
+    while cancel == None or not cancel.is_set():
+      for i in range(self.max_processes):
+        slot = open(os.path.join(self.lock_path, 'slot-' + str(i) + '.lock'), 'w')
+        try:
+          fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+          return slot
+        except OSError:
+          slot.close()
+      time.sleep(0.1)
+    return None
+
+
+  def _releaseSlot(self, slot):
+    fcntl.flock(slot, fcntl.LOCK_UN)
+    slot.close()
+
+
+_runner = GitRunner()
+
+def getGitRunner():
+  '''
+  Get the git runner used for all git invocations
+
+  :rtype: GitRunner
+  '''
+  return _runner
+
+
+def configureGitRunner(config, lock_path='/tmp/git-mirror/locks'):
+  '''
+  Configure the git runner used for all git invocations
+
+  :param dict config:    git configuration (keys: timeouts, max-processes, nice, io-class)
+  :param str lock_path:  directory holding the lock files of the process slots
+
+  :raises ValueError: if the given configuration is invalid
+  '''
+  global _runner
+  timeouts = config.get('timeouts', dict())
+  if any(key not in DEFAULT_TIMEOUTS for key in timeouts):
+    raise ValueError('Timeouts can only be set for ' + ', '.join(DEFAULT_TIMEOUTS))
+  _runner = GitRunner(timeouts, int(config.get('max-processes', 8)), lock_path, int(config.get('nice', 0)),
+    config.get('io-class'))
+
+
+def parseProgress(stderr):
+  '''
+  Parse the progress output (--progress) of git fetch, clone or push
+
+  :param str stderr: captured error output
+
+  :return: number of objects and bytes transferred
+  :rtype:  Tuple[int, int]
+  '''
+  objects = 0
+  size = 0
+  if stderr == None:
+    return objects, size
+  for match in PROGRESS_PATTERN.finditer(stderr):
+    objects = int(match.group(2))
+    if match.group(4) != None:
+      size = int(float(match.group(4)) * UNITS[match.group(5)])
+  return objects, size
+
+
+def parseSize(value):
+  '''
+  Parse a size given as number (bytes) or string with a unit (e.g. "10 MiB")
+
+  :param value: size
+
+  :return: size in bytes
+  :rtype:  float
+
+  :raises ValueError: if the given value is invalid
+  '''
+  if isinstance(value, (int, float)):
+    return float(value)
+  match = re.match(r'^\s*([\d.]+)\s*(bytes|KiB|MiB|GiB|TiB)?\s*$', str(value))
+  if match == None:
+    raise ValueError('Invalid size \'' + str(value) + '\'')
+  return float(match.group(1)) * UNITS[match.group(2) or 'bytes']
+
+
+def isTransportError(error):
+  '''
+  Check if a git error has been caused by the connection to the server or the
+  server itself (timeouts, network errors, HTTP 5xx, killed processes). Rejected
+  pushes (hooks, size limits, protected branches) are no transport errors.
+
+  :param Exception error: error of a git invocation
+
+  :rtype: bool
+  '''
+  if isinstance(error, GitCancelledError) or not isinstance(error, GitError):
+    return False
+  if isinstance(error, GitTimeoutError) or error.returncode == None:
+    return True
+  if CLIENT_ERROR_PATTERN.search(error.stderr) != None:
+    return False
+  return TRANSPORT_ERROR_PATTERN.search(error.stderr) != None
+
+
+def maskCredentials(text):
+  '''
+  Remove authentication data from URLs in the given text
+
+  :param str text: text (e.g. git error output)
+
+  :return: text without authentication data
+  :rtype:  str
+  '''
+  if text == None:
+    return ''
+  return re.sub(r'://[^/@\s]+@', '://***@', text)
+
+
+def getErrorLine(text):
+  '''
+  Get the first error line of the given git output (the last non-empty line if there is none)
+  '''
+  lines = [line.strip() for line in re.split(r'[\r\n]', text) if len(line.strip()) > 0]
+  for line in lines:
+    if line.startswith('fatal:') or line.startswith('error:'):
+      return line
+  if len(lines) == 0:
+    return ''
+  return lines[-1]
@@ -4,16 +4,24 @@
 #
 # This software is licensed under GPLv3, see LICENSE for details. 
 
+from bandwidth import getBandwidthLimiters
+from circuit import getCircuitBreaker
+from credentials import getCredentialPool
+from fanout import getPushPolicy
 from hoster_base import BaseHoster
 from hoster_gitlab import GitLabHoster
 from hoster_github import GitHubHoster
 from hoster_bitbucket import BitbucketHoster
+from repo import getCachePath
+from ssh_transport import SshTransport
+from transfer import getTransferProfile
 
-def getHosterInstance(config):
+def getHosterInstance(config, profiles=dict()):
     '''
     Get an instance of git hoster
 
-    :param dict config: hoster configuration
+    :param dict config:   hoster configuration
+    :param dict profiles: available transfer profiles
 
     :return: BaseHoster object
     :rtype:  BaseHoster
@@ -34,13 +42,29 @@ def getHosterInstance(config):
       ignored_repositories = list()
 
     if config['type'] == 'github':
-      return GitHubHoster(config['name'], config['user'], config['password'], config['api-version'], organization, ignored_repositories)
+      hoster = GitHubHoster(config['name'], config['user'], config['password'], config['api-version'], organization, ignored_repositories)
     elif config['type'] == 'gitlab':
       if 'domain' not in config:
         raise ValueError('Property \'domain\' required for hoster \'gitlab\'')
-      return GitLabHoster(config['name'], config['user'], config['password'], config['api-version'], \
+      hoster = GitLabHoster(config['name'], config['user'], config['password'], config['api-version'], \
         config['domain'], organization, ignored_repositories)
     elif config['type'] == 'bitbucket':
-      return BitbucketHoster(config['name'], config['user'], config['password'], config['api-version'], organization, ignored_repositories)
+      hoster = BitbucketHoster(config['name'], config['user'], config['password'], config['api-version'], organization, ignored_repositories)
     else:
       raise ValueError('Unknown hoster \'' + config['type'] + '\'')
+
+    if 'api-url' in config:
+      hoster.api_url = config['api-url'].rstrip('/')
+    hoster.transfer_profile = getTransferProfile(config, profiles)
+    hoster.push_policy = getPushPolicy(config)
+    hoster.credentials = getCredentialPool(config)
+    hoster.bandwidth_limiters = getBandwidthLimiters(config)
+    hoster.circuit_breaker = getCircuitBreaker(config['name'], config)
+    hoster.git_circuit_breaker = getCircuitBreaker(config['name'] + ' (git)', config, latency = False)
+
+    if 'transport' in config and config['transport'] not in ['https', 'ssh']:
+      raise ValueError('Transport \'' + config['transport'] + '\' is not supported')
+    if config.get('transport') == 'ssh':
+      hoster.ssh_transport = SshTransport(getCachePath() + '/ssh', int(config.get('ssh-control-persist', 600)),
+        config.get('ssh-key'), config.get('ssh-host-key-checking', 'accept-new'))
+    return hoster
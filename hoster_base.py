@@ -5,6 +5,18 @@
 # This software is licensed under GPLv3, see LICENSE for details. 
 
 from abc import ABC, abstractmethod
+from credentials import Credential, CredentialPool
+from matcher import getRepositoryMatcher
+from datetime import datetime, timezone
+import re
+import requests
+import time
+
+# Seconds until an API request is aborted if the hoster has no circuit-latency
+REQUEST_TIMEOUT = 60
+
+# Multiple of circuit-latency until an API request is aborted (slower responses count as failures anyway)
+REQUEST_TIMEOUT_FACTOR = 2
 
 class BaseHoster(ABC):
 
@@ -17,24 +29,40 @@ class BaseHoster(ABC):
     :param str user:                 Username for the git service
     :param str password:             Password for the git service (in plain text)
     :param str organization:         Organization name used for syncing
-    :param str ignored_repositories: List of repository names to be ignored
+    :param list ignored_repositories: Rules of the repositories to be ignored (see RepositoryMatcher)
     '''
     self.name = name
     self.user = user
     self.password = password
     self.organization = organization
-    self.ignored_repositories = ignored_repositories
+    self.ignored_repositories = getRepositoryMatcher(ignored_repositories)
+    self.credentials = CredentialPool([Credential(user, password)])
+    self.api_calls = 0
+    self.api_time = 0.0
+    self.transfer_profile = None
+    self.ssh_transport = None
+    self.push_policy = None
+    self.circuit_breaker = None
+    self.git_circuit_breaker = None
+    self.bandwidth_limiters = dict()
+    self.api_url = None
+    # Seconds within which further changes may not move the activity timestamp of a repository forward
+    self.activity_granularity = 0
 
 
   @abstractmethod
-  def getRepositoryList(self, visibility):
+  def getRepositoryList(self, visibility, changed_since=None, include=None):
     '''
     Get all repositories of the given type
 
-    :param str visibility: requested repository type (public, internal, private, all)
+    :param str visibility:        requested repository type (public, internal, private, all)
+    :param float changed_since:   only list repositories with activity since this UNIX timestamp
+                                  (the result may contain some older repositories as well)
+    :param RepositoryMatcher include: only list the matching repositories where the API can filter them
+                                  (the result may contain other repositories as well)
 
-    :return: returns a list of RemoteRepository objects
-    :rtype:  list
+    :return: returns the RemoteRepository objects indexed by name
+    :rtype:  RepositoryList
 
     :raises PermissionError:     if the access is denied by the server
     :raises ConnectionError:     if another HTTP error has occurred
@@ -44,6 +72,110 @@ class BaseHoster(ABC):
     pass
 
 
+  def isAvailable(self):
+    '''
+    Check if the API and git calls of this hoster are let through by its
+    circuit breakers (open breakers fail fast until a probe is due)
+
+    :rtype: bool
+    '''
+    return all(breaker == None or breaker.isAvailable() for breaker in [self.circuit_breaker, self.git_circuit_breaker])
+
+
+  def getRefStates(self, repositories):
+    '''
+    Get the branch and tag tips of several repositories with batched API
+    requests (without any git network traffic). Hosters without such an API
+    return an empty dictionary.
+
+    :param list repositories: RemoteRepository objects of this hoster
+
+    :return: dictionary with the repository name as key and a dictionary (ref name -> hash) as value.
+             Repositories whose refs could not be determined completely are missing.
+    :rtype:  dict
+
+    :raises PermissionError: if the access is denied by the server
+    :raises ConnectionError: if another HTTP error has occurred
+    '''
+    return dict()
+
+
+  def getRemoteMirrors(self, repo):
+    '''
+    Get the push mirrors the hoster updates on its own for a repository
+
+    :param RemoteRepository repo: repository of this hoster
+
+    :return: list of RemoteMirror objects
+    :rtype:  list
+
+    :raises PermissionError:     if the access is denied by the server
+    :raises ConnectionError:     if another HTTP error has occurred
+    :raises NotImplementedError: if the hoster does not support push mirrors
+    '''
+    raise NotImplementedError('Hoster \'' + self.name + '\' does not support remote mirrors')
+
+
+  def createRemoteMirror(self, repo, git_url):
+    '''
+    Create an enabled push mirror for a repository
+
+    :param RemoteRepository repo: repository of this hoster
+    :param str git_url:           git URL of the mirror including authentication data
+
+    :return: created mirror
+    :rtype:  RemoteMirror
+
+    :raises PermissionError:     if the access is denied by the server
+    :raises ConnectionError:     if another HTTP error has occurred
+    :raises NotImplementedError: if the hoster does not support push mirrors
+    '''
+    raise NotImplementedError('Hoster \'' + self.name + '\' does not support remote mirrors')
+
+
+  def updateRemoteMirror(self, repo, mirror, git_url=None):
+    '''
+    Enable a push mirror of a repository (and update its URL)
+
+    :param RemoteRepository repo: repository of this hoster
+    :param RemoteMirror mirror:   mirror to be updated
+    :param str git_url:           git URL of the mirror including authentication data (unchanged if None)
+
+    :raises PermissionError:     if the access is denied by the server
+    :raises ConnectionError:     if another HTTP error has occurred
+    :raises NotImplementedError: if the hoster does not support push mirrors
+    '''
+    raise NotImplementedError('Hoster \'' + self.name + '\' does not support remote mirrors')
+
+
+  def deleteRemoteMirror(self, repo, mirror):
+    '''
+    Delete a push mirror of a repository
+
+    :param RemoteRepository repo: repository of this hoster
+    :param RemoteMirror mirror:   mirror to be deleted
+
+    :raises PermissionError:     if the access is denied by the server
+    :raises ConnectionError:     if another HTTP error has occurred
+    :raises NotImplementedError: if the hoster does not support push mirrors
+    '''
+    raise NotImplementedError('Hoster \'' + self.name + '\' does not support remote mirrors')
+
+
+  def syncRemoteMirror(self, repo, mirror):
+    '''
+    Trigger an update of a push mirror (the hoster pushes asynchronously)
+
+    :param RemoteRepository repo: repository of this hoster
+    :param RemoteMirror mirror:   mirror to be updated
+
+    :raises PermissionError:     if the access is denied by the server
+    :raises ConnectionError:     if another HTTP error has occurred (e.g. too many updates)
+    :raises NotImplementedError: if the hoster does not support push mirrors
+    '''
+    raise NotImplementedError('Hoster \'' + self.name + '\' does not support remote mirrors')
+
+
   @abstractmethod
   def getRepository(self, name):
     '''
@@ -113,6 +245,121 @@ class BaseHoster(ABC):
     pass
 
 
+  def _request(self, method, url, **kwargs):
+    '''
+    Send a request to the hoster API. All API calls go through this method
+    so that the number of calls and the time spent waiting is tracked. The
+    request is authenticated with the credential of the pool with the most
+    remaining requests and repeated with another credential if it has been
+    rejected because of the rate limit. Without an organization, the hoster
+    works on the user namespace of its own account (e.g. GitHub 'viewer',
+    '/user/repos' and private repositories visible to the owner only), so
+    the request is always authenticated with user/password of the hoster.
+    The circuit breaker of this hoster is checked before a credential is
+    taken from the pool. Connection errors, timeouts, server errors and slow
+    responses are recorded as failures; requests are aborted after
+    REQUEST_TIMEOUT_FACTOR times circuit-latency (REQUEST_TIMEOUT without).
+
+    :param str method: HTTP method (get, post, put, patch, delete)
+    :param str url:    request URL
+    :param kwargs:     arguments passed to requests.request (without authentication)
+
+    :return: response object
+    :rtype:  requests.Response
+
+    :raises CircuitOpenError: if the circuit breaker of this hoster is open
+    '''
+    timeout = REQUEST_TIMEOUT
+    if self.circuit_breaker != None and self.circuit_breaker.latency != None:
+      timeout = self.circuit_breaker.latency * REQUEST_TIMEOUT_FACTOR
+    attempts = 0
+    while True:
+      if self.circuit_breaker != None:
+        self.circuit_breaker.acquire()
+      credential = self.credentials.acquire(primary = self.organization == None)
+      request_args = dict(kwargs)
+      request_args.setdefault('timeout', timeout)
+      for key, value in self._getAuthentication(credential).items():
+        if key == 'headers':
+          value = dict(request_args.get('headers') or dict(), **value)
+        request_args[key] = value
+      start = time.time()
+      try:
+        response = requests.request(method, url, **request_args)
+      except requests.exceptions.RequestException as e:
+        # Includes requests.exceptions.Timeout
+        if self.circuit_breaker != None:
+          self.circuit_breaker.recordFailure()
+        raise e
+      finally:
+        self.api_calls += 1
+        self.api_time += time.time() - start
+      if self.circuit_breaker != None:
+        if response.status_code >= 500:
+          self.circuit_breaker.recordFailure()
+        else:
+          self.circuit_breaker.recordSuccess(time.time() - start)
+      attempts += 1
+      if not self.credentials.update(credential, response) or attempts >= len(self.credentials):
+        return response
+
+
+  def _getAuthentication(self, credential):
+    '''
+    Get the arguments authenticating a request with the given credential
+
+    :param Credential credential: credential
+
+    :return: arguments passed to requests.request (e.g. headers or auth)
+    :rtype:  dict
+    '''
+    return dict()
+
+
+  def _parseLinkResponseHeader(self, response):
+    '''
+    Parses the Link header and returns the link for the next resource if available
+
+    :param object response: request response object
+
+    :return: returns the link for the next page
+    :rtype:  str
+    '''
+    if 'Link' not in response.headers:
+      return None
+    links = response.headers['Link'].split(',')
+    for link in links:
+      partials = link.strip().split('; ', 2)
+      if (len(partials) == 2 and partials[1] == 'rel="next"'):
+        return partials[0][1:-1]
+    return None
+
+
+  def _parseTimestamp(self, value):
+    '''
+    Parse an ISO 8601 timestamp as returned by the hoster APIs
+
+    :param str value: timestamp (e.g. 2018-01-01T12:00:00.000Z)
+
+    :return: UNIX timestamp (None if the value is missing or invalid)
+    :rtype:  float
+    '''
+    if value == None:
+      return None
+    match = re.match(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$', value)
+    if match == None:
+      return None
+    timestamp = datetime(*[int(match.group(i)) for i in range(1, 7)], tzinfo=timezone.utc).timestamp()
+    if match.group(7) != None:
+      timestamp += float(match.group(7))
+    offset = match.group(8)
+    if offset != None and offset != 'Z':
+      offset = offset.replace(':', '')
+      seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+      timestamp += -seconds if offset[0] == '+' else seconds
+    return timestamp
+
+
   def _raisePermissionError(self, response):
     json_response = response.json()
     message = 'HTTP ERROR ' + str(response.status_code)
@@ -131,3 +378,47 @@ class BaseHoster(ABC):
     else:
       message += ': ' + response.text
     raise ConnectionError(message)
+
+
+  def _formatTimestamp(self, timestamp):
+    '''
+    Format a UNIX timestamp as ISO 8601 timestamp for the hoster APIs
+
+    :param float timestamp: UNIX timestamp
+
+    :return: timestamp (e.g. 2018-01-01T12:00:00Z)
+    :rtype:  str
+    '''
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+  def _isPastChanges(self, repositories, changed_since):
+    '''
+    Check if a page of repositories sorted by activity (most recent first)
+    reaches the repositories without activity since the given time. The
+    following pages do not need to be requested then.
+
+    :param list repositories:   repositories of the page
+    :param float changed_since: UNIX timestamp (None for a full listing)
+
+    :rtype: bool
+    '''
+    if changed_since == None or len(repositories) == 0:
+      return False
+    return repositories[-1].last_activity != None and repositories[-1].last_activity < changed_since
+
+
+  def _filterChanged(self, repositories, changed_since):
+    '''
+    Filter repositories to the ones with activity since the given time
+
+    :param RepositoryList repositories: repositories
+    :param float changed_since:         UNIX timestamp (None for a full listing)
+
+    :return: filtered repositories
+    :rtype:  RepositoryList
+    '''
+    if changed_since == None:
+      return repositories
+    return type(repositories)(repo for repo in repositories
+      if repo.last_activity == None or repo.last_activity >= changed_since)
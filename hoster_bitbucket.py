@@ -5,13 +5,19 @@
 # This software is licensed under GPLv3, see LICENSE for details. 
 
 from hoster_base import BaseHoster
-from remote_repo import RemoteRepository
+from remote_repo import RemoteRepository, RepositoryList, removeUrlCredentials
 import validators
-import requests
 import json
 from urllib.parse import urlencode
 from slugify import slugify
 
+# Maximum number of repository names filtered in the query of getRepositoryList (URL length)
+BITBUCKET_QUERY_NAMES = 50
+
+# Partial responses of the repository listings with only the fields read by _parseProjectResponse
+BITBUCKET_LIST_FIELDS = ','.join(['next'] + ['values.' + field for field in
+  ['uuid', 'name', 'is_private', 'description', 'website', 'updated_on', 'links.clone', 'links.self']])
+
 class BitbucketHoster(BaseHoster):
 
   def __init__(self, name, user, access_token, api_version, team=None, ignored_repositories=None):
@@ -23,7 +29,7 @@ class BitbucketHoster(BaseHoster):
     :param str access_token:         Personal access token for the user
     :param int api_version:          API version
     :param str team:                 Team name used for syncing
-    :param str ignored_repositories: List of repository names to be ignored
+    :param list ignored_repositories: Rules of the repositories to be ignored (see RepositoryMatcher)
     :raises ValueError:              If the given parameters are invalid
     '''
     super().__init__(name, user, access_token, team, ignored_repositories)
@@ -31,14 +37,21 @@ class BitbucketHoster(BaseHoster):
     if api_version not in [2]:
       raise ValueError('Bitbucket API v' + str(api_version) + ' is not supported')
     self.api_version = api_version
+    self.api_url = 'https://api.bitbucket.org'
 
 
-  def getRepositoryList(self, visibility):
+  def getRepositoryList(self, visibility, changed_since=None, include=None):
     self._checkVisibility(visibility)
 
-    param = dict()
-    if visibility in ['internal' 'private']:
-      param['q'] = 'is_private = true'
+    param = {'fields': BITBUCKET_LIST_FIELDS}
+    query = list()
+    if visibility in ['internal', 'private']:
+      query.append('is_private = true')
+    if include != None and include.isNameOnly() and len(include.names) <= BITBUCKET_QUERY_NAMES:
+      # BBQL strings take escaped quotes but no \u escapes
+      query.append('(' + ' OR '.join('name = ' + json.dumps(name, ensure_ascii = False) for name in sorted(include.names)) + ')')
+    if len(query) > 0:
+      param['q'] = ' AND '.join(query)
 
     if self.api_version == 2:
       if self.organization != None:
@@ -48,15 +61,21 @@ class BitbucketHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.get(url, params = param, auth = self._getBasicAuthentication())
-    repo_list = self._parseRepositoryListResponse(response)
-    next_link = response.json()['next']
+    if changed_since != None:
+      # Most recently updated first: stop paginating at the first unchanged repository
+      param['sort'] = '-updated_on'
+
+    response = self._request('get', url, params = param)
+    page = self._parseRepositoryListResponse(response)
+    repo_list = RepositoryList(page)
+    next_link = response.json().get('next')
 
-    while (next_link):
-      response = requests.get(next_link, auth = self._getBasicAuthentication())
-      repo_list += self._parseRepositoryListResponse(response)
-      next_link = response.json()['next']
-    return repo_list
+    while (next_link and not self._isPastChanges(page, changed_since)):
+      response = self._request('get', next_link)
+      page = self._parseRepositoryListResponse(response)
+      repo_list += page
+      next_link = response.json().get('next')
+    return self._filterChanged(repo_list, changed_since)
 
 
   def getRepository(self, name):
@@ -64,7 +83,7 @@ class BitbucketHoster(BaseHoster):
       raise LookupError('Repository \'' + name + '\' not found')
 
     if self.api_version == 2:
-      param = {'q': 'name="%(name)s"' % {'name': name}}
+      param = {'q': 'name = ' + json.dumps(name, ensure_ascii = False), 'fields': BITBUCKET_LIST_FIELDS}
 
       if self.organization != None:
         url = self._getAPIUrl('/2.0/repositories/%(team)s', {'team': self.organization})
@@ -73,12 +92,15 @@ class BitbucketHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.get(url, params = param, auth = self._getBasicAuthentication())
+    response = self._request('get', url, params = param)
 
     if response.status_code in [200, 201, 202]:
       for repo in response.json()['values']:
         if repo['name'] == name:
-          return self._parseProjectResponse(repo)
+          remote = self._parseProjectResponse(repo)
+          if self.ignored_repositories.matches(remote):
+            break # Topic or visibility rule
+          return remote
       raise LookupError('Repository \'' + name + '\' not found')
     elif response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -87,8 +109,8 @@ class BitbucketHoster(BaseHoster):
 
 
   def createRepository(self, name, visibility, description=None, website=None):
-    if name in self.ignored_repositories:
-      raise PermissionError('Repository name \'' + name + '\' is in ignored-list of this hoster')
+    if name in self.ignored_repositories or visibility in self.ignored_repositories.visibilities:
+      raise PermissionError('Repository \'' + name + '\' is in ignored-list of this hoster')
 
     if self.api_version == 2:
 
@@ -113,7 +135,7 @@ class BitbucketHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.post(url, json = values, auth = self._getBasicAuthentication(), headers = {'Content-Type': 'application/json'})
+    response = self._request('post', url, json = values, headers = {'Content-Type': 'application/json'})
 
     if response.status_code in [200, 201, 202]:
       return self._parseProjectResponse(response.json())
@@ -147,7 +169,7 @@ class BitbucketHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.put(url, json = values, auth = self._getBasicAuthentication(), headers = {'Content-Type': 'application/json'})
+    response = self._request('put', url, json = values, headers = {'Content-Type': 'application/json'})
 
     if response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -158,13 +180,13 @@ class BitbucketHoster(BaseHoster):
   def deleteRepository(self, repo):
     if self.api_version == 2:
       if self.organization != None:
-        url = self._getAPIUrl('/2.0/repositories/%(team)s/%(slug)s', {'team': self.organization, 'id': repp.id})
+        url = self._getAPIUrl('/2.0/repositories/%(team)s/%(id)s', {'team': self.organization, 'id': repo.id})
       else:
-        url = self._getAPIUrl('/2.0/repositories/%(user)s/%(slug)s', {'user': self.user, 'id': repo.id})
+        url = self._getAPIUrl('/2.0/repositories/%(user)s/%(id)s', {'user': self.user, 'id': repo.id})
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.delete(url, auth = self._getBasicAuthentication())
+    response = self._request('delete', url)
 
     if response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -183,12 +205,16 @@ class BitbucketHoster(BaseHoster):
     else:
       visibility = 'public'
     
+    ssh_url_to_repo = None
     for link in response['links']['clone']:
       if link['name'] == 'https':
-        http_url_to_repo = 'https://' + link['href'].split('@', 2)[1]
+        http_url_to_repo = removeUrlCredentials(link['href'])
+      elif link['name'] == 'ssh':
+        ssh_url_to_repo = link['href']
 
     return RemoteRepository(response['uuid'], response['name'], visibility, response['description'], response['website'], 
-      http_url_to_repo, response['links']['self']['href'], self.name, self.user, self.password)
+      http_url_to_repo, response['links']['self']['href'], self,
+      self._parseTimestamp(response.get('updated_on')), ssh_url_to_repo)
 
 
   def _getAPIUrl(self, path, parameters=dict()):
@@ -200,13 +226,13 @@ class BitbucketHoster(BaseHoster):
     :return: Complete API URL
     :rtype:  str
     '''
-    url = 'https://api.bitbucket.org'
+    url = self.api_url
     url += path % parameters
     return url
 
 
-  def _getBasicAuthentication(self):
-    return (self.user, self.password)
+  def _getAuthentication(self, credential):
+    return {'auth': (credential.user, credential.password)}
 
 
   def _parseRepositoryListResponse(self, response):
@@ -225,8 +251,9 @@ class BitbucketHoster(BaseHoster):
       repo_list = list()
       values = response.json()['values']
       for repo in values:
-        if (repo['name'] not in self.ignored_repositories):
-          repo_list.append(self._parseProjectResponse(repo))
+        remote = self._parseProjectResponse(repo)
+        if not self.ignored_repositories.matches(remote):
+          repo_list.append(remote)
       return repo_list
     elif response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -5,11 +5,28 @@
 # This software is licensed under GPLv3, see LICENSE for details. 
 
 from hoster_base import BaseHoster
-from remote_repo import RemoteRepository
+from remote_repo import RemoteRepository, RepositoryList
 import json
-import requests
 from urllib.parse import urlencode
 
+# Repositories per GraphQL query of getRefStates
+GRAPHQL_BATCH_SIZE = 50
+
+GRAPHQL_REFS = '%(alias)s: repository(owner: %(owner)s, name: %(name)s) { ' + \
+  'heads: refs(refPrefix: "refs/heads/", first: 100) { pageInfo { hasNextPage } nodes { name target { oid } } } ' + \
+  'tags: refs(refPrefix: "refs/tags/", first: 100) { pageInfo { hasNextPage } nodes { name target { oid } } } }'
+
+# Only the fields read by _parseGraphqlRepository
+GRAPHQL_REPOSITORY_FIELDS = 'databaseId name visibility description homepageUrl url sshUrl pushedAt ' + \
+  'repositoryTopics(first: 20) { nodes { topic { name } } }'
+
+GRAPHQL_LIST_REPOSITORIES = 'query ListRepositories(%(params)s$cursor: String, $privacy: RepositoryPrivacy, ' + \
+  '$orderBy: RepositoryOrder) { %(owner)s { repositories(first: 100, after: $cursor, privacy: $privacy, orderBy: $orderBy%(filter)s) { ' + \
+  'pageInfo { hasNextPage endCursor } nodes { ' + GRAPHQL_REPOSITORY_FIELDS + ' } } } }'
+
+GRAPHQL_GET_REPOSITORY = 'query GetRepository($owner: String!, $name: String!) { ' + \
+  'repository(owner: $owner, name: $name) { ' + GRAPHQL_REPOSITORY_FIELDS + ' } }'
+
 class GitHubHoster(BaseHoster):
 
   def __init__(self, name, user, password, api_version, organization=None, ignored_repositories=list()):
@@ -21,7 +38,7 @@ class GitHubHoster(BaseHoster):
     :param str password:             Password for the git service (in plain text)
     :param int api_version:          API version
     :param str organization:         Organization name used for syncing
-    :param str ignored_repositories: List of repository names to be ignored
+    :param list ignored_repositories: Rules of the repositories to be ignored (see RepositoryMatcher)
     :raises ValueError:              If the given parameters are invalid
     '''
     super().__init__(name, user, password, organization, ignored_repositories)
@@ -29,71 +46,93 @@ class GitHubHoster(BaseHoster):
     if api_version not in [3]:
       raise ValueError('GitHub API v' + str(api_version) + ' is not supported')
     self.api_version = api_version
+    self.api_url = 'https://api.github.com'
 
 
-  def getRepositoryList(self, visibility):
+  def getRepositoryList(self, visibility, changed_since=None, include=None):
+    # GraphQL returns only the fields needed instead of the full REST representation
     self._checkVisibility(visibility)
 
-    param = dict()
-    if visibility in ['public', 'internal' 'private']:
-      if visibility == 'internal':
-        visibility = 'private'
-      param['visibility'] = visibility
-
-    if self.api_version == 3:
-      if self.organization != None:
-        url = self._getAPIUrl('/orgs/%(org)s/repos', {'org': self.organization})
-        param = {'type': visibility}
-      else:
-        param['affiliation'] = 'owner'
-        url = self._getAPIUrl('/user/%(user)/repos', {'user': self.user})
-    else:
+    if self.api_version != 3:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
-    
-    response = requests.get(url, params = param, headers = self._getAuthenticationHeader())
 
-    repo_list = self._parseRepositoryListResponse(response)
-    next_link = self._parseLinkResponseHeader(response)
-
-    while (next_link):
-      response = requests.get(next_link, headers = self._getAuthenticationHeader())
-      repo_list += self._parseRepositoryListResponse(response)
-      next_link = self._parseLinkResponseHeader(response)
-    return repo_list
+    variables = dict()
+    if visibility == 'public':
+      variables['privacy'] = 'PUBLIC'
+    elif visibility in ['internal', 'private']:
+      variables['privacy'] = 'PRIVATE'
+    if changed_since != None:
+      # Most recently pushed first: stop paginating at the first unchanged repository
+      variables['orderBy'] = {'field': 'PUSHED_AT', 'direction': 'DESC'}
+    if self.organization != None:
+      query = GRAPHQL_LIST_REPOSITORIES % {'params': '$owner: String!, ', 'owner': 'organization(login: $owner)', 'filter': ''}
+      variables['owner'] = self.organization
+    else:
+      query = GRAPHQL_LIST_REPOSITORIES % {'params': '', 'owner': 'viewer', 'filter': ', ownerAffiliations: [OWNER]'}
+
+    repo_list = RepositoryList()
+    while True:
+      data = self._requestGraphql(query, variables)
+      connection = (data.get('organization') if self.organization != None else data.get('viewer')) or dict()
+      if 'repositories' not in connection:
+        raise ConnectionError('GraphQL ERROR: Owner \'' + str(self.organization or self.user) + '\' not found')
+      page = list()
+      for node in connection['repositories']['nodes']:
+        remote = self._parseGraphqlRepository(node)
+        if not self.ignored_repositories.matches(remote):
+          page.append(remote)
+      repo_list += page
+      page_info = connection['repositories']['pageInfo']
+      if not page_info['hasNextPage'] or self._isPastChanges(page, changed_since):
+        break
+      variables['cursor'] = page_info['endCursor']
+    return self._filterChanged(repo_list, changed_since)
 
 
   def getRepository(self, name):
     if name in self.ignored_repositories:
       raise LookupError('Repository \'' + name + '\' not found')
 
-    if self.api_version == 3:
-      if self.organization != None:
-        param = {'name': name, 'org': self.organization}
-        url = self._getAPIUrl('/search/repositories?q=%(name)s+org:%(org)s', param)
-      else:
-        param = {'name': name, 'user': self.user}
-        url = self._getAPIUrl('/search/repositories?q=%(name)s+user:%(user)s', param)
-    else:
+    if self.api_version != 3:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.get(url, headers = self._getAuthenticationHeader())
-
-    if response.status_code in [200, 201, 202]:
-      json_response = response.json()
-      if 'items' in json_response:
-        for repo in json_response['items']:
-          if repo['name'] == name:
-            return self._parseProjectResponse(repo)
+    owner = self.organization if self.organization != None else self.user
+    data = self._requestGraphql(GRAPHQL_GET_REPOSITORY, {'owner': owner, 'name': name}, True)
+    if data.get('repository') == None:
       raise LookupError('Repository not found')
-    elif response.status_code in [401, 403]:
-      self._raisePermissionError(response)
-    else:
-      self._raiseConnectionError(response)
+    remote = self._parseGraphqlRepository(data['repository'])
+    if self.ignored_repositories.matches(remote):
+      raise LookupError('Repository \'' + name + '\' not found')
+    return remote
+
+
+  def getRefStates(self, repositories):
+    # One GraphQL query (with an alias per repository) for a batch of repositories
+    states = dict()
+    owner = self.organization if self.organization != None else self.user
+    repositories = list(repositories)
+    for offset in range(0, len(repositories), GRAPHQL_BATCH_SIZE):
+      batch = repositories[offset:offset + GRAPHQL_BATCH_SIZE]
+      fields = [GRAPHQL_REFS % {'alias': 'r' + str(i), 'owner': json.dumps(owner), 'name': json.dumps(repo.name)}
+        for i, repo in enumerate(batch)]
+      query = {'query': 'query { ' + ' '.join(fields) + ' }'}
+      response = self._request('post', self._getAPIUrl('/graphql'), data = json.dumps(query))
+
+      if response.status_code in [401, 403]:
+        self._raisePermissionError(response)
+      elif response.status_code not in [200, 201, 202]:
+        self._raiseConnectionError(response)
+      data = response.json().get('data') or dict()
+      for i, repo in enumerate(batch):
+        refs = self._parseRefStateResponse(data.get('r' + str(i)))
+        if refs != None:
+          states[repo.name] = refs
+    return states
 
 
   def createRepository(self, name, visibility, description=None, website=None):
-    if name in self.ignored_repositories:
-      raise PermissionError('Repository name \'' + name + '\' is in ignored-list of this hoster')
+    if name in self.ignored_repositories or visibility in self.ignored_repositories.visibilities:
+      raise PermissionError('Repository \'' + name + '\' is in ignored-list of this hoster')
 
     if self.api_version == 3:
       if self.organization != None:
@@ -118,7 +157,7 @@ class GitHubHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.post(url, data = json.dumps(values), headers = self._getAuthenticationHeader())
+    response = self._request('post', url, data = json.dumps(values))
 
     if response.status_code in [200, 201, 202]:
       return self._parseProjectResponse(response.json())
@@ -152,7 +191,7 @@ class GitHubHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.patch(url, data = json.dumps(values), headers = self._getAuthenticationHeader())
+    response = self._request('patch', url, data = json.dumps(values))
 
     if response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -169,7 +208,7 @@ class GitHubHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.delete(url, headers = self._getAuthenticationHeader())
+    response = self._request('delete', url)
 
     if response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -189,7 +228,8 @@ class GitHubHoster(BaseHoster):
       visibility = 'public'
 
     return RemoteRepository(response['id'], response['name'], visibility, response['description'], 
-      response['homepage'], response['clone_url'], response['html_url'], self.name, self.user, self.password)
+      response['homepage'], response['clone_url'], response['html_url'], self,
+      self._parseTimestamp(response.get('pushed_at')), response.get('ssh_url'), response.get('topics'))
 
 
   def _getAPIUrl(self, path, parameters=dict()):
@@ -201,54 +241,79 @@ class GitHubHoster(BaseHoster):
     :return: Complete API URL
     :rtype:  str
     '''
-    url = 'https://api.github.com'
+    url = self.api_url
     url += path % parameters
     return url
 
 
-  def _getAuthenticationHeader(self):
-    return {
+  def _getAuthentication(self, credential):
+    return {'headers': {
       'Accept': 'application/vnd.github.v' + str(self.api_version) + '.text+json',
-      'Authorization': 'token ' + self.password
-    }
+      'Authorization': 'token ' + credential.password
+    }}
 
 
-  def _parseLinkResponseHeader(self, response):
+  def _requestGraphql(self, query, variables=dict(), allow_missing=False):
     '''
-    Parses the Link header and returns the link for the next resource if available
+    Send a GraphQL query
 
-    :param object response: request response object
+    :param str query:          GraphQL query
+    :param dict variables:     query variables
+    :param bool allow_missing: whether NOT_FOUND errors are returned as missing data instead of raised
 
-    :return: returns the link for the next page
-    :rtype:  str
+    :return: data of the response
+    :rtype:  dict
+
+    :raises PermissionError: if the access is denied by the server
+    :raises ConnectionError: if another HTTP or GraphQL error has occurred
     '''
-    links = response.headers['Link'].split(',')
-    for link in links:
-      partials = link.split('; ', 2)
-      if (len(partials) == 2 and partials[1] == 'rel="next"'):
-        return partials[0][1:-1]
-    return None
+    values = {'query': query, 'variables': variables}
+    response = self._request('post', self._getAPIUrl('/graphql'), data = json.dumps(values))
+
+    if response.status_code in [401, 403]:
+      self._raisePermissionError(response)
+    elif response.status_code not in [200, 201, 202]:
+      self._raiseConnectionError(response)
+    json_response = response.json()
+    errors = [error for error in json_response.get('errors') or list()
+      if not allow_missing or error.get('type') != 'NOT_FOUND']
+    if len(errors) > 0:
+      raise ConnectionError('GraphQL ERROR: ' + '; '.join(str(error.get('message')) for error in errors))
+    return json_response.get('data') or dict()
 
 
-  def _parseRepositoryListResponse(self, response):
+  def _parseGraphqlRepository(self, node):
     '''
-    Parse the API response and return all (non-ignored) repositories as a list.
+    Parse a repository returned by the GraphQL API (see GRAPHQL_REPOSITORY_FIELDS)
 
-    :param object response: request response object
+    :param dict node: repository object of the GraphQL response
+
+    :return: remote repository
+    :rtype:  RemoteRepository
+    '''
+    visibility = 'public' if node['visibility'] == 'PUBLIC' else 'private'
+    topics = [topic_node['topic']['name'] for topic_node in (node.get('repositoryTopics') or dict()).get('nodes', list())]
+    return RemoteRepository(node['databaseId'], node['name'], visibility, node['description'], node['homepageUrl'],
+      node['url'] + '.git', node['url'], self, self._parseTimestamp(node.get('pushedAt')), node.get('sshUrl'), topics)
 
-    :return: returns a list of RemoteRepository objects
-    :rtype:  list
 
-    :raises PermissionError:     if the access is denied by the server
-    :raises ConnectionError:     if another HTTP error has occurred
+  def _parseRefStateResponse(self, data):
     '''
-    if response.status_code in [200, 201, 202]:
-      repo_list = list()
-      for repo in response.json():
-        if (repo['name'] not in self.ignored_repositories):
-          repo_list.append(self._parseProjectResponse(repo))
-      return repo_list
-    elif response.status_code in [401, 403]:
-      self._raisePermissionError(response)
-    else:
-      self._raiseConnectionError(response)
+    Parse the refs of a repository returned by the GraphQL API
+
+    :param dict data: repository object of the GraphQL response
+
+    :return: dictionary with the ref name as key and the object hash as value
+             (None if the repository is missing or has more refs than returned)
+    :rtype:  dict
+    '''
+    if data == None:
+      return None
+    refs = dict()
+    for kind in ['heads', 'tags']:
+      connection = data.get(kind)
+      if connection == None or connection['pageInfo']['hasNextPage']:
+        return None
+      for node in connection['nodes']:
+        refs['refs/' + kind + '/' + node['name']] = node['target']['oid']
+    return refs
@@ -5,12 +5,14 @@
 # This software is licensed under GPLv3, see LICENSE for details. 
 
 from hoster_base import BaseHoster
-from remote_repo import RemoteRepository
+from remote_repo import RemoteMirror, RemoteRepository, RepositoryList, removeUrlCredentials
 import validators
-import requests
 import json
 from urllib.parse import urlencode
 
+# GitLab updates last_activity_at at most once per hour
+GITLAB_ACTIVITY_GRANULARITY = 3600
+
 class GitLabHoster(BaseHoster):
 
   def __init__(self, name, user, access_token, api_version, domain, organization=None, ignored_repositories=None):
@@ -23,7 +25,7 @@ class GitLabHoster(BaseHoster):
     :param int api_version:          API version
     :param str domain:               GitLab domain
     :param str organization:         Organization name used for syncing
-    :param str ignored_repositories: List of repository names to be ignored
+    :param list ignored_repositories: Rules of the repositories to be ignored (see RepositoryMatcher)
     :raises ValueError:              If the given parameters are invalid
     '''
     super().__init__(name, user, access_token, organization, ignored_repositories)
@@ -35,14 +37,26 @@ class GitLabHoster(BaseHoster):
     if validators.domain(domain) != True:
       raise ValueError('GitLab domain is invalid')
     self.domain = domain
+    self.api_url = 'https://' + domain + '/api/v' + str(api_version)
+    self.activity_granularity = GITLAB_ACTIVITY_GRANULARITY
 
 
-  def getRepositoryList(self, visibility):
+  def getRepositoryList(self, visibility, changed_since=None, include=None):
     self._checkVisibility(visibility)
 
-    param = dict()
-    if visibility in ['public', 'internal' 'private']:
-      param['visibility'] = visibility
+    # Simple project representations (a fraction of the full size) lack the
+    # visibility: each visibility is listed separately
+    visibilities = [visibility]
+    if visibility not in ['public', 'internal', 'private']:
+      visibilities = ['public', 'internal', 'private']
+
+    param = {'per_page': 100, 'simple': 'true'}
+    if changed_since != None:
+      param['last_activity_after'] = self._formatTimestamp(changed_since)
+    if include != None and include.isTopicOnly() and len(include.topics) == 1:
+      param['topic'] = list(include.topics)[0] # Several topics would have to match all
+    elif include != None and include.isNameOnly() and len(include.names) == 1:
+      param['search'] = list(include.names)[0]
 
     if self.api_version == 4:
       if self.organization != None:
@@ -52,14 +66,16 @@ class GitLabHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.head(url, params = param, headers = self._getAuthenticationHeader())
-
-    repo_list = self._parseApiRepositoryListResponse(response)
-
-    while next_url is not None:
-      new_items, next_url = self._getRepositoryListKeyBasedPagination(next_url, param)
+    repo_list = RepositoryList()
+    for list_visibility in visibilities:
+      param['visibility'] = list_visibility
+      new_items, next_url = self._getRepositoryListKeyBasedPagination(url, param, list_visibility)
       repo_list += new_items
 
+      while next_url is not None:
+        new_items, next_url = self._getRepositoryListKeyBasedPagination(next_url, visibility = list_visibility)
+        repo_list += new_items
+
     return repo_list
 
 
@@ -77,12 +93,15 @@ class GitLabHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.get(url, params = param, headers = self._getAuthenticationHeader())
+    response = self._request('get', url, params = param)
 
     if response.status_code in [200, 201, 202]:
       for repo in response.json():
         if repo['name'] == name:
-          return self._parseProjectResponse(repo)
+          remote = self._parseProjectResponse(repo)
+          if self.ignored_repositories.matches(remote):
+            break # Topic or visibility rule
+          return remote
       raise LookupError('Repository \'' + name + '\' not found')
     elif response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -91,8 +110,8 @@ class GitLabHoster(BaseHoster):
 
 
   def createRepository(self, name, visibility, description=None, website=None):
-    if name in self.ignored_repositories:
-      raise PermissionError('Repository name \'' + name + '\' is in ignored-list of this hoster')
+    if name in self.ignored_repositories or visibility in self.ignored_repositories.visibilities:
+      raise PermissionError('Repository \'' + name + '\' is in ignored-list of this hoster')
 
     if self.api_version == 4:
       if website != None:
@@ -113,7 +132,7 @@ class GitLabHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.post(url, data = values, headers = self._getAuthenticationHeader())
+    response = self._request('post', url, data = values)
 
     if response.status_code in [200, 201, 202]:
       return self._parseProjectResponse(response.json())
@@ -142,7 +161,7 @@ class GitLabHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.put(url, data = values, headers = self._getAuthenticationHeader())
+    response = self._request('put', url, data = values)
 
     if response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -156,7 +175,7 @@ class GitLabHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.delete(url, headers = self._getAuthenticationHeader())
+    response = self._request('delete', url)
 
     if response.status_code in [401, 403]:
       self._raisePermissionError(response)
@@ -164,6 +183,89 @@ class GitLabHoster(BaseHoster):
       self._raiseConnectionError(response)
 
 
+  def getRemoteMirrors(self, repo):
+    if self.api_version == 4:
+      url = self._getAPIUrl('/projects/%(id)s/remote_mirrors', {'id': repo.id})
+    else:
+      raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
+
+    response = self._request('get', url)
+
+    if response.status_code in [200, 201, 202]:
+      return [self._parseRemoteMirrorResponse(mirror) for mirror in response.json()]
+    elif response.status_code in [401, 403]:
+      self._raisePermissionError(response)
+    else:
+      self._raiseConnectionError(response)
+
+
+  def createRemoteMirror(self, repo, git_url):
+    if self.api_version == 4:
+      url = self._getAPIUrl('/projects/%(id)s/remote_mirrors', {'id': repo.id})
+      values = {
+        'url': git_url,
+        'enabled': True,
+        'only_protected_branches': False,
+        'keep_divergent_refs': False
+      }
+    else:
+      raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
+
+    response = self._request('post', url, data = values)
+
+    if response.status_code in [200, 201, 202]:
+      return self._parseRemoteMirrorResponse(response.json())
+    elif response.status_code in [401, 403]:
+      self._raisePermissionError(response)
+    else:
+      self._raiseConnectionError(response)
+
+
+  def updateRemoteMirror(self, repo, mirror, git_url=None):
+    if self.api_version == 4:
+      url = self._getAPIUrl('/projects/%(id)s/remote_mirrors/%(mirror)s', {'id': repo.id, 'mirror': mirror.id})
+      values = {'enabled': True, 'only_protected_branches': False, 'keep_divergent_refs': False}
+      if git_url != None:
+        values['url'] = git_url
+    else:
+      raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
+
+    response = self._request('put', url, data = values)
+
+    if response.status_code in [401, 403]:
+      self._raisePermissionError(response)
+    elif response.status_code not in [200, 201, 202]:
+      self._raiseConnectionError(response)
+
+
+  def deleteRemoteMirror(self, repo, mirror):
+    if self.api_version == 4:
+      url = self._getAPIUrl('/projects/%(id)s/remote_mirrors/%(mirror)s', {'id': repo.id, 'mirror': mirror.id})
+    else:
+      raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
+
+    response = self._request('delete', url)
+
+    if response.status_code in [401, 403]:
+      self._raisePermissionError(response)
+    elif response.status_code not in [200, 201, 202, 204]:
+      self._raiseConnectionError(response)
+
+
+  def syncRemoteMirror(self, repo, mirror):
+    if self.api_version == 4:
+      url = self._getAPIUrl('/projects/%(id)s/remote_mirrors/%(mirror)s/sync', {'id': repo.id, 'mirror': mirror.id})
+    else:
+      raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
+
+    response = self._request('post', url)
+
+    if response.status_code in [401, 403]:
+      self._raisePermissionError(response)
+    elif response.status_code not in [200, 201, 202, 204]:
+      self._raiseConnectionError(response)
+
+
   def _checkVisibility(self, visibility):
     if visibility not in ['all', 'public', 'internal', 'private']:
       raise ValueError('Type \'' + visibility +'\' is unknown')
@@ -189,7 +291,7 @@ class GitLabHoster(BaseHoster):
     else:
       raise NotImplementedError('Operation not supported with API v' + str(self.api_version))
 
-    response = requests.get(url, params = param, headers = self._getAuthenticationHeader())
+    response = self._request('get', url, params = param)
 
     if response.status_code in [200, 201, 202]:
       for repo in response.json():
@@ -202,9 +304,17 @@ class GitLabHoster(BaseHoster):
       self._raiseConnectionError(response)
 
 
-  def _parseProjectResponse(self, response):
-    return RemoteRepository(response['id'], response['name'], response['visibility'], response['description'], None, 
-      response['http_url_to_repo'], response['web_url'], self.name, self.user, self.password)
+  def _parseProjectResponse(self, response, visibility=None):
+    return RemoteRepository(response['id'], response['name'], response.get('visibility', visibility), response['description'], None,
+      response['http_url_to_repo'], response['web_url'], self,
+      self._parseTimestamp(response.get('last_activity_at')), response.get('ssh_url_to_repo'),
+      response.get('topics', response.get('tag_list')))
+
+
+  def _parseRemoteMirrorResponse(self, response):
+    return RemoteMirror(response['id'], removeUrlCredentials(response['url']), response.get('enabled', False),
+      response.get('update_status'), self._parseTimestamp(response.get('last_update_at')),
+      self._parseTimestamp(response.get('last_successful_update_at')), response.get('last_error'))
 
 
   def _getAPIUrl(self, path, parameters=dict()):
@@ -216,21 +326,22 @@ class GitLabHoster(BaseHoster):
     :return: Complete API URL
     :rtype:  str
     '''
-    url = 'https://' + self.domain + '/api/v' + str(self.api_version)
+    url = self.api_url
     url += path % parameters
     return url
 
 
-  def _getAuthenticationHeader(self):
-    return {'Private-Token': self.password}
+  def _getAuthentication(self, credential):
+    return {'headers': {'Private-Token': credential.password}}
 
 
-  def _getRepositoryListKeyBasedPagination(self, apiUrl, params):
+  def _getRepositoryListKeyBasedPagination(self, apiUrl, params=None, visibility=None):
     '''
     Get the given page of repositories of the given type
 
     :param str apiUrl: prepared API URL to request the repositories
-    :param dict params: request GET parameters
+    :param dict params: request GET parameters (already contained in the URL of the following pages)
+    :param str visibility: visibility of the listed repositories (missing in simple representations)
 
     :return: returns a list of RemoteRepository objects and the url for the next items
     :rtype:  Tuple[List, str]
@@ -239,23 +350,21 @@ class GitLabHoster(BaseHoster):
     :raises ConnectionError:     if another HTTP error has occurred
     '''
 
-    response = requests.get(apiUrl, params = params, headers = self._getAuthenticationHeader())
+    response = self._request('get', apiUrl, params = params)
 
     if response.status_code in [200, 201, 202]:
-      if 'link' in response.headers:
-        next_link = response.headers['link']
-      else:
-        next_link = None
-      repo_list = self._parseApiRepositoryListResponse(response)
+      next_link = self._parseLinkResponseHeader(response)
+      repo_list = self._parseApiRepositoryListResponse(response, visibility)
       return repo_list, next_link
     elif response.status_code in [401, 403]:
       self._raisePermissionError(response)
     else:
       self._raiseConnectionError(response)
 
-  def _parseApiRepositoryListResponse(self, response):
+  def _parseApiRepositoryListResponse(self, response, visibility=None):
     repo_list = list()
     for repo in response.json():
-      if (repo['name'] not in self.ignored_repositories):
-        repo_list.append(self._parseProjectResponse(repo))
+      remote = self._parseProjectResponse(repo, visibility)
+      if not self.ignored_repositories.matches(remote):
+        repo_list.append(remote)
     return repo_list
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import json
+import os
+import threading
+import time
+
+class Journal():
+
+  def __init__(self, path, max_age=86400):
+    '''
+    Initialize an append-only journal of completed steps of a task run.
+    An interrupted run resumes from the steps recorded in the journal.
+
+    :param str path:    Path to the journal file
+    :param int max_age: Maximum age of a journal in seconds to be resumed
+    '''
+    self.path = path
+    self.max_age = max_age
+    self.resumed = False
+    self._lock = threading.Lock()
+    self._entries = dict()
+    self._file = None
+
+
+  def begin(self):
+    '''
+    Start a run. Resumes the existing journal if it belongs to an
+    interrupted run which is not older than the maximum age.
+
+    :return: True if an interrupted run is resumed
+    :rtype:  bool
+    '''
+    with self._lock:
+      self._entries = dict()
+      self.resumed = False
+      started = None
+
+      if os.path.isfile(self.path):
+        with open(self.path, 'r') as f:
+          for line in f:
+            try:
+              entry = json.loads(line)
+            except ValueError:
+              break # Incomplete last line of a killed run
+            if entry['step'] == 'start':
+              started = entry['time']
+            else:
+              self._entries[self._getKey(entry['step'], entry['key'], entry.get('destination'))] = entry.get('data')
+
+      if started != None and time.time() - started <= self.max_age:
+        self.resumed = True
+      else:
+        self._entries = dict()
+        directory = os.path.dirname(self.path)
+        if directory:
+          os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'w') as f:
+          f.write(json.dumps({'step': 'start', 'time': time.time()}) + '\n')
+
+      self._file = open(self.path, 'a')
+      return self.resumed
+
+
+  def record(self, step, key, destination=None, data=None):
+    '''
+    Record a completed step
+
+    :param str step:        step name (e.g. listed, resolved, fetched, pushed)
+    :param str key:         repository key
+    :param str destination: destination hoster name (for per-destination steps)
+    :param data:            JSON serializable data needed to skip the step later
+    '''
+    entry = {'step': step, 'key': key, 'time': time.time()}
+    if destination != None:
+      entry['destination'] = destination
+    if data != None:
+      entry['data'] = data
+
+    with self._lock:
+      self._entries[self._getKey(step, key, destination)] = data
+      if self._file != None:
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+  def isDone(self, step, key, destination=None):
+    '''
+    Check if a step has already been completed
+
+    :param str step:        step name
+    :param str key:         repository key
+    :param str destination: destination hoster name
+
+    :rtype: bool
+    '''
+    with self._lock:
+      return self._getKey(step, key, destination) in self._entries
+
+
+  def getData(self, step, key, destination=None):
+    '''
+    Get the data recorded with a completed step
+
+    :param str step:        step name
+    :param str key:         repository key
+    :param str destination: destination hoster name
+
+    :return: recorded data (None if the step was not completed)
+    '''
+    with self._lock:
+      return self._entries.get(self._getKey(step, key, destination))
+
+
+  def complete(self):
+    '''
+    Finish the run. The journal is removed so that the next run starts from scratch.
+    '''
+    with self._lock:
+      if self._file != None:
+        self._file.close()
+        self._file = None
+      if os.path.isfile(self.path):
+        os.remove(self.path)
+      self._entries = dict()
+
+
+  def _getKey(self, step, key, destination):
+    return (step, key, destination)
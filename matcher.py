@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import fnmatch
+import re
+
+VISIBILITIES = ['public', 'internal', 'private']
+
+class RepositoryMatcher():
+
+  def __init__(self, rules=()):
+    '''
+    Initialize a matcher compiled from a list of rules. A repository matches
+    if any rule matches:
+
+      name          exact repository name (set lookup)
+      glob          repository name with wildcards (e.g. "tmp-*")
+      re:pattern    regular expression matching the whole repository name
+      topic:name    repository topic (GitHub topics, GitLab topics)
+      visibility:v  repository visibility (public, internal, private)
+
+    All globs are compiled into a single expression. Regular expressions are
+    compiled one by one (inline flags and backreferences apply to their rule).
+
+    :param list rules: rules
+
+    :raises ValueError: if a rule is invalid
+    '''
+    self.rules = list(rules)
+    names = set()
+    patterns = list()
+    expressions = list()
+    topics = set()
+    visibilities = set()
+    self._kinds = set()
+    for rule in self.rules:
+      kind, value = _parseRule(rule)
+      self._kinds.add(kind)
+      if kind == 're':
+        try:
+          expressions.append(re.compile(value))
+        except re.error as e:
+          raise ValueError('Invalid regular expression \'' + value + '\': ' + str(e))
+      elif kind == 'topic':
+        topics.add(value.lower())
+      elif kind == 'visibility':
+        if value not in VISIBILITIES:
+          raise ValueError('Visibility \'' + value + '\' is unknown')
+        visibilities.add(value)
+      elif kind == 'glob':
+        patterns.append(fnmatch.translate(value)[:-2]) # without the \Z anchor
+      else:
+        names.add(value)
+    self.names = frozenset(names)
+    self.topics = frozenset(topics)
+    self.visibilities = frozenset(visibilities)
+    self._expressions = expressions
+    self._pattern = None
+    if len(patterns) > 0:
+      try:
+        self._pattern = re.compile('(?:' + '|'.join('(?:' + pattern + ')' for pattern in patterns) + ')\\Z')
+      except re.error as e:
+        raise ValueError('Invalid repository rules: ' + str(e))
+
+
+  def __contains__(self, name):
+    '''
+    Check if a repository name matches a name, glob or regular expression rule
+    (topic and visibility rules need the repository, see matches)
+    '''
+    if name in self.names or (self._pattern != None and self._pattern.match(name) != None):
+      return True
+    return any(expression.fullmatch(name) != None for expression in self._expressions)
+
+
+  def __len__(self):
+    return len(self.rules)
+
+
+  def matches(self, repo):
+    '''
+    Check if a repository matches any rule
+
+    :param RemoteRepository repo: repository
+
+    :rtype: bool
+    '''
+    if repo.name in self:
+      return True
+    if len(self.topics) > 0 and repo.topics != None and any(topic.lower() in self.topics for topic in repo.topics):
+      return True
+    return repo.visibility in self.visibilities
+
+
+  def isNameOnly(self):
+    '''
+    :return: True if all rules are exact repository names
+    :rtype:  bool
+    '''
+    return self._kinds == {'name'}
+
+
+  def isTopicOnly(self):
+    '''
+    :return: True if all rules are topics
+    :rtype:  bool
+    '''
+    return self._kinds == {'topic'}
+
+
+def getRepositoryMatcher(rules):
+    '''
+    Get a repository matcher for a list of rules (e.g. ignored-repositories)
+
+    :param rules: list of rules (or a RepositoryMatcher, returned as is)
+
+    :return: repository matcher
+    :rtype:  RepositoryMatcher
+
+    :raises ValueError: if a rule is invalid
+    '''
+    if isinstance(rules, RepositoryMatcher):
+      return rules
+    if rules == None:
+      return RepositoryMatcher()
+    return RepositoryMatcher(rules)
+
+
+def _parseRule(rule):
+    '''
+    Get the kind (name, glob, re, topic, visibility) and the value of a rule
+    '''
+    for kind in ['re', 'topic', 'visibility']:
+      if rule.startswith(kind + ':'):
+        return kind, rule[len(kind) + 1:]
+    if any(char in rule for char in '*?['):
+      return 'glob', rule
+    return 'name', rule
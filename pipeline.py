@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import queue
+import threading
+
+class Stage():
+
+  def __init__(self, worker, workers=1, queue_size=None):
+    '''
+    Initialize a pipeline stage: a pool of threads processing the items put
+    into a bounded queue. A full queue blocks the producers (back pressure),
+    e.g. fetches do not run further ahead of the pushes than the queue allows.
+
+    :param callable worker: function called with each item (exceptions are the worker's duty)
+    :param int workers:     number of threads
+    :param int queue_size:  maximum number of waiting items (number of workers if None)
+
+    :raises ValueError: if the given values are invalid
+    '''
+    if workers < 1:
+      raise ValueError('Number of workers must be at least 1')
+    if queue_size == None:
+      queue_size = workers
+    if queue_size < 1:
+      raise ValueError('Queue size must be at least 1')
+    self.worker = worker
+    self.workers = workers
+    self._queue = queue.Queue(queue_size)
+    self._threads = list()
+    self._stopped = False
+
+
+  def start(self):
+    '''
+    Start the worker threads
+    '''
+    for _i in range(self.workers):
+      thread = threading.Thread(target=self._work, daemon=True)
+      thread.start()
+      self._threads.append(thread)
+
+
+  def put(self, item):
+    '''
+    Add an item (blocks while the queue is full)
+
+    :param item: item passed to the worker (dropped if the stage has been stopped)
+    '''
+    while not self._stopped:
+      try:
+        self._queue.put(item, timeout = 0.5)
+        return
+      except queue.Full:
+        continue
+
+
+  def close(self):
+    '''
+    Wait until all items have been processed and stop the worker threads.
+    This is a blocking method!
+    '''
+    for _thread in self._threads:
+      self._queue.put(None)
+    for thread in self._threads:
+      while thread.is_alive():
+        thread.join(0.5)
+
+
+  def stop(self):
+    '''
+    Stop processing items (the items still waiting are dropped)
+    '''
+    self._stopped = True
+    try:
+      while True:
+        self._queue.get_nowait()
+    except queue.Empty:
+      pass
+    for _thread in self._threads:
+      try:
+        self._queue.put_nowait(None)
+      except queue.Full:
+        pass
+
+
+  def _work(self):
+    while True:
+      item = self._queue.get()
+      if item == None or self._stopped:
+        return
+      self.worker(item)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+ACTIONS = ['create', 'update', 'push', 'delete']
+
+class Plan():
+
+  def __init__(self, task_name):
+    '''
+    Initialize a plan describing what a task run would do
+
+    :param str task_name: name of the planned task
+    '''
+    self.task_name = task_name
+    self.destinations = dict()
+    self.up_to_date = 0
+    self.api_calls = 0
+    self.fetch_bytes = 0
+    self.push_bytes = 0
+    self.unknown_sizes = 0
+    self.runtime = 0.0
+    self.unknown_runtimes = 0
+
+
+  def addAction(self, destination, action, name):
+    '''
+    Add a planned action for a repository
+
+    :param str destination: destination hoster name
+    :param str action:      action (create, update, push, delete)
+    :param str name:        repository name
+    '''
+    if action not in ACTIONS:
+      raise ValueError('Action \'' + action + '\' is unknown')
+    if destination not in self.destinations:
+      self.destinations[destination] = {key: list() for key in ACTIONS}
+    self.destinations[destination][action].append(name)
+
+
+  def countActions(self, action):
+    '''
+    Count the planned actions of the given type over all destinations
+
+    :param str action: action (create, update, push, delete)
+
+    :return: number of planned actions
+    :rtype:  int
+    '''
+    return sum(len(actions[action]) for actions in self.destinations.values())
+
+
+  def format(self):
+    '''
+    Format the plan as human readable text
+
+    :return: plan description
+    :rtype:  str
+    '''
+    lines = ['Plan for task \'' + str(self.task_name) + '\':']
+    for destination in sorted(self.destinations):
+      lines.append('  Destination \'' + destination + '\':')
+      for action in ACTIONS:
+        names = self.destinations[destination][action]
+        if len(names) > 0:
+          lines.append('    ' + action + ' (' + str(len(names)) + '): ' + ', '.join(sorted(names)))
+    if len(self.destinations) == 0:
+      lines.append('  Nothing to do')
+
+    lines.append('  Estimates:')
+    lines.append('    repositories up to date: ' + str(self.up_to_date))
+    lines.append('    API calls: ' + str(self.api_calls))
+    transfer = '    transfer: ' + formatBytes(self.fetch_bytes) + ' fetch, ' + formatBytes(self.push_bytes) + ' push'
+    if self.unknown_sizes > 0:
+      transfer += ' (+ ' + str(self.unknown_sizes) + ' repositories of unknown size)'
+    lines.append(transfer)
+    runtime = '    runtime: ' + formatDuration(self.runtime)
+    if self.unknown_runtimes > 0:
+      runtime += ' (' + str(self.unknown_runtimes) + ' repositories without historical timings)'
+    lines.append(runtime)
+    return '\n'.join(lines)
+
+
+def formatBytes(value):
+  '''
+  Format a number of bytes in a human readable way
+
+  :param int value: number of bytes
+
+  :return: formatted value
+  :rtype:  str
+  '''
+  for unit in ['B', 'KiB', 'MiB', 'GiB']:
+    if abs(value) < 1024:
+      return '%.1f %s' % (value, unit) if unit != 'B' else '%d %s' % (value, unit)
+    value /= 1024.0
+  return '%.1f TiB' % value
+
+
+def formatDuration(seconds):
+  '''
+  Format a duration in a human readable way
+
+  :param float seconds: duration in seconds
+
+  :return: formatted value
+  :rtype:  str
+  '''
+  seconds = int(round(seconds))
+  hours, seconds = divmod(seconds, 3600)
+  minutes, seconds = divmod(seconds, 60)
+  if hours > 0:
+    return '%dh %02dm %02ds' % (hours, minutes, seconds)
+  if minutes > 0:
+    return '%dm %02ds' % (minutes, seconds)
+  return '%ds' % seconds
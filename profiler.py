@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import collections
+import os
+import sys
+import threading
+import time
+
+CATEGORIES = ['hoster API parsing', 'network', 'git subprocess', 'Python (task)', 'idle', 'other']
+
+class SamplingProfiler():
+
+  def __init__(self, interval=0.005):
+    '''
+    Initialize a sampling profiler. The stacks of all threads are sampled
+    periodically while the profiler is running.
+
+    :param float interval: sampling interval in seconds
+    '''
+    self.interval = interval
+    self.stacks = collections.Counter()
+    self.categories = collections.Counter()
+    self.duration = 0.0
+    self._stopped = threading.Event()
+    self._thread = None
+    self._start = None
+
+
+  def start(self):
+    '''
+    Start sampling in a background thread
+    '''
+    self._stopped.clear()
+    self._start = time.time()
+    self._thread = threading.Thread(target=self._sample, daemon=True)
+    self._thread.start()
+
+
+  def stop(self):
+    '''
+    Stop sampling
+    '''
+    self._stopped.set()
+    self._thread.join()
+    self.duration += time.time() - self._start
+
+
+  def writeCollapsed(self, path):
+    '''
+    Write the samples in the collapsed stack format (input of flamegraph.pl, speedscope, ...)
+
+    :param str path: output file
+    '''
+    with open(path, 'w') as f:
+      for stack, count in sorted(self.stacks.items()):
+        f.write(';'.join(stack) + ' ' + str(count) + '\n')
+
+
+  def formatSummary(self, top=20):
+    '''
+    Format the time spent per category and the top functions
+
+    :param int top: number of functions to be listed
+
+    :return: summary
+    :rtype:  str
+    '''
+    total = max(sum(self.categories.values()), 1)
+    lines = ['Profile of ' + '%.2f' % self.duration + 's (' + str(total) + ' samples, all threads):', '', 'Time by category:']
+    for category in CATEGORIES:
+      count = self.categories[category]
+      lines.append('  %-20s %8.2fs %6.1f%%' % (category, count * self.interval, 100.0 * count / total))
+
+    own = collections.Counter()
+    inclusive = collections.Counter()
+    for stack, count in self.stacks.items():
+      own[stack[-1]] += count
+      for frame in set(stack):
+        inclusive[frame] += count
+
+    for title, counter in [('Top functions (own time):', own), ('Top functions (inclusive time):', inclusive)]:
+      lines += ['', title]
+      for frame, count in counter.most_common(top):
+        lines.append('  %8.2fs %6.1f%%  %s' % (count * self.interval, 100.0 * count / total, frame))
+    return '\n'.join(lines)
+
+
+  def _sample(self):
+    own_id = threading.get_ident()
+    while not self._stopped.wait(self.interval):
+      for thread_id, frame in sys._current_frames().items():
+        if thread_id == own_id:
+          continue
+        stack = list()
+        while frame != None:
+          stack.append(frame)
+          frame = frame.f_back
+        stack.reverse()
+        names = tuple(_getFrameName(frame) for frame in stack)
+        self.stacks[names] += 1
+        self.categories[_getCategory(stack)] += 1
+
+
+def _getFrameName(frame):
+  '''
+  Get the name of a stack frame (module:function)
+  '''
+  return _getModuleName(frame.f_code.co_filename) + ':' + frame.f_code.co_name
+
+
+def _getModuleName(path):
+  '''
+  Get the module name of a source file (e.g. task for /root/package/task.py)
+  '''
+  name = os.path.basename(path)
+  if name.endswith('.py'):
+    return name[:-3]
+  return name.strip('<>')
+
+
+def _getCategory(stack):
+  '''
+  Attribute a stack (outermost frame first) to a category. The innermost
+  frame matching a rule determines the category.
+  '''
+  for frame in reversed(stack):
+    path = frame.f_code.co_filename.replace('\\', '/')
+    module = _getModuleName(path)
+    function = frame.f_code.co_name
+
+    if '/json/' in path or (module.startswith('hoster') and function.startswith('_parse')):
+      return 'hoster API parsing'
+    if module in ['socket', 'ssl', 'selectors'] and _isNetworkStack(stack):
+      return 'network'
+    if '/urllib3/' in path or '/requests/' in path or path.endswith('/http/client.py'):
+      return 'network'
+    if module == 'git_command' or module == 'subprocess':
+      return 'git subprocess'
+    if module in ['threading', 'queue'] and function in ['wait', 'join', 'get', '_wait_for_tstate_lock']:
+      return 'idle'
+    if module in ['task', 'scheduler', 'repo', 'journal', 'state', 'remote_repo', 'plan']:
+      return 'Python (task)'
+  return 'other'
+
+
+def _isNetworkStack(stack):
+  '''
+  Check whether a stack waits on a socket of its own (not on the pipes of a git process)
+  '''
+  return not any(os.path.basename(frame.f_code.co_filename) in ['subprocess.py', 'git_command.py'] for frame in stack)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import threading
+import time
+
+class RateLimiter():
+
+  def __init__(self, rate, burst=1):
+    '''
+    Initialize a token bucket shared between threads
+
+    :param float rate:  tokens added per second
+    :param float burst: maximum number of tokens available at once
+
+    :raises ValueError: if the given values are invalid
+    '''
+    if rate <= 0 or burst <= 0:
+      raise ValueError('Rate and burst of a rate limiter must be positive')
+    self.rate = float(rate)
+    self.burst = float(burst)
+    self._tokens = float(burst)
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+
+  def acquire(self, amount=1):
+    '''
+    Take tokens from the bucket, waiting until enough tokens are available.
+    Amounts above the burst size are granted once the bucket is full (and
+    leave the bucket in debt).
+
+    :param float amount: number of tokens
+
+    :return: time waited in seconds
+    :rtype:  float
+    '''
+    waited = 0.0
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= min(amount, self.burst):
+          self._tokens -= amount
+          return waited
+        # Wait until enough tokens are available (acquire(0) waits until the bucket is out of debt)
+        delay = (min(amount, self.burst) - self._tokens) / self.rate
+      time.sleep(delay)
+      waited += delay
+
+
+  def charge(self, amount):
+    '''
+    Take tokens from the bucket without waiting (e.g. for work measured
+    afterwards). The bucket may be left in debt, delaying the next acquire.
+
+    :param float amount: number of tokens
+    '''
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      self._tokens -= amount
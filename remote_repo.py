@@ -4,9 +4,17 @@
 #
 # This software is licensed under GPLv3, see LICENSE for details. 
 
+from urllib.parse import quote, urlsplit, urlunsplit
+
 class RemoteRepository():
 
-  def __init__(self, id, name, visibility, description, website, git_url, web_url, source_name, user, password):
+  # Repositories are kept in memory for whole organizations: no per-instance
+  # __dict__ and the authentication data is shared through the hoster
+  __slots__ = ('id', 'name', 'visibility', 'description', 'website', 'git_url', 'web_url', 'hoster', 'last_activity', 'ssh_url',
+    'topics')
+
+  def __init__(self, id, name, visibility, description, website, git_url, web_url, hoster, last_activity=None, ssh_url=None,
+    topics=None):
     '''
     Initialize a git remote instance
     
@@ -17,28 +25,214 @@ class RemoteRepository():
     :param str website:     Repository website
     :param str git_url:     HTTP URL to the git repository
     :param str web_url:     URL to the repository website
-    :param str source_name: Name of the source hoster
-    :param str user:        Username for the git hoster
-    :param str password:    Password for the git hoster (in plain text)
+    :param BaseHoster hoster: Hoster of the repository (provides the name, authentication data and SSH transport)
+    :param float last_activity: Time of the last change as UNIX timestamp (if known)
+    :param str ssh_url:     SSH URL to the git repository
+    :param list topics:     Repository topics (None if not supported by the hoster)
     '''
     self.id = id
     self.git_url = git_url
     self.web_url = web_url
-    self.source_name = source_name
-    self.user = user
-    self.password = password
+    self.hoster = hoster
     self.name = name
     self.visibility = visibility
     self.description = description
     self.website = website
+    self.last_activity = last_activity
+    self.ssh_url = ssh_url
+    self.topics = topics
+
+
+  @property
+  def source_name(self):
+    '''
+    Name of the hoster of this repository
+    '''
+    return self.hoster.name
+
+
+  @property
+  def user(self):
+    return self.hoster.user
+
+
+  @property
+  def password(self):
+    return self.hoster.password
+
+
+  @property
+  def ssh_transport(self):
+    return self.hoster.ssh_transport
 
 
   def getGitUrl(self):
     '''
     Get URL used to interact with git and the remote host
 
-    :return: URL with authentication data for the remote repository
+    :return: URL with authentication data for the remote repository (SSH URL without authentication data)
     :rtype: str
     '''
-    param = {'user': self.user, 'password': self.password, 'url': self.git_url[8:]}
-    return 'https://%(user)s:%(password)s@%(url)s' % param
+    if self.ssh_transport != None and self.ssh_url != None:
+      return self.ssh_url
+    url = urlsplit(removeUrlCredentials(self.git_url))
+    netloc = quote(self.user, safe = '') + ':' + quote(self.password, safe = '') + '@' + url.netloc
+    return urlunsplit((url.scheme, netloc, url.path, url.query, url.fragment))
+
+
+  def getGitEnvironment(self):
+    '''
+    Get the environment variables needed by git to interact with the remote host
+
+    :return: environment variables (None if no variables are needed)
+    :rtype:  dict
+    '''
+    if self.ssh_transport != None and self.ssh_url != None:
+      return self.ssh_transport.getEnvironment()
+    return None
+
+
+  def toDict(self):
+    '''
+    Get the repository properties without authentication data
+
+    :return: JSON serializable dictionary
+    :rtype:  dict
+    '''
+    return {
+      'id': self.id,
+      'name': self.name,
+      'visibility': self.visibility,
+      'description': self.description,
+      'website': self.website,
+      'git_url': self.git_url,
+      'web_url': self.web_url,
+      'source_name': self.source_name,
+      'last_activity': self.last_activity,
+      'ssh_url': self.ssh_url,
+      'topics': self.topics
+    }
+
+
+  @classmethod
+  def fromDict(cls, data, hoster):
+    '''
+    Create a remote repository from the properties returned by toDict
+
+    :param dict data:         repository properties
+    :param BaseHoster hoster: hoster of the repository (provides the authentication data)
+
+    :return: remote repository
+    :rtype:  RemoteRepository
+    '''
+    return cls(data['id'], data['name'], data['visibility'], data['description'], data['website'],
+      data['git_url'], data['web_url'], hoster, data.get('last_activity'), data.get('ssh_url'), data.get('topics'))
+
+
+class RepositoryList():
+
+  __slots__ = ('_repositories',)
+
+  def __init__(self, repositories=()):
+    '''
+    Initialize a collection of remote repositories indexed by name. The
+    insertion order is kept; a repository replaces one with the same name.
+
+    :param repositories: RemoteRepository objects
+    '''
+    self._repositories = dict()
+    self.extend(repositories)
+
+
+  def add(self, repository):
+    '''
+    Add a remote repository
+
+    :param RemoteRepository repository: remote repository
+    '''
+    self._repositories[repository.name] = repository
+
+
+  def extend(self, repositories):
+    '''
+    Add several remote repositories
+
+    :param repositories: RemoteRepository objects
+    '''
+    for repository in repositories:
+      self._repositories[repository.name] = repository
+
+
+  def get(self, name, default=None):
+    '''
+    Get a remote repository by name
+
+    :param str name: repository name
+    :param default:  value returned if no repository has this name
+
+    :return: remote repository
+    :rtype:  RemoteRepository
+    '''
+    return self._repositories.get(name, default)
+
+
+  def names(self):
+    '''
+    :return: repository names (set-like view)
+    '''
+    return self._repositories.keys()
+
+
+  def __contains__(self, name):
+    return name in self._repositories
+
+
+  def __iter__(self):
+    return iter(self._repositories.values())
+
+
+  def __len__(self):
+    return len(self._repositories)
+
+
+  def __iadd__(self, repositories):
+    self.extend(repositories)
+    return self
+
+
+class RemoteMirror():
+
+  __slots__ = ('id', 'url', 'enabled', 'update_status', 'last_update_at', 'last_successful_update_at', 'last_error')
+
+  def __init__(self, id, url, enabled, update_status, last_update_at=None, last_successful_update_at=None, last_error=None):
+    '''
+    Initialize a push mirror configured on the hoster of a repository (e.g. GitLab remote mirror)
+
+    :param int id:                          Mirror Id on the hoster API
+    :param str url:                         Git URL of the mirror (without authentication data)
+    :param bool enabled:                    True if the mirror is updated by the hoster
+    :param str update_status:               Status of the last update (none, scheduled, started, finished, failed, to_retry)
+    :param float last_update_at:            Time of the last update as UNIX timestamp
+    :param float last_successful_update_at: Time of the last successful update as UNIX timestamp
+    :param str last_error:                  Error of the last update
+    '''
+    self.id = id
+    self.url = url
+    self.enabled = enabled
+    self.update_status = update_status
+    self.last_update_at = last_update_at
+    self.last_successful_update_at = last_successful_update_at
+    self.last_error = last_error
+
+
+def removeUrlCredentials(url):
+  '''
+  Remove the authentication data from the given URL
+
+  :param str url: URL (e.g. https://user@bitbucket.org/team/repo.git)
+
+  :return: URL without authentication data
+  :rtype:  str
+  '''
+  parts = urlsplit(url)
+  return urlunsplit((parts.scheme, parts.netloc.rsplit('@', 1)[-1], parts.path, parts.query, parts.fragment))
@@ -4,22 +4,44 @@
 #
 # This software is licensed under GPLv3, see LICENSE for details. 
 
+import math
 import os
-import subprocess
+import threading
+from bandwidth import getLimiters
+from concurrent.futures import ThreadPoolExecutor
+from fanout import DEFAULT_PUSH_POLICY
+from git_command import GitCancelledError, GitError, getGitRunner, isTransportError, parseProgress
 from remote_repo import RemoteRepository
+from transfer import DEFAULT_PROFILE
+
+CACHE_PATH = '/tmp/git-mirror'
+
+_cache_path = CACHE_PATH
 
 class Repository():
 
-  def __init__(self, source, destinations=dict()):
+  def __init__(self, source, destinations=dict(), fetch_profile=DEFAULT_PROFILE, push_profiles=dict(), push_policies=dict(),
+    seed_chunk_size=None):
     '''
     Initialize a git repository instance
 
-    :param RemoteRepository source: Source remote repository
-    :param dict destinations:       Destination remote repositories
+    :param RemoteRepository source:        Source remote repository
+    :param dict destinations:              Destination remote repositories
+    :param TransferProfile fetch_profile:  Transfer profile used for the source
+    :param dict push_profiles:             Transfer profiles used for the destinations (default profile if missing)
+    :param dict push_policies:             Push policies (concurrency, retries) of the destinations (default policy if missing)
+    :param int seed_chunk_size:            Push the branches in chunks of about this many bytes when more data is
+                                           missing on a destination (disabled if None)
     '''
     self.source = source
     self.destinations = destinations
+    self.fetch_profile = fetch_profile
+    self.push_profiles = push_profiles
+    self.push_policies = push_policies
+    self.seed_chunk_size = seed_chunk_size
     self.local_path = None
+    self.fetch_bytes = 0
+    self.push_bytes = 0
     self._checkLocalPath()
 
 
@@ -37,14 +59,12 @@ class Repository():
         return
 
     self.local_path = self._generateLocalPath()
-    proc = subprocess.Popen(['git', 'clone', '--mirror', self.source.getGitUrl(), self.local_path + '/.git'], stdout = subprocess.DEVNULL)
-
     try:
-      if proc.wait() != 0:
-        raise ConnectionError('Cloning repository ' + self.source.git_url + ' failed')
-    except KeyboardInterrupt as e:
-      proc.kill()
-      raise e
+      args = self.fetch_profile.getConfigArgs() + ['clone', '--mirror', '--progress', self.source.getGitUrl(), self.local_path + '/.git']
+      result = _runRemote(self.source, 'clone', args)
+    except GitError as e:
+      raise GitError('Cloning repository ' + self.source.git_url + ' failed: ' + str(e), e.operation, e.returncode, e.stderr)
+    self.fetch_bytes += result.bytes
 
 
   def pull(self):
@@ -57,23 +77,26 @@ class Repository():
       self.clone()
       return
 
-    proc = subprocess.Popen(['git', 'remote', 'update', '--prune'], cwd = self.local_path, stdout = subprocess.DEVNULL)
-
     try:
-      if proc.wait() != 0:
-        raise ConnectionError('Cloning repository ' + self.source.git_url + ' failed')
-    except KeyboardInterrupt as e:
-      proc.kill()
-      raise e
+      # The URL may have changed since cloning (e.g. transport or credentials)
+      getGitRunner().run('local', ['remote', 'set-url', 'origin', self.source.getGitUrl()], cwd = self.local_path)
+      args = self.fetch_profile.getConfigArgs() + ['fetch', '--prune', '--progress', 'origin']
+      result = _runRemote(self.source, 'fetch', args, cwd = self.local_path)
+    except GitError as e:
+      raise GitError('Fetching repository ' + self.source.git_url + ' failed: ' + str(e), e.operation, e.returncode, e.stderr)
+    self.fetch_bytes += result.bytes
 
 
-  def push(self, remote_name=None):
+  def push(self, remote_names=None):
     '''
-    (Force) Push this repository to the named git hoster
+    (Force) Push this repository to the named git hosters. The destinations
+    are pushed in parallel within the concurrency limit of each hoster and a
+    failing destination neither delays nor hides the others.
 
-    :param str remote_name: Hoster name (push to all destinations if None)
+    :param list remote_names: Hoster names (push to all destinations if None)
 
-    :raises ConnectionError: An error has occured
+    :return: dictionary with the hoster name as key and PushResult as value
+    :rtype:  dict
     '''
 
     if (self.local_path == None):
@@ -81,25 +104,220 @@ class Repository():
 
     self.local_path = self._generateLocalPath()
 
-    procList = list()
-    if remote_name != None:
+    if remote_names == None:
+      remote_names = list(self.destinations)
+    for remote_name in remote_names:
       if remote_name not in self.destinations:
         raise RuntimeError('Remote destination \'' + remote_name + '\' not found')
-      procList.append(subprocess.Popen(['git', 'push', '--mirror', self.destinations[remote_name].getGitUrl()], cwd = self.local_path, stdout = subprocess.DEVNULL))
-    else:
-      for _key, remote in self.destinations.items():
-        procList.append(subprocess.Popen(['git', 'push', '--mirror', remote.getGitUrl()], cwd = self.local_path))
+
+    results = dict()
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers = max(len(remote_names), 1))
     try:
-      for proc in procList:
-        value = proc.wait()
-        if value != 0:
-          raise ConnectionError('(Error ' + str(value) + ') Pushing repository ' + self.source.git_url + ' failed')
-    except InterruptedError:
-      for proc in procList:
-        proc.kill()
-    except KeyboardInterrupt:
-      for proc in procList:
-        proc.kill()
+      futures = dict()
+      for remote_name in remote_names:
+        remote = self.destinations[remote_name]
+        policy = self.push_policies.get(remote_name, DEFAULT_PUSH_POLICY)
+        push = lambda remote=remote: self._pushRemote(remote, self._getPushProfile(remote), cancel)
+        futures[remote_name] = executor.submit(policy.run, remote_name, push, cancel)
+      for remote_name, future in futures.items():
+        results[remote_name] = future.result()
+        self.push_bytes += results[remote_name].bytes
+        # One outcome per push (retries and seeded chunks included)
+        _recordOutcome(self.destinations[remote_name].hoster.git_circuit_breaker, results[remote_name].error,
+          results[remote_name].duration)
+    except KeyboardInterrupt as e:
+      # Kill the running pushes instead of waiting for them (up to the push timeout)
+      getGitRunner().cancel(cancel)
+      executor.shutdown(wait = False, cancel_futures = True)
+      raise e
+    executor.shutdown(wait = True)
+    return results
+
+
+  def _pushRemote(self, remote, profile, cancel=None):
+    '''
+    (Force) Push this repository to the given remote repository. When more
+    than seed_chunk_size bytes are missing on the remote (e.g. initial push of
+    a large repository), the branches are seeded in chunks first.
+
+    :param RemoteRepository remote:  destination remote repository
+    :param TransferProfile profile:  transfer profile
+    :param threading.Event cancel:   cancel event of the git processes (see GitRunner.cancel)
+
+    :return: result of the git process (bytes include the seeded chunks)
+    :rtype:  GitResult
+    '''
+    try:
+      seeded_bytes = 0
+      if self.seed_chunk_size != None and self.getCacheSize() > self.seed_chunk_size:
+        seeded_bytes = self._seedRemote(remote, profile, cancel)
+      args = profile.getConfigArgs() + ['push', '--mirror', '--progress', remote.getGitUrl()]
+      result = _runRemote(remote, 'push', args, cwd = self.local_path, cancel = cancel, record = False)
+      result.bytes += seeded_bytes
+      return result
+    except GitError as e:
+      raise type(e)('Pushing repository ' + self.source.git_url + ' to ' + remote.git_url + ' failed: ' + str(e),
+        e.operation, e.returncode, e.stderr)
+
+
+  def _seedRemote(self, remote, profile, cancel=None):
+    '''
+    Push the branches to the given remote repository in chunks of about
+    seed_chunk_size bytes, walking the commits from the oldest to the newest.
+    The branches on the remote record the progress: a failed seed continues
+    after the last chunk pushed.
+
+    :param RemoteRepository remote:  destination remote repository
+    :param TransferProfile profile:  transfer profile
+    :param threading.Event cancel:   cancel event of the git processes (see GitRunner.cancel)
+
+    :return: number of bytes pushed
+    :rtype:  int
+
+    :raises GitError: if a chunk could not be pushed
+    '''
+    remote_refs = lsRemote(remote, profile)
+    local_refs = self.getLocalRefs()
+    if self.estimateTransferSize(local_refs, remote_refs) <= self.seed_chunk_size:
+      return 0
+
+    pushed = set(self._filterKnownObjects(set(remote_refs.values())))
+    seeded_bytes = 0
+    for ref, tip in sorted(local_refs.items()):
+      if not ref.startswith('refs/heads/'):
+        continue
+      chunks = math.ceil(self.estimateTransferSize({ref: tip}, {obj: obj for obj in pushed}) / self.seed_chunk_size)
+      if chunks <= 1:
+        continue # Small enough for the final mirror push
+      # Commits of the branch missing on the remote, oldest first
+      # The revisions are passed on stdin: the objects known to the remote may exceed ARG_MAX
+      stdin = '\n'.join([tip] + ['^' + obj for obj in sorted(pushed)]) + '\n'
+      commits = getGitRunner().run('local', ['rev-list', '--reverse', '--first-parent', '--stdin'],
+        cwd = self.local_path, input = stdin, cancel = cancel).stdout.split()
+      step = max(math.ceil(len(commits) / chunks), 1)
+      # The tip itself is pushed with the final mirror push
+      for commit in commits[step - 1:-1:step]:
+        args = profile.getConfigArgs() + ['push', '--force', '--progress', remote.getGitUrl(), commit + ':' + ref]
+        seeded_bytes += _runRemote(remote, 'push', args, cwd = self.local_path, cancel = cancel, record = False).bytes
+        pushed.add(commit)
+    return seeded_bytes
+
+
+  def isInSync(self, remote_names=None):
+    '''
+    Check if all destinations have the same branches and tags as the source.
+    Only the remote refs are compared, no objects are transferred.
+
+    :param list remote_names: Hoster names (compare all destinations if None)
+
+    :return: True if all destinations are in sync
+    :rtype:  bool
+
+    :raises ConnectionError: if a remote repository is not reachable
+    '''
+    if remote_names == None:
+      remote_names = list(self.destinations)
+    source_refs = lsRemote(self.source, self.fetch_profile)
+    for remote_name in remote_names:
+      remote = self.destinations[remote_name]
+      if lsRemote(remote, self._getPushProfile(remote)) != source_refs:
+        return False
+    return True
+
+
+  def getCacheSize(self):
+    '''
+    Get the size of the local copy of this repository
+
+    :return: size in bytes (0 if no local copy exists)
+    :rtype:  int
+    '''
+    self._checkLocalPath()
+    if self.local_path == None:
+      return 0
+
+    size = 0
+    for root, _dirs, files in os.walk(self.local_path):
+      for name in files:
+        try:
+          size += os.path.getsize(os.path.join(root, name))
+        except OSError:
+          pass # File removed in the meantime
+    return size
+
+
+  def getLocalRefs(self):
+    '''
+    Get the refs of the local copy of this repository
+
+    :return: dictionary with the ref name as key and the object hash as value
+    :rtype:  dict
+    '''
+    self._checkLocalPath()
+    if self.local_path == None:
+      return dict()
+
+    try:
+      result = getGitRunner().run('local', ['for-each-ref', '--format=%(objectname) %(refname)'], cwd = self.local_path)
+    except GitError:
+      return dict()
+    return _parseRefList(result.stdout)
+
+
+  def estimateTransferSize(self, refs, existing_refs=dict()):
+    '''
+    Estimate the number of bytes needed to transfer the given refs to a remote
+    which already has the existing refs. Only objects available in the local
+    copy are taken into account.
+
+    :param dict refs:          refs to be transferred (ref name -> hash)
+    :param dict existing_refs: refs already available on the remote (ref name -> hash)
+
+    :return: estimated size in bytes
+    :rtype:  int
+    '''
+    self._checkLocalPath()
+    if self.local_path == None:
+      return 0
+
+    want = self._filterKnownObjects(set(refs.values()) - set(existing_refs.values()))
+    if len(want) == 0:
+      return 0
+    have = self._filterKnownObjects(set(existing_refs.values()))
+
+    stdin = '\n'.join(want) + '\n' + ''.join('^' + obj + '\n' for obj in have)
+    try:
+      result = getGitRunner().run('local', ['rev-list', '--objects', '--disk-usage', '--stdin'], cwd = self.local_path, input = stdin)
+      return int(result.stdout.strip())
+    except (GitError, ValueError):
+      return 0
+
+
+  def _getPushProfile(self, remote):
+    '''
+    Get the transfer profile used for the given destination remote repository
+    '''
+    return self.push_profiles.get(remote.source_name, DEFAULT_PROFILE)
+
+
+  def _filterKnownObjects(self, objects):
+    '''
+    Filter the given object hashes to the ones available in the local copy
+    '''
+    if len(objects) == 0:
+      return list()
+    try:
+      result = getGitRunner().run('local', ['cat-file', '--batch-check=%(objectname) %(objecttype)'], cwd = self.local_path,
+        input = '\n'.join(objects) + '\n')
+    except GitError:
+      return list()
+    known = list()
+    for line in result.stdout.splitlines():
+      partials = line.split(' ')
+      if len(partials) == 2 and partials[1] != 'missing':
+        known.append(partials[0])
+    return known
 
 
   def _checkLocalPath(self):
@@ -119,4 +337,123 @@ class Repository():
     :rtype:  str
     '''
     param = {'source': self.source.source_name, 'name': self.source.name}
-    return '/tmp/git-mirror/%(source)s/%(name)s' % param
+    return getCachePath() + '/%(source)s/%(name)s' % param
+
+
+def getCachePath():
+  '''
+  Get the directory holding the local repository copies and the run state
+
+  :rtype: str
+  '''
+  return _cache_path
+
+
+def setCachePath(path):
+  '''
+  Set the directory holding the local repository copies and the run state
+
+  :param str path: cache directory
+  '''
+  global _cache_path
+  _cache_path = path
+
+
+def lsRemote(remote, profile=DEFAULT_PROFILE):
+  '''
+  List the branches and tags of a remote repository (read-only)
+
+  :param RemoteRepository remote:  remote repository
+  :param TransferProfile profile:  transfer profile
+
+  :return: dictionary with the ref name as key and the object hash as value
+  :rtype:  dict
+
+  :raises ConnectionError: if the remote repository is not reachable
+  '''
+  try:
+    args = profile.getConfigArgs() + ['ls-remote', '--heads', '--tags', remote.getGitUrl()]
+    result = _runRemote(remote, 'ls-remote', args)
+  except GitError as e:
+    raise GitError('Listing refs of repository ' + remote.git_url + ' failed: ' + str(e), e.operation, e.returncode, e.stderr)
+  return _parseRefList(result.stdout)
+
+
+def _runRemote(remote, operation, args, cwd=None, cancel=None, record=True):
+  '''
+  Run a git command transferring data from/to a remote repository. The
+  outcome is recorded by the git circuit breaker of the remote's hoster
+  (see _recordOutcome).
+  The command is only started once the bandwidth budgets (global and of the
+  hoster) are out of debt and the transferred bytes are charged afterwards.
+
+  :param RemoteRepository remote: remote repository
+  :param str operation:           operation name (see GitRunner.run)
+  :param list args:               git arguments
+  :param str cwd:                 working directory
+  :param threading.Event cancel:  cancel event of the git process (see GitRunner.run)
+  :param bool record:             whether the outcome is recorded (False if the caller records it once for several calls)
+
+  :return: result of the git process
+  :rtype:  GitResult
+
+  :raises GitError:         if the git command has failed
+  :raises CircuitOpenError: if the circuit breaker of the hoster is open
+  '''
+  breaker = remote.hoster.git_circuit_breaker
+  if breaker != None:
+    breaker.acquire()
+  limiters = getLimiters(operation, remote.hoster)
+  for limiter in limiters:
+    limiter.acquire(0)
+  try:
+    result = getGitRunner().run(operation, args, cwd = cwd, env = remote.getGitEnvironment(), cancel = cancel)
+  except GitError as e:
+    for limiter in limiters:
+      limiter.charge(parseProgress(e.stderr)[1])
+    if record:
+      _recordOutcome(breaker, e)
+    raise e
+  for limiter in limiters:
+    limiter.charge(result.bytes)
+  if record:
+    _recordOutcome(breaker, None, result.duration)
+  return result
+
+
+def _recordOutcome(breaker, error=None, duration=0.0):
+  '''
+  Record the outcome of a git transfer in a git circuit breaker. Only transport
+  errors count as failures: a rejected push (hooks, size limits, protected
+  branches) shows that the hoster is reachable.
+
+  :param CircuitBreaker breaker: git circuit breaker of the hoster (nothing is recorded if None)
+  :param Exception error:        error of the transfer (None if successful)
+  :param float duration:         duration of the transfer in seconds
+  '''
+  if breaker == None or isinstance(error, GitCancelledError):
+    return
+  if isTransportError(error):
+    breaker.recordFailure()
+  elif error == None or isinstance(error, GitError):
+    breaker.recordSuccess(duration)
+
+
+def _parseRefList(output):
+  '''
+  Parse the output of git ls-remote / for-each-ref into a dictionary.
+  Only branches and tags are taken into account (peeled tags are skipped).
+
+  :param str output: command output with lines formatted as "<hash> <ref>"
+
+  :return: dictionary with the ref name as key and the object hash as value
+  :rtype:  dict
+  '''
+  refs = dict()
+  for line in output.splitlines():
+    partials = line.split(None, 1)
+    if len(partials) != 2 or partials[1].endswith('^{}'):
+      continue
+    if partials[1].startswith('refs/heads/') or partials[1].startswith('refs/tags/'):
+      refs[partials[1]] = partials[0]
+  return refs
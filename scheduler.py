@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import heapq
+import itertools
+import threading
+import time
+from state import getRepositoryKey
+
+class Scheduler():
+
+  def __init__(self, state, workers=1, large_workers=1, large_size=1073741824, large_duration=600):
+    '''
+    Initialize a scheduler which orders the repositories of a task run.
+
+    Repositories changed since their last sync come first, followed by the
+    ones without activity information and the unchanged ones. Within these
+    groups shorter syncs (by historical duration) are preferred, then the
+    most stale ones. Large repositories are scheduled in a separate lane
+    which never occupies all workers.
+
+    :param StateStore state:     state store with the history of previous runs
+    :param int workers:          number of repositories synced in parallel
+    :param int large_workers:    maximum number of large repositories synced in parallel
+    :param int large_size:       cache size in bytes from which a repository is large
+    :param int large_duration:   sync duration in seconds from which a repository is large
+    '''
+    if workers < 1 or large_workers < 1:
+      raise ValueError('Number of workers must be at least 1')
+    self.state = state
+    self.workers = workers
+    self.large_workers = min(large_workers, workers - 1) if workers > 1 else 1
+    self.large_size = large_size
+    self.large_duration = large_duration
+
+    self._condition = threading.Condition()
+    self._lanes = {'small': list(), 'large': list()}
+    self._running = {'small': 0, 'large': 0}
+    self._lane_of = dict()
+    self._counter = itertools.count()
+    self._stopped = False
+
+
+  def add(self, repository):
+    '''
+    Add a repository to be synced
+
+    :param Repository repository: repository to be synced
+    '''
+    values = self.state.getRepository(getRepositoryKey(repository.source))
+    lane = 'large' if self.isLarge(values) else 'small'
+    entry = (self.getPriority(repository.source, values), next(self._counter), repository)
+    with self._condition:
+      heapq.heappush(self._lanes[lane], entry)
+      self._condition.notify()
+
+
+  def get(self):
+    '''
+    Get the next repository to be synced (blocks while only large
+    repositories are left and their lane is fully occupied)
+
+    :return: next repository (None if there is no repository left)
+    :rtype:  Repository
+    '''
+    with self._condition:
+      while not self._stopped:
+        small = self._lanes['small']
+        large = self._lanes['large']
+        large_free = self._running['large'] < self.large_workers
+        if len(large) > 0 and large_free and \
+          (len(small) == 0 or (self.workers > 1 and large[0][0] < small[0][0])):
+          lane = 'large'
+        elif len(small) > 0:
+          lane = 'small'
+        elif len(large) > 0:
+          self._condition.wait()
+          continue
+        else:
+          return None
+
+        repository = heapq.heappop(self._lanes[lane])[2]
+        self._running[lane] += 1
+        self._lane_of[id(repository)] = lane
+        return repository
+      return None
+
+
+  def done(self, repository):
+    '''
+    Mark a repository returned by get as finished
+
+    :param Repository repository: finished repository
+    '''
+    with self._condition:
+      lane = self._lane_of.pop(id(repository), None)
+      if lane != None:
+        self._running[lane] -= 1
+      self._condition.notify_all()
+
+
+  def stop(self):
+    '''
+    Stop handing out repositories
+    '''
+    with self._condition:
+      self._stopped = True
+      self._condition.notify_all()
+
+
+  def run(self, worker):
+    '''
+    Sync all added repositories with the configured number of workers.
+    This is a blocking method!
+
+    :param callable worker: function called with each repository
+    '''
+    if self.workers == 1:
+      self._work(worker)
+      return
+
+    threads = list()
+    for _i in range(self.workers):
+      thread = threading.Thread(target=self._work, args=(worker,), daemon=True)
+      thread.start()
+      threads.append(thread)
+    try:
+      for thread in threads:
+        while thread.is_alive():
+          thread.join(0.5)
+    except KeyboardInterrupt as e:
+      self.stop()
+      raise e
+
+
+  def isLarge(self, values):
+    '''
+    Check if a repository belongs to the lane of large repositories
+
+    :param dict values: recorded values of the repository (see StateStore)
+
+    :rtype: bool
+    '''
+    return values.get('size', 0) >= self.large_size or values.get('duration', 0) >= self.large_duration
+
+
+  def getPriority(self, remote, values):
+    '''
+    Get the priority of a repository (lower values are synced first)
+
+    :param RemoteRepository remote: source remote repository
+    :param dict values:             recorded values of the repository (see StateStore)
+
+    :return: priority
+    :rtype:  tuple
+    '''
+    synced_at = values.get('synced_at')
+    if synced_at == None:
+      group = 0 # Never synced
+    elif remote.last_activity == None:
+      group = 1
+    elif remote.last_activity > synced_at:
+      group = 0
+    else:
+      group = 2
+
+    staleness = time.time() - synced_at if synced_at != None else float('inf')
+    return (group, values.get('duration', 0), -staleness)
+
+
+  def _work(self, worker):
+    while True:
+      repository = self.get()
+      if repository == None:
+        return
+      try:
+        worker(repository)
+      finally:
+        self.done(repository)
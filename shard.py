@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import bisect
+import hashlib
+
+class HashRing():
+
+  def __init__(self, nodes, replicas=100):
+    '''
+    Initialize a consistent hash ring. Each node is placed on the ring several
+    times, so adding or removing a node only moves the keys of that node.
+
+    :param list nodes:   node names
+    :param int replicas: number of points per node on the ring
+
+    :raises ValueError: if no or duplicate nodes are given
+    '''
+    if len(nodes) == 0:
+      raise ValueError('Hash ring needs at least one node')
+    if len(set(nodes)) != len(nodes):
+      raise ValueError('Node names of the hash ring must be unique')
+    if replicas < 1:
+      raise ValueError('Number of replicas must be at least 1')
+    self.nodes = list(nodes)
+    self._points = sorted((_hash(node + '#' + str(i)), node) for node in nodes for i in range(replicas))
+    self._hashes = [point[0] for point in self._points]
+
+
+  def getNode(self, key):
+    '''
+    Get the node owning the given key
+
+    :param str key: key (e.g. source hoster and repository name)
+
+    :return: node name
+    :rtype:  str
+    '''
+    index = bisect.bisect(self._hashes, _hash(key)) % len(self._points)
+    return self._points[index][1]
+
+
+class Shard():
+
+  def __init__(self, ring, node):
+    '''
+    Initialize the shard of one git-mirror instance
+
+    :param HashRing ring: hash ring shared by all instances
+    :param str node:      node name of this instance
+
+    :raises ValueError: if the node is not part of the ring
+    '''
+    if node not in ring.nodes:
+      raise ValueError('Node \'' + str(node) + '\' is not part of the sharding nodes')
+    self.ring = ring
+    self.node = node
+
+
+  def isOwner(self, key):
+    '''
+    Check whether this instance owns the given key
+
+    :param str key: repository key (see getRepositoryKey)
+
+    :return: True if this instance is responsible for the key
+    :rtype:  bool
+    '''
+    return self.ring.getNode(key) == self.node
+
+
+def getShard(config, node=None):
+    '''
+    Get the shard of this instance
+
+    :param dict config: sharding configuration (nodes, node, replicas)
+    :param str node:    node name overriding the one of the configuration
+
+    :return: shard (None if sharding is not configured)
+    :rtype:  Shard
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    if node == None:
+      node = config.get('node')
+    if 'nodes' not in config:
+      if node != None:
+        raise ValueError('Node name given but no sharding nodes configured')
+      return None
+    if node == None:
+      raise ValueError('Sharding is configured but the node name of this instance is missing')
+    return Shard(HashRing(config['nodes'], int(config.get('replicas', 100))), node)
+
+
+def _hash(value):
+  return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
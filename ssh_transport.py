@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import os
+import shlex
+
+class SshTransport():
+
+  def __init__(self, control_path, control_persist=600, key=None, host_key_checking='accept-new'):
+    '''
+    Initialize an SSH transport. All git operations using this transport share
+    one authenticated connection per host (OpenSSH connection multiplexing).
+
+    :param str control_path:      directory holding the control sockets
+    :param int control_persist:   seconds an idle master connection is kept open
+    :param str key:               path to the private key (ssh default keys if None)
+    :param str host_key_checking: value of the StrictHostKeyChecking option
+    '''
+    if host_key_checking not in ['yes', 'no', 'accept-new']:
+      raise ValueError('StrictHostKeyChecking \'' + str(host_key_checking) + '\' is not supported')
+    self.control_path = control_path
+    self.control_persist = control_persist
+    self.key = key
+    self.host_key_checking = host_key_checking
+
+
+  def getEnvironment(self):
+    '''
+    Get the environment variables making git use this transport
+
+    :return: environment variables
+    :rtype:  dict
+    '''
+    os.makedirs(self.control_path, mode = 0o700, exist_ok = True)
+    command = ['ssh',
+      '-o', 'BatchMode=yes',
+      '-o', 'StrictHostKeyChecking=' + self.host_key_checking,
+      '-o', 'ControlMaster=auto',
+      '-o', 'ControlPath=' + os.path.join(self.control_path, '%C'),
+      '-o', 'ControlPersist=' + str(self.control_persist)]
+    if self.key != None:
+      command += ['-i', self.key, '-o', 'IdentitiesOnly=yes']
+    return {'GIT_SSH_COMMAND': ' '.join(shlex.quote(arg) for arg in command)}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+import json
+import os
+import threading
+
+class StateStore():
+
+  def __init__(self, path):
+    '''
+    Initialize a state store instance. The state is kept in a JSON file
+    and contains historical values of previous runs (e.g. sync timings).
+
+    :param str path: Path to the JSON file holding the state
+    '''
+    self.path = path
+    self._lock = threading.RLock()
+    self._data = {'repositories': dict(), 'values': dict()}
+    self._load()
+
+
+  def getRepository(self, key):
+    '''
+    Get the recorded values of a repository
+
+    :param str key: repository key (see getRepositoryKey)
+
+    :return: copy of the recorded values (empty if unknown)
+    :rtype:  dict
+    '''
+    with self._lock:
+      return dict(self._data['repositories'].get(key, dict()))
+
+
+  def updateRepository(self, key, **values):
+    '''
+    Update the recorded values of a repository
+
+    :param str key: repository key (see getRepositoryKey)
+    '''
+    with self._lock:
+      if key not in self._data['repositories']:
+        self._data['repositories'][key] = dict()
+      self._data['repositories'][key].update(values)
+
+
+  def getRepositories(self):
+    '''
+    Get the recorded values of all repositories
+
+    :return: dictionary with the repository key as key
+    :rtype:  dict
+    '''
+    with self._lock:
+      return {key: dict(values) for key, values in self._data['repositories'].items()}
+
+
+  def get(self, key, default=None):
+    '''
+    Get a global value
+
+    :param str key: value name
+    :param default: returned if the value does not exist
+    '''
+    with self._lock:
+      return self._data['values'].get(key, default)
+
+
+  def set(self, key, value):
+    '''
+    Set a global value
+
+    :param str key: value name
+    :param value:   JSON serializable value
+    '''
+    with self._lock:
+      self._data['values'][key] = value
+
+
+  def save(self):
+    '''
+    Write the state to disk (atomically replaces the existing file)
+    '''
+    with self._lock:
+      directory = os.path.dirname(self.path)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      tmp_path = self.path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(self._data, f)
+      os.replace(tmp_path, self.path)
+
+
+  def _load(self):
+    if not os.path.isfile(self.path):
+      return
+    try:
+      with open(self.path, 'r') as f:
+        data = json.load(f)
+    except ValueError:
+      return # Start with an empty state if the file is corrupt
+    if isinstance(data, dict):
+      self._data['repositories'].update(data.get('repositories', dict()))
+      self._data['values'].update(data.get('values', dict()))
+
+
+def getRepositoryKey(remote):
+  '''
+  Get the key identifying a source repository in the state store
+
+  :param RemoteRepository remote: source remote repository
+
+  :return: repository key
+  :rtype:  str
+  '''
+  return remote.source_name + '/' + remote.name
@@ -5,15 +5,36 @@
 # This software is licensed under GPLv3, see LICENSE for details. 
 
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from git_command import GitError, parseSize
 from hoster import BaseHoster
-from repo import Repository, RemoteRepository
+from journal import Journal
+from matcher import RepositoryMatcher, getRepositoryMatcher
+from pipeline import Stage
+from plan import Plan
+from rate_limit import RateLimiter
+from scheduler import Scheduler
+from remote_repo import removeUrlCredentials
+from repo import getCachePath, Repository, RemoteRepository, lsRemote
+from state import StateStore, getRepositoryKey
+from transfer import DEFAULT_PROFILE, getTransferProfile
+from verify import DriftReport, compareRefs
 
-def getTaskInstance(config, hoster):
+# Incremental listings reach back this many seconds before the high-water mark
+# (GitLab updates last_activity_at at most once per hour)
+LISTING_MARGIN = 3600
+
+def getTaskInstance(config, hoster, state=None, profiles=dict(), shard=None):
     '''
     Get a Task instance
 
-    :param dict config: task configuration
-    :param dict hoster: hoster collection
+    :param dict config:       task configuration
+    :param dict hoster:       hoster collection
+    :param StateStore state:  state store shared between tasks
+    :param dict profiles:     available transfer profiles
+    :param Shard shard:       shard of this instance (None to mirror all repositories)
 
     :return: Task object
     :rtype:  Task
@@ -43,7 +64,12 @@ def getTaskInstance(config, hoster):
     else:
       sync = 'manual'
 
-    task = Task(source, destinations, sync)
+    task = Task(source, destinations, sync, state)
+
+    if 'mode' in config:
+      if config['mode'] not in ['all', 'metadata', 'data']:
+        raise ValueError('Task mode \'' + config['mode'] + '\' is not supported')
+      task.mode = config['mode']
 
     if 'create' in config and config['create'] == False:
       task.create = False
@@ -56,49 +82,697 @@ def getTaskInstance(config, hoster):
       task.repositories = config['repositories']
 
     if 'ignored-repositories' in config:
-      task.ignored_repositories = config['ignored-repositories']
+      task.ignored_repositories = getRepositoryMatcher(config['ignored-repositories'])
+    if config.get('included-repositories') != None:
+      task.included_repositories = getRepositoryMatcher(config['included-repositories'])
+
+    if 'resume-max-age' in config:
+      task.resume_max_age = int(config['resume-max-age'])
+
+    if 'workers' in config:
+      task.workers = int(config['workers'])
+    if 'large-workers' in config:
+      task.large_workers = int(config['large-workers'])
+    if 'large-repository-size' in config:
+      task.large_repository_size = int(config['large-repository-size'])
+    if 'large-repository-duration' in config:
+      task.large_repository_duration = int(config['large-repository-duration'])
+    if task.workers < 1 or task.large_workers < 1:
+      raise ValueError('Number of workers must be at least 1')
+    if 'push-workers' in config:
+      task.push_workers = int(config['push-workers'])
+    if 'pipeline-queue' in config:
+      task.pipeline_queue = int(config['pipeline-queue'])
+    if (task.push_workers != None and task.push_workers < 1) or (task.pipeline_queue != None and task.pipeline_queue < 1):
+      raise ValueError('Number of push workers and pipeline queue size must be at least 1')
+
+    if 'delete-workers' in config:
+      task.delete_workers = int(config['delete-workers'])
+    if 'delete-rate' in config:
+      task.delete_rate = float(config['delete-rate'])
+    if 'delete-threshold' in config:
+      task.delete_threshold = float(config['delete-threshold'])
+    if task.delete_workers < 1 or task.delete_rate <= 0:
+      raise ValueError('Number of delete workers and delete rate must be positive')
+
+    if 'incremental-listing' in config:
+      task.incremental_listing = config['incremental-listing'] == True
+    if 'full-listing-interval' in config:
+      task.full_listing_interval = int(config['full-listing-interval'])
+
+    if 'remote-mirrors' in config:
+      task.remote_mirrors = config['remote-mirrors'] == True
+    if 'remote-mirror-timeout' in config:
+      task.remote_mirror_timeout = int(config['remote-mirror-timeout'])
+
+    if config.get('seed-chunk-size') != None:
+      task.seed_chunk_size = int(parseSize(config['seed-chunk-size']))
+
+    if 'ref-probe' in config:
+      task.ref_probe = config['ref-probe'] == True
+
+    if 'verify-workers' in config:
+      task.verify_workers = int(config['verify-workers'])
+    if task.verify_workers < 1:
+      raise ValueError('Number of verify workers must be at least 1')
+
+    task.transfer_profile = getTransferProfile(config, profiles)
+    task.shard = shard
 
     return task
 
 
 class Task():
 
-  def __init__(self, source, destinations, sync):
+  def __init__(self, source, destinations, sync, state=None):
     '''
     Initialize a Task instance
 
     :param BaseHoster source: source hoster
     :param dict destinations: dictionary with BaseHoster as destinations
     :param str sync:          sync mode (all, public, internal, private, manual)
+    :param StateStore state:  state store with the history of previous runs
     '''
     self.source = source
     self.destinations = destinations
     self.sync = sync
+    if state == None:
+      state = StateStore(getCachePath() + '/state.json')
+    self.state = state
 
     # Default values
+    self.mode = 'all'
     self.create = True
     self.delete = False
     self.name = None
     self.repositories = None
-    self.ignored_repositories = list()
+    self.ignored_repositories = RepositoryMatcher()
+    self.included_repositories = None
+    self.resume_max_age = 86400
+    self.workers = 1
+    self.large_workers = 1
+    self.push_workers = None
+    self.pipeline_queue = None
+    self.large_repository_size = 1073741824
+    self.large_repository_duration = 600
+    self.delete_workers = 4
+    self.delete_rate = 1.0
+    self.delete_threshold = 0.25
+    self.verify_workers = 8
+    self.incremental_listing = False
+    self.ref_probe = True
+    self.remote_mirrors = False
+    self.remote_mirror_timeout = 600
+    self.remote_mirror_poll_interval = 5
+    self.seed_chunk_size = None
+    self.full_listing_interval = 86400
+    self.transfer_profile = None
+    self.shard = None
+    self.timings = dict()
+    self._timings_lock = threading.Lock()
 
 
   def run(self, verbose):
     '''
     Run mirror task now. This is a blocking method!
+
+    Completed steps are recorded in a journal. When a previous run has been
+    interrupted, the steps recorded there are skipped.
+
+    In mode 'metadata' only the hoster APIs are used (create, update and delete
+    repositories). In mode 'data' only the git data is synced; existing
+    destination repositories are looked up in one listing per destination and
+    not updated.
+    '''
+    self.timings = dict()
+    run_start = time.time()
+    journal = Journal(getCachePath() + '/journal/' + self._getJournalName() + '.log', self.resume_max_age)
+    if journal.begin() and verbose:
+      print('Resume interrupted run of task \'' + str(self.name) + '\'')
+
+    try:
+      start = time.time()
+      listed_at = start
+      changed_since = self._getListingChangedSince()
+      if changed_since != None and verbose:
+        print('List repositories changed since ' + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(changed_since)))
+      source_remotes = self._getJournaledSourceRemotes(journal, verbose, changed_since)
+      self._addTiming('list', start)
+
+      start = time.time()
+      destination_lists = None
+      if self.mode == 'data':
+        destination_lists = self._getDestinationLists(verbose)
+      repositories = list()
+      destination_names = dict() # Destinations each repository has to be synced to
+      for source_remote in source_remotes:
+        key = getRepositoryKey(source_remote)
+        data = journal.getData('resolved', key)
+        failed = list()
+        if data != None:
+          repository = self._newRepository(source_remote, {
+            name: RemoteRepository.fromDict(values, self.destinations[name])
+            for name, values in data.items() if name in self.destinations
+          })
+        else:
+          repository = self._createRepository(source_remote, self.destinations, destination_lists, failed)
+          if repository != None:
+            journal.record('resolved', key, data = {name: remote.toDict() for name, remote in repository.destinations.items()})
+        destination_names[key] = failed + (list(repository.destinations) if repository != None else list())
+        if repository != None and len(repository.destinations) > 0:
+          repositories.append(repository)
+          if verbose and self.sync != 'manual':
+            print('Found repository \'' + source_remote.name + '\'')
+
+      self._addTiming('resolve', start)
+
+      probes = dict()
+      if self.mode != 'metadata':
+        start = time.time()
+        probes = self._probeRefStates(repositories, verbose)
+        self._addTiming('probe', start)
+
+      if self.remote_mirrors and self.mode != 'metadata':
+        start = time.time()
+        self._syncRemoteMirrors(repositories, journal, verbose, probes)
+        self._addTiming('mirror', start)
+
+      start = time.time()
+      if self.mode != 'metadata':
+        scheduler = Scheduler(self.state, self.workers, self.large_workers, self.large_repository_size,
+          self.large_repository_duration)
+        for repository in repositories:
+          scheduler.add(repository)
+        push_stage = None
+        if self.push_workers != None:
+          # Fetch with the scheduler workers, push with a separate pool
+          push_stage = Stage(lambda item: self._pushRepository(item[0], journal, verbose, *item[1:]),
+            self.push_workers, self.pipeline_queue)
+          push_stage.start()
+        try:
+          scheduler.run(lambda repository: self._syncRepository(repository, journal, verbose,
+            probes.get(getRepositoryKey(repository.source)), push_stage))
+          if push_stage != None:
+            push_stage.close()
+        except KeyboardInterrupt as e:
+          if push_stage != None:
+            push_stage.stop()
+          raise e
+        self._updateListingMark(source_remotes, destination_names, changed_since, listed_at)
+      self._addTiming('sync', start)
+
+      start = time.time()
+      if self.delete and self.mode != 'data':
+        self._deleteRepositories(self._getObsoleteRepositories(verbose), verbose)
+      self._addTiming('delete', start)
+    finally:
+      # Keep the timings and activity marks of the synced repositories even if the run fails
+      self.state.save()
+    journal.complete()
+    self._addTiming('total', run_start)
+
+
+  def _syncRepository(self, repository, journal, verbose, in_sync=None, push_stage=None):
+    '''
+    Fetch a repository and push it to all its destinations. Destinations
+    whose hoster is unavailable (open circuit breaker) are skipped and synced
+    on the next run.
+
+    :param Repository repository: repository to be synced
+    :param Journal journal:       journal of the current run
+    :param bool verbose:          print more output to the console
+    :param bool in_sync:          whether the destinations are in sync according to the hoster APIs
+                                  (compared with git ls-remote if None)
+    :param Stage push_stage:      stage the fetched repository is handed over to for pushing
+                                  (pushed by the calling thread if None)
+    '''
+    try:
+      if verbose:
+        print('Mirror repository \'' + repository.source.name + '\'')
+      key = getRepositoryKey(repository.source)
+      start = time.time()
+      if self._isUntouched(repository.source, repository.destinations):
+        if verbose:
+          print('Repository \'' + repository.source.name + '\' is untouched since the last sync')
+        return
+      available = [name for name, remote in repository.destinations.items() if remote.hoster.isAvailable()]
+      if not repository.source.hoster.isAvailable() or len(available) == 0:
+        if verbose:
+          print('SyncError: Skip repository \'' + repository.source.name + '\': hosters unavailable')
+        return
+      if verbose and len(available) < len(repository.destinations):
+        print('Skip unavailable destinations of repository \'' + repository.source.name + '\': ' +
+          ', '.join(name for name in repository.destinations if name not in available))
+      if not journal.isDone('fetched', key):
+        if in_sync == None:
+          phase_start = time.time()
+          in_sync = repository.isInSync(available)
+          self._addTiming('compare', phase_start)
+        if in_sync:
+          if verbose:
+            print('Repository \'' + repository.source.name + '\' is already in sync')
+          self.state.updateRepository(key, synced_at = time.time(), activity = repository.source.last_activity,
+            destinations = available)
+          return
+      pending = [name for name in available if not journal.isDone('pushed', key, name)]
+      if len(pending) > 0 and (not journal.isDone('fetched', key) or repository.local_path == None):
+        phase_start = time.time()
+        repository.clone()
+        self._addTiming('fetch', phase_start)
+        journal.record('fetched', key)
+    except KeyboardInterrupt as e:
+      raise e
+    except Exception as e:
+      self._printSyncError(repository, e, verbose)
+      return # ignore this repository when an error occures
+
+    if push_stage != None:
+      push_stage.put((repository, available, pending, time.time() - start))
+    else:
+      self._pushRepository(repository, journal, verbose, available, pending, time.time() - start)
+
+
+  def _pushRepository(self, repository, journal, verbose, available, pending, duration=0.0):
+    '''
+    Push a fetched repository to the pending destinations and record the
+    synced destinations in the state
+
+    :param Repository repository: repository to be pushed
+    :param Journal journal:       journal of the current run
+    :param bool verbose:          print more output to the console
+    :param list available:        names of the available destinations
+    :param list pending:          names of the destinations to be pushed (the other ones are synced already)
+    :param float duration:        time spent on the repository before (without waiting for a push worker)
+    '''
+    try:
+      key = getRepositoryKey(repository.source)
+      start = time.time()
+      results = dict()
+      if len(pending) > 0:
+        results = repository.push(pending)
+        self._addTiming('push', start)
+      synced = [name for name in available if name not in results]
+      for name, result in results.items():
+        if result.isSuccessful():
+          journal.record('pushed', key, name)
+          synced.append(name)
+        elif verbose:
+          print('SyncError: Pushing repository \'' + repository.source.name + '\' to \'' + name + '\' failed after ' +
+            str(result.attempts) + ' attempt(s): ' + str(result.error))
+          if isinstance(result.error, GitError) and len(result.error.stderr) > 0:
+            print(result.error.stderr.strip())
+      # Failed destinations are missing in the state, so the next run does not skip the repository
+      self.state.updateRepository(key, duration = duration + time.time() - start, size = repository.getCacheSize(),
+        synced_at = time.time(), activity = repository.source.last_activity, destinations = synced,
+        fetch_bytes = repository.fetch_bytes, push_bytes = repository.push_bytes)
+    except KeyboardInterrupt as e:
+      raise e
+    except Exception as e:
+      self._printSyncError(repository, e, verbose)
+
+
+  def _printSyncError(self, repository, error, verbose):
+    '''
+    Print the error which stopped the sync of a repository (only if verbose)
+    '''
+    if verbose:
+      print('SyncError: Skip repository \'' + repository.source.name + '\': ' + str(error))
+      if isinstance(error, GitError) and len(error.stderr) > 0:
+        print(error.stderr.strip())
+
+
+  def _syncRemoteMirrors(self, repositories, journal, verbose, probes=dict()):
+    '''
+    Let the source hoster push the repositories to their destinations (e.g.
+    GitLab remote mirrors). The mirrors of all repositories are triggered
+    first and then polled together until remote_mirror_timeout, so the
+    hoster updates them concurrently. Destinations updated this way are
+    recorded as pushed in the journal, the other ones are pushed with git.
+
+    :param list repositories: repositories of the current run
+    :param Journal journal:   journal of the current run
+    :param bool verbose:      print more output to the console
+    :param dict probes:       results of _probeRefStates (repositories in sync are skipped)
+    '''
+    triggered = dict() # Repository key -> (repository, dictionary with the destination name as key)
+    for repository in repositories:
+      key = getRepositoryKey(repository.source)
+      if probes.get(key) == True or self._isUntouched(repository.source, repository.destinations):
+        continue
+      if not self.source.isAvailable():
+        break
+      names = [name for name, remote in repository.destinations.items()
+        if not journal.isDone('pushed', key, name) and remote.hoster.isAvailable()]
+      if len(names) > 0:
+        pending = self._triggerRemoteMirrors(repository, names, verbose)
+        if len(pending) > 0:
+          triggered[key] = (repository, pending)
+
+    deadline = time.time() + self.remote_mirror_timeout
+    while len(triggered) > 0 and time.time() < deadline:
+      time.sleep(self.remote_mirror_poll_interval)
+      for key, (repository, pending) in list(triggered.items()):
+        source_remote = repository.source
+        try:
+          mirrors = {mirror.id: mirror for mirror in self.source.getRemoteMirrors(source_remote)}
+        except KeyboardInterrupt as e:
+          raise e
+        except Exception:
+          continue # Try again with the next poll
+        for name, (mirror_id, last_update_at) in list(pending.items()):
+          mirror = mirrors.get(mirror_id)
+          if mirror != None and (mirror.last_update_at == last_update_at or mirror.update_status in ['scheduled', 'started']):
+            continue # Update still running
+          del pending[name]
+          if mirror != None and mirror.update_status == 'finished':
+            journal.record('pushed', key, name)
+          elif verbose:
+            print('Remote mirror of \'' + source_remote.name + '\' to \'' + name + '\' failed: ' +
+              str(mirror.last_error if mirror != None else 'mirror removed'))
+        if len(pending) == 0:
+          del triggered[key]
+    if verbose:
+      for repository, pending in triggered.values():
+        print('Remote mirrors of \'' + repository.source.name + '\' to ' + ', '.join(pending) + ' timed out, pushing with git')
+
+
+  def _triggerRemoteMirrors(self, repository, names, verbose):
+    '''
+    Trigger the remote mirrors of a repository to the given destinations. The
+    mirrors are created or enabled if needed. Destinations using the SSH
+    transport are skipped. Mirrors created by this tool whose destination is
+    not configured anymore are deleted.
+
+    :param Repository repository: repository to be synced
+    :param list names:            destination hoster names
+    :param bool verbose:          print more output to the console
+
+    :return: dictionary with the destination name as key and the mirror id and its last update time as value
+    :rtype:  dict
     '''
-    repositories = list()
+    source_remote = repository.source
+    key = getRepositoryKey(source_remote)
+    try:
+      mirrors = self.source.getRemoteMirrors(source_remote)
+    except KeyboardInterrupt as e:
+      raise e
+    except Exception as e:
+      if verbose:
+        print('Remote mirrors of \'' + source_remote.name + '\' not available, pushing with git: ' + str(e))
+      return dict()
+
+    # URLs of the mirrors created by this tool (other mirrors are left alone)
+    owned = set(self.state.getRepository(key).get('remote_mirrors', list()))
+    urls = {name: removeUrlCredentials(remote.git_url) for name, remote in repository.destinations.items()}
+    if len(repository.destinations) == len(self.destinations):
+      for mirror in mirrors:
+        if mirror.url not in owned or mirror.url in urls.values():
+          continue
+        try:
+          self.source.deleteRemoteMirror(source_remote, mirror)
+          owned.discard(mirror.url)
+          if verbose:
+            print('Remote mirror of \'' + source_remote.name + '\' to ' + mirror.url + ' deleted (destination removed)')
+        except KeyboardInterrupt as e:
+          raise e
+        except Exception as e:
+          if verbose:
+            print('Remote mirror of \'' + source_remote.name + '\' to ' + mirror.url + ' not deleted: ' + str(e))
+
+    triggered = dict()
+    for name in names:
+      remote = repository.destinations[name]
+      if remote.ssh_transport != None:
+        continue # The hoster needs the credentials of an HTTPS URL
+      try:
+        matches = [mirror for mirror in mirrors if mirror.url == urls[name]]
+        if len(matches) == 0:
+          mirror = self.source.createRemoteMirror(source_remote, remote.getGitUrl())
+        else:
+          mirror = matches[0]
+          if not mirror.enabled or mirror.update_status in ['failed', 'to_retry']:
+            # The credentials may have changed since the mirror was created
+            self.source.updateRemoteMirror(source_remote, mirror, remote.getGitUrl())
+        owned.add(urls[name])
+        self.source.syncRemoteMirror(source_remote, mirror)
+        triggered[name] = (mirror.id, mirror.last_update_at)
+      except KeyboardInterrupt as e:
+        raise e
+      except Exception as e:
+        if verbose:
+          print('Remote mirror of \'' + source_remote.name + '\' to \'' + name + '\' not updated: ' + str(e))
+    self.state.updateRepository(key, remote_mirrors = sorted(owned))
+    return triggered
+
+
+  def _probeRefStates(self, repositories, verbose):
+    '''
+    Compare the branch and tag tips of the source with the ones of the
+    destinations using batched hoster API requests (see BaseHoster.getRefStates).
+    Repositories untouched since their last sync are not probed.
+
+    :param list repositories: repositories of the current run
+    :param bool verbose:      print more output to the console
+
+    :return: dictionary with the repository key as key and True if all destinations are in sync as value.
+             Repositories which could not be compared completely are missing.
+    :rtype:  dict
+    '''
+    pending = [repository for repository in repositories if not self._isUntouched(repository.source, repository.destinations)]
+    if not self.ref_probe or len(pending) == 0:
+      return dict()
+
+    try:
+      source_states = self.source.getRefStates([repository.source for repository in pending])
+      if len(source_states) == 0:
+        return dict()
+      destination_states = dict()
+      for key, destination in self.destinations.items():
+        remotes = [repository.destinations[key] for repository in pending
+          if key in repository.destinations and repository.source.name in source_states]
+        destination_states[key] = destination.getRefStates(remotes) if len(remotes) > 0 else dict()
+    except KeyboardInterrupt as e:
+      raise e
+    except Exception as e:
+      if verbose:
+        print('Probing refs failed, falling back to git ls-remote: ' + str(e))
+      return dict()
+
+    probes = dict()
+    for repository in pending:
+      source_refs = source_states.get(repository.source.name)
+      if source_refs == None:
+        continue
+      states = [destination_states[key].get(remote.name) for key, remote in repository.destinations.items()]
+      if any(refs != None and refs != source_refs for refs in states):
+        probes[getRepositoryKey(repository.source)] = False
+      elif all(refs != None for refs in states):
+        probes[getRepositoryKey(repository.source)] = True
+    return probes
+
+
+  def _addTiming(self, phase, start):
+    '''
+    Add the time elapsed since start to the given phase of the current run
+
+    :param str phase:   phase name (list, resolve, probe, compare, mirror, fetch, push, sync, delete, total)
+    :param float start: start time of the measurement
+    '''
+    with self._timings_lock:
+      self.timings[phase] = self.timings.get(phase, 0.0) + time.time() - start
+
+
+  def plan(self, verbose):
+    '''
+    Determine what a run of this task would do. Only read operations are
+    performed on the hoster APIs and the git remotes.
+
+    :return: plan of the task run
+    :rtype:  Plan
+    '''
+    plan = Plan(self.name)
+    hosters = [self.source] + [hoster for hoster in self.destinations.values() if hoster is not self.source]
+    api_calls = sum(hoster.api_calls for hoster in hosters)
+    api_time = sum(hoster.api_time for hoster in hosters)
+
+    history = self.state.getRepositories()
+    durations = [values['duration'] for values in history.values() if 'duration' in values]
+    if len(durations) > 0:
+      average_duration = sum(durations) / len(durations)
+    else:
+      average_duration = None
+
+    writes = 0
+    for source_remote in self._getSourceRemotes(verbose, self._getListingChangedSince()):
+      repository = self._newRepository(source_remote, dict())
+      values = history.get(getRepositoryKey(source_remote), dict())
+      # No git data is synced in mode 'metadata'
+      untouched = self.mode == 'metadata' or self._isUntouched(source_remote, self.destinations)
+      local_refs = repository.getLocalRefs()
+      source_refs = None
+      if not untouched:
+        try:
+          source_refs = lsRemote(source_remote, repository.fetch_profile)
+        except ConnectionError:
+          pass
+
+      if untouched:
+        pass # No fetch needed
+      elif repository.local_path == None:
+        if 'size' in values:
+          plan.fetch_bytes += values['size']
+        else:
+          plan.unknown_sizes += 1
+      elif source_refs == None or any(local_refs.get(ref) != obj for ref, obj in source_refs.items()):
+        if 'fetch_bytes' in values:
+          plan.fetch_bytes += values['fetch_bytes']
+        else:
+          plan.unknown_sizes += 1 # New objects are unknown until they are fetched
+
+      synced = False
+      needs_push = False
+      for key in self.destinations:
+        destination = self.destinations[key]
+        try:
+          destination_remote = destination.getRepository(source_remote.name)
+          destination_refs = source_refs if untouched else lsRemote(destination_remote, self._getTransferProfile(destination))
+          if self.mode != 'data':
+            plan.addAction(key, 'update', source_remote.name)
+            writes += 1
+        except LookupError:
+          if not self.create or destination.ignored_repositories.matches(source_remote):
+            continue
+          plan.addAction(key, 'create', source_remote.name)
+          writes += 1
+          destination_refs = dict()
+        except KeyboardInterrupt as e:
+          raise e
+        except:
+          continue # Skip this destination when communication errors occur
+
+        synced = True
+        if self.mode != 'metadata' and source_refs != destination_refs:
+          needs_push = True
+          plan.addAction(key, 'push', source_remote.name)
+          plan.push_bytes += repository.estimateTransferSize(source_refs or local_refs, destination_refs)
+
+      if synced:
+        if not needs_push:
+          plan.up_to_date += 1
+        if untouched and not needs_push:
+          pass # Skipped without any git call
+        elif 'duration' in values:
+          plan.runtime += values['duration']
+        elif average_duration != None:
+          plan.runtime += average_duration
+        else:
+          plan.unknown_runtimes += 1
+
+    if self.delete and self.mode != 'data':
+      obsolete_repositories = self._getObsoleteRepositories(verbose)
+      for key in obsolete_repositories:
+        for repo in obsolete_repositories[key]:
+          plan.addAction(key, 'delete', repo.name)
+          writes += 1
+
+    reads = sum(hoster.api_calls for hoster in hosters) - api_calls
+    read_time = sum(hoster.api_time for hoster in hosters) - api_time
+    plan.api_calls = reads + writes
+    if reads > 0:
+      plan.runtime += plan.api_calls * read_time / reads
+    return plan
+
+
+  def verify(self, verbose, repair=True):
+    '''
+    Compare the ref tips of the source with the ones of all destinations
+    (git ls-remote in parallel, no objects are transferred). Drifted
+    repositories are fetched and pushed to the drifted destinations only.
+
+    :param bool verbose: print more output to the console
+    :param bool repair:  push the drifted repositories
+
+    :return: drift report
+    :rtype:  DriftReport
+    '''
+    report = DriftReport(self.name)
+    source_remotes = self._getSourceRemotes(verbose)
+    destination_lists = self._getDestinationLists(verbose, report)
+
+    def check(source_remote):
+      remotes = dict()
+      for key in destination_lists:
+        remote = destination_lists[key].get(source_remote.name)
+        if remote != None:
+          remotes[key] = remote
+        elif not self.destinations[key].ignored_repositories.matches(source_remote):
+          report.addDrift(source_remote.name, key, {'repository': 'missing'})
+      try:
+        source_refs = lsRemote(source_remote, self._getTransferProfile(self.source))
+      except ConnectionError as e:
+        report.addError(source_remote.name, self.source.name, e)
+        return source_remote, dict()
+      for key, remote in remotes.items():
+        try:
+          drift = compareRefs(source_refs, lsRemote(remote, self._getTransferProfile(self.destinations[key])))
+        except ConnectionError as e:
+          report.addError(source_remote.name, key, e)
+          continue
+        if drift != None:
+          report.addDrift(source_remote.name, key, drift)
+      return source_remote, remotes
+
+    with ThreadPoolExecutor(max_workers = self.verify_workers) as executor:
+      checked = list(executor.map(check, source_remotes))
+    report.checked = len(checked)
+
+    if not repair:
+      return report
+
+    scheduler = Scheduler(self.state, self.workers, self.large_workers, self.large_repository_size,
+      self.large_repository_duration)
+    for source_remote, remotes in checked:
+      drifted = report.getDriftedDestinations(source_remote.name)
+      if len(drifted) > 0:
+        scheduler.add(self._newRepository(source_remote, {key: remotes[key] for key in drifted}))
+
+    def push(repository):
+      try:
+        if verbose:
+          print('Repair repository \'' + repository.source.name + '\' on ' + ', '.join(repository.destinations))
+        repository.clone()
+        for key, result in repository.push().items():
+          report.addRepair(repository.source.name, key, result)
+      except KeyboardInterrupt as e:
+        raise e
+      except Exception as e:
+        report.addError(repository.source.name, self.source.name, e)
+
+    scheduler.run(push)
+    return report
+
+
+  def _getSourceRemotes(self, verbose, changed_since=None):
+    '''
+    Get the source remote repositories to be mirrored by this task
+
+    :param bool verbose:        print more output to the console
+    :param float changed_since: only list repositories with activity since this UNIX timestamp
+                                (ignored with sync mode 'manual')
+
+    :return: list of RemoteRepository objects
+    :rtype:  list
+    '''
+    source_remotes = list()
     if self.sync == 'manual':
       if self.repositories == None:
-        return
+        return source_remotes
       for repo_name in self.repositories:
-        if repo_name not in self.ignored_repositories:
+        if repo_name not in self.ignored_repositories and self._isOwned(repo_name):
           try:
             source_remote = self.source.getRepository(repo_name)
-            if not source_remote.description.startswith('MIRROR:'):
-              repository = self._createRepository(source_remote, self.destinations)
-              if repository != None:
-                repositories.append(repository)
+            if not source_remote.description.startswith('MIRROR:') and not self.ignored_repositories.matches(source_remote):
+              source_remotes.append(source_remote)
           except LookupError:
             if verbose:
               print('Repository \'' + repo_name + '\' not found on \'' + self.source.name + '\'')
@@ -112,67 +786,296 @@ class Task():
               print('ERROR: ' + str(e))
     else:
       try:
-        source_remotes = self.source.getRepositoryList(self.sync)
-        for source_remote in source_remotes:
-          if source_remote.name not in self.ignored_repositories and \
+        for source_remote in self.source.getRepositoryList(self.sync, changed_since, self.included_repositories):
+          if self._isSelected(source_remote) and self._isOwned(source_remote.name) and \
             source_remote.description != None and not source_remote.description.startswith('MIRROR:'):
-            repository = self._createRepository(source_remote, self.destinations)
-            if repository != None:
-              repositories.append(repository)
-              if verbose:
-                print('Found repository \'' + source_remote.name + '\'')
-      except LookupError:
-        if verbose:
-          print('Repository \'' + repo_name + '\' not found on \'' + self.source.name + '\'')
+            source_remotes.append(source_remote)
       except PermissionError:
         if verbose:
           print('Permission denied on hoster \'' + self.source.name + '\'')
-          return # Skip this hoster
       except KeyboardInterrupt as e:
         raise e
       except Exception as e:
         if verbose:
           print('ERROR: ' + str(e))
+    return source_remotes
 
-    for repository in repositories:
+
+  def _isSelected(self, source_remote):
+    '''
+    Check whether a source repository is selected by the include and ignore rules of this task
+
+    :param RemoteRepository source_remote: source remote repository
+
+    :rtype: bool
+    '''
+    if self.ignored_repositories.matches(source_remote):
+      return False
+    return self.included_repositories == None or self.included_repositories.matches(source_remote)
+
+
+  def _isOwned(self, name):
+    '''
+    Check whether a repository belongs to the shard of this instance
+
+    :param str name: repository name
+
+    :return: True if this instance mirrors the repository
+    :rtype:  bool
+    '''
+    if self.shard == None:
+      return True
+    return self.shard.isOwner(self.source.name + '/' + name)
+
+
+  def _isUntouched(self, source_remote, destination_names):
+    '''
+    Check if a repository has not changed since its last sync according to the
+    activity timestamp of the hoster listing. No git call is needed for this.
+    Hosters move the timestamp forward only once within their activity
+    granularity (GitLab: one hour), so the last sync has to be more than this
+    after the last activity. Otherwise the refs are compared as usual.
+
+    :param RemoteRepository source_remote: source remote repository
+    :param destination_names:              names of the destination hosters
+
+    :return: True if the repository has been synced to all destinations since its last change
+    :rtype:  bool
+    '''
+    if not self._isSynced(source_remote, destination_names):
+      return False
+    values = self.state.getRepository(getRepositoryKey(source_remote))
+    if values.get('synced_at') == None:
+      return False
+    return values['synced_at'] > source_remote.last_activity + source_remote.hoster.activity_granularity
+
+
+  def _isSynced(self, source_remote, destination_names):
+    '''
+    Check if a repository has been synced to all destinations at its current
+    activity timestamp
+
+    :param RemoteRepository source_remote: source remote repository
+    :param destination_names:              names of the destination hosters
+
+    :rtype: bool
+    '''
+    values = self.state.getRepository(getRepositoryKey(source_remote))
+    if source_remote.last_activity == None or values.get('activity') == None:
+      return False
+    if any(name not in values.get('destinations', list()) for name in destination_names):
+      return False
+    return source_remote.last_activity <= values['activity']
+
+
+  def _getJournaledSourceRemotes(self, journal, verbose, changed_since=None):
+    '''
+    Get the source remote repositories from the journal or from the source hoster
+
+    :param Journal journal:     journal of the current run
+    :param bool verbose:        print more output to the console
+    :param float changed_since: only list repositories with activity since this UNIX timestamp
+
+    :return: list of RemoteRepository objects
+    :rtype:  list
+    '''
+    data = journal.getData('listed', self.source.name)
+    if data != None:
+      return [RemoteRepository.fromDict(values, self.source) for values in data]
+
+    source_remotes = self._getSourceRemotes(verbose, changed_since)
+    journal.record('listed', self.source.name, data = [remote.toDict() for remote in source_remotes])
+    return source_remotes
+
+
+  def _getListingChangedSince(self):
+    '''
+    Get the time since which the source listing of the next run is incremental
+
+    :return: UNIX timestamp (None if a full listing is needed)
+    :rtype:  float
+    '''
+    if not self.incremental_listing or self.sync == 'manual' or self.mode == 'metadata':
+      return None
+    values = self.state.get('listing/' + self._getJournalName(), dict())
+    if values.get('mark') == None or time.time() - values.get('full_at', 0) >= self.full_listing_interval:
+      return None
+    return values['mark'] - LISTING_MARGIN
+
+
+  def _updateListingMark(self, source_remotes, destination_names, changed_since, listed_at):
+    '''
+    Advance the high-water mark of the incremental listing to the most recent
+    activity seen. Repositories which could not be synced to their destinations
+    (including the ones which could not be resolved because of errors) keep the
+    mark below their activity, so they are listed again by the next run.
+    Destinations a repository is not mirrored to (create disabled, ignored)
+    do not hold the mark.
+
+    :param list source_remotes:    listed source remote repositories of the current run
+    :param dict destination_names: dictionary with the repository key as key and the names of the
+                                   resolved and failed destinations as value
+    :param float changed_since: time since which the listing was incremental (None if it was full)
+    :param float listed_at:     time of the listing
+    '''
+    if not self.incremental_listing or self.sync == 'manual':
+      return
+    key = 'listing/' + self._getJournalName()
+    values = dict(self.state.get(key, dict()))
+    if changed_since == None:
+      values['full_at'] = listed_at
+
+    activities = [source_remote.last_activity for source_remote in source_remotes if source_remote.last_activity != None]
+    if values.get('mark') != None:
+      activities.append(values['mark'])
+    if len(activities) > 0:
+      mark = max(activities)
+      for source_remote in source_remotes:
+        names = destination_names.get(getRepositoryKey(source_remote), list())
+        if source_remote.last_activity != None and len(names) > 0 and not self._isSynced(source_remote, names):
+          mark = min(mark, source_remote.last_activity)
+      values['mark'] = mark
+    self.state.set(key, values)
+
+
+  def _getJournalName(self):
+    '''
+    Get the file name of the journal of this task
+
+    :return: file name without extension
+    :rtype:  str
+    '''
+    if self.name != None:
+      name = self.name
+    else:
+      name = self.source.name + '_' + '_'.join(sorted(self.destinations))
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+  def _getObsoleteRepositories(self, verbose=False):
+    '''
+    Get mirrored repositories on the destinations which do not exist on the source anymore.
+    Destinations on which more than delete_threshold of the mirrors would be
+    deleted are skipped (e.g. when the source listing is incomplete), as well
+    as destinations which could not be listed. Nothing is deleted if the
+    source could not be listed.
+
+    :param bool verbose: print more output to the console
+
+    :return: dictionary with the destination name as key and a list of RemoteRepository objects as value
+    :rtype:  dict
+    '''
+    obsolete_repositories = dict()
+    source_names = set()
+    try:
+      for source_repo in self.source.getRepositoryList('all'):
+        if source_repo.description != None and not source_repo.description.startswith('MIRROR:'):
+          source_names.add(source_repo.name)
+    except KeyboardInterrupt as e:
+      raise e
+    except Exception as e:
+      if verbose:
+        print('WARNING: Listing repositories of \'' + self.source.name + '\' failed, no repositories are deleted: ' + str(e))
+      return obsolete_repositories
+
+    for key, destination_list in self._getDestinationLists(verbose).items():
+      obsolete_repositories[key] = list()
+      mirrors = [repo for repo in destination_list
+        if repo.description != None and repo.description.startswith('MIRROR:') and self._isOwned(repo.name)]
+      obsolete = [repo for repo in mirrors if repo.name not in source_names]
+      if len(obsolete) > 1 and len(obsolete) > self.delete_threshold * len(mirrors):
+        if verbose:
+          print('WARNING: ' + str(len(obsolete)) + ' of ' + str(len(mirrors)) + ' mirrors on \'' + key +
+            '\' would be deleted which exceeds the delete threshold. No repositories are deleted there.')
+        continue
+      obsolete_repositories[key] = obsolete
+    return obsolete_repositories
+
+
+  def _deleteRepositories(self, obsolete_repositories, verbose):
+    '''
+    Delete the given repositories concurrently within the delete rate
+
+    :param dict obsolete_repositories: dictionary with the destination name as key and a list of RemoteRepository objects as value
+    :param bool verbose:               print more output to the console
+    '''
+    limiter = RateLimiter(self.delete_rate, self.delete_workers)
+
+    def delete(key, repo):
+      limiter.acquire()
       try:
+        self.destinations[key].deleteRepository(repo)
         if verbose:
-          print('Mirror repository \'' + repository.source.name + '\'')
-        repository.clone()
-        repository.push()
+          print('Repository \'' + repo.name + '\' deleted from \'' + self.destinations[key].name + '\'')
       except KeyboardInterrupt as e:
         raise e
-      except:
+      except Exception as e:
         if verbose:
-          print('SyncError: Skip repository \'' + repository.source.name + '\'')
-        pass # ignore this repository when an error occures
-
-    if self.delete:
-      source_repositories = self.source.getRepositoryList('public')
-      source_repositories += self.source.getRepositoryList('internal')
-      source_repositories += self.source.getRepositoryList('private')
-      source_names = list()
-      for source_repo in source_repositories:
-        if source_repo.description != None and not source_repo.description.startswith('MIRROR:'):
-          source_names.append(source_repo.name)
+          print('DeleteError: Repository \'' + repo.name + '\' on \'' + self.destinations[key].name + '\': ' + str(e))
 
-      # Delete non-existent repositories on mirror destinations
-      for key in self.destinations:
-        destination_repositories = self.destinations[key].getRepositoryList('all')
-        for repo in destination_repositories:
-          if repo.description != None and repo.description.startswith('MIRROR:') and repo.name not in source_names:
-            self.destinations[key].deleteRepository(repo)
-            if verbose:
-              print('Repository \'' + repo.name + '\' deleted from \'' + self.destinations[key].name + '\'')
+    with ThreadPoolExecutor(max_workers = self.delete_workers) as executor:
+      for key in obsolete_repositories:
+        for repo in obsolete_repositories[key]:
+          executor.submit(delete, key, repo)
 
 
-  def _createRepository(self, source_remote, destinations):
+  def _getDestinationLists(self, verbose, report=None):
+    '''
+    Get the repositories of all destinations (one listing per destination)
+
+    :param bool verbose:       print more output to the console
+    :param DriftReport report: report recording the listing errors (see verify)
+
+    :return: dictionary with the destination name as key and RepositoryList as value
+             (destinations which could not be listed are missing)
+    :rtype:  dict
+    '''
+    destination_lists = dict()
+    for key, destination in self.destinations.items():
+      try:
+        destination_lists[key] = destination.getRepositoryList('all')
+      except KeyboardInterrupt as e:
+        raise e
+      except Exception as e:
+        if report != None:
+          report.addError(None, key, e)
+        if verbose:
+          print('ERROR: Listing repositories of \'' + destination.name + '\' failed: ' + str(e))
+    return destination_lists
+
+
+  def _createRepository(self, source_remote, destinations, destination_lists=None, failed=None):
+    '''
+    Get the destination repositories of a source repository. Existing
+    repositories get the description and website of the source, missing ones
+    are created (if enabled).
+
+    :param RemoteRepository source_remote: source remote repository
+    :param dict destinations:              destination hosters
+    :param dict destination_lists:         listings of the destinations (see _getDestinationLists).
+                                           Existing repositories found there are not updated.
+    :param list failed:                    names of the destinations which could not be resolved
+                                           because of errors are appended to this list
+
+    :return: repository instance (None if no destination is available)
+    :rtype:  Repository
+    '''
     param = {'description': source_remote.description, 'web_url': source_remote.web_url}
     description = 'MIRROR: %(description)s // Contribute at %(web_url)s' % param 
 
     destination_remotes = dict()
     for key in destinations:
       try:
+        if destination_lists != None:
+          if key not in destination_lists:
+            if failed != None:
+              failed.append(key) # Destination could not be listed
+            continue
+          remote_repo = destination_lists[key].get(source_remote.name)
+          if remote_repo == None:
+            raise LookupError('Repository \'' + source_remote.name + '\' not found')
+          destination_remotes[key] = remote_repo
+          continue
         remote_repo = destinations[key].getRepository(source_remote.name)
         remote_repo.description = description
         remote_repo.website = source_remote.website
@@ -180,7 +1083,7 @@ class Task():
         destination_remotes[key] = remote_repo
       except LookupError:
         # Repository does not exist -> create it
-        if self.create and source_remote.name not in destinations[key].ignored_repositories:
+        if self.create and not destinations[key].ignored_repositories.matches(source_remote):
           try:
             destination_remotes[destinations[key].name] = destinations[key].createRepository(
               source_remote.name, source_remote.visibility, description, source_remote.web_url
@@ -188,12 +1091,48 @@ class Task():
           except KeyboardInterrupt as e:
             raise e
           except:
-            pass # Skip this destination when communication errors occur
+            # Skip this destination when communication errors occur
+            if failed != None:
+              failed.append(key)
       except KeyboardInterrupt as e:
         raise e
       except:
-        pass # Skip this destination when communication errors occur
+        # Skip this destination when communication errors occur
+        if failed != None:
+          failed.append(key)
 
     if len(destination_remotes) == 0:
       return None
-    return Repository(source_remote, destination_remotes)
+    return self._newRepository(source_remote, destination_remotes)
+
+
+  def _newRepository(self, source_remote, destination_remotes):
+    '''
+    Create a repository instance using the transfer profiles of this task
+
+    :param RemoteRepository source_remote: source remote repository
+    :param dict destination_remotes:       destination remote repositories
+
+    :return: repository instance
+    :rtype:  Repository
+    '''
+    push_profiles = {key: self._getTransferProfile(self.destinations[key]) for key in destination_remotes if key in self.destinations}
+    push_policies = {key: self.destinations[key].push_policy for key in destination_remotes
+      if key in self.destinations and self.destinations[key].push_policy != None}
+    return Repository(source_remote, destination_remotes, self._getTransferProfile(self.source), push_profiles, push_policies,
+      self.seed_chunk_size)
+
+
+  def _getTransferProfile(self, hoster):
+    '''
+    Get the transfer profile for git operations with the given hoster
+    (the profile of the task takes precedence over the one of the hoster)
+
+    :param BaseHoster hoster: hoster
+
+    :return: transfer profile
+    :rtype:  TransferProfile
+    '''
+    if hoster.transfer_profile != None:
+      return hoster.transfer_profile.merge(self.transfer_profile)
+    return DEFAULT_PROFILE.merge(self.transfer_profile)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+# Profile options mapped to the git configuration they set
+CONFIG_OPTIONS = {
+  'protocol-version': 'protocol.version',
+  'pack-window': 'pack.window',
+  'pack-threads': 'pack.threads',
+  'compression': 'core.compression',
+  'http-post-buffer': 'http.postBuffer',
+  'fetch-parallel': 'fetch.parallel'
+}
+
+class TransferProfile():
+
+  def __init__(self, name, options=dict()):
+    '''
+    Initialize a transfer profile holding git tuning options
+
+    :param str name:     Profile name
+    :param dict options: Profile options (see CONFIG_OPTIONS)
+
+    :raises ValueError: if the given options are invalid
+    '''
+    for key in options:
+      if key not in CONFIG_OPTIONS:
+        raise ValueError('Unknown option \'' + key + '\' in transfer profile \'' + name + '\'')
+    if 'protocol-version' in options and options['protocol-version'] not in [0, 1, 2]:
+      raise ValueError('Protocol version \'' + str(options['protocol-version']) + '\' is not supported')
+    if 'compression' in options and options['compression'] not in range(-1, 10):
+      raise ValueError('Compression level must be between -1 and 9')
+
+    self.name = name
+    self.options = dict(options)
+
+
+  def merge(self, profile):
+    '''
+    Get a new profile with the options of the given profile taking precedence
+
+    :param TransferProfile profile: profile overriding the options of this one (may be None)
+
+    :return: merged profile
+    :rtype:  TransferProfile
+    '''
+    if profile == None:
+      return self
+    options = dict(self.options)
+    options.update(profile.options)
+    return TransferProfile(self.name + '+' + profile.name, options)
+
+
+  def getConfigArgs(self):
+    '''
+    Get the git arguments setting the configuration of this profile
+
+    :return: arguments to be placed before the git command
+    :rtype:  list
+    '''
+    args = list()
+    for key in sorted(self.options):
+      if key in CONFIG_OPTIONS:
+        args += ['-c', CONFIG_OPTIONS[key] + '=' + str(self.options[key])]
+    return args
+
+
+DEFAULT_PROFILE = TransferProfile('default')
+
+def getTransferProfiles(config):
+    '''
+    Get the transfer profiles of the configuration
+
+    :param dict config: transfer profile configuration (name -> options)
+
+    :return: dictionary with the profile name as key and TransferProfile as value
+    :rtype:  dict
+
+    :raises ValueError: if the given configuration is invalid
+    '''
+    profiles = dict()
+    for name in config:
+      profiles[name] = TransferProfile(name, config[name])
+    return profiles
+
+
+def getTransferProfile(config, profiles):
+    '''
+    Get the transfer profile referenced by a hoster or task configuration
+
+    :param dict config:   hoster or task configuration
+    :param dict profiles: available transfer profiles
+
+    :return: referenced transfer profile (None if the configuration does not reference any)
+    :rtype:  TransferProfile
+
+    :raises ValueError: if the referenced profile does not exist
+    '''
+    if 'transfer-profile' not in config:
+      return None
+    if config['transfer-profile'] not in profiles:
+      raise ValueError('Transfer profile \'' + config['transfer-profile'] + '\' not found')
+    return profiles[config['transfer-profile']]
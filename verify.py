@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Sandro Lutz <code@temparus.ch>
+#
+# This software is licensed under GPLv3, see LICENSE for details.
+
+class DriftReport():
+
+  def __init__(self, task_name):
+    '''
+    Initialize a report of the refs drifted between the source and the
+    destinations of a task
+
+    :param str task_name: name of the verified task
+    '''
+    self.task_name = task_name
+    self.checked = 0
+    self.repositories = dict()
+    self.errors = list()
+
+
+  def addDrift(self, name, destination, drift):
+    '''
+    Add the drift of a repository on a destination
+
+    :param str name:        repository name
+    :param str destination: destination hoster name
+    :param dict drift:      drift (see compareRefs) or {'repository': 'missing'}
+    '''
+    self.repositories.setdefault(name, dict())[destination] = dict(drift)
+
+
+  def addError(self, name, destination, error):
+    '''
+    Add an error which prevented the verification of a repository
+
+    :param str name:        repository name (None if the whole destination failed)
+    :param str destination: hoster name
+    :param Exception error: error
+    '''
+    self.errors.append({'repository': name, 'hoster': destination, 'error': str(error)})
+
+
+  def addRepair(self, name, destination, result):
+    '''
+    Add the outcome of pushing a drifted repository to a destination
+
+    :param str name:          repository name
+    :param str destination:   destination hoster name
+    :param PushResult result: result of the push
+    '''
+    drift = self.repositories[name][destination]
+    if result.isSuccessful():
+      drift['repaired'] = True
+    else:
+      drift['repaired'] = False
+      drift['error'] = str(result.error)
+
+
+  def getDriftedDestinations(self, name):
+    '''
+    Get the destinations on which a repository has drifted refs (repositories
+    missing on a destination are not included, they are created by a sync run)
+
+    :param str name: repository name
+
+    :return: destination hoster names
+    :rtype:  list
+    '''
+    return [destination for destination, drift in self.repositories.get(name, dict()).items() if 'repository' not in drift]
+
+
+  def isHealthy(self):
+    '''
+    :return: True if all repositories were verified and are in sync (or have been repaired)
+    :rtype:  bool
+    '''
+    if len(self.errors) > 0:
+      return False
+    return all(drift.get('repaired') == True for drifts in self.repositories.values() for drift in drifts.values())
+
+
+  def toDict(self):
+    '''
+    Get the report as JSON serializable dictionary
+
+    :rtype: dict
+    '''
+    return {
+      'task': self.task_name,
+      'checked': self.checked,
+      'drifted': len(self.repositories),
+      'healthy': self.isHealthy(),
+      'repositories': self.repositories,
+      'errors': self.errors
+    }
+
+
+def compareRefs(source_refs, destination_refs):
+  '''
+  Compare the ref tips of the source with the ones of a destination
+
+  :param dict source_refs:      refs of the source (ref name -> hash)
+  :param dict destination_refs: refs of the destination (ref name -> hash)
+
+  :return: drift with the keys missing, stale and extra (None if in sync)
+  :rtype:  dict
+  '''
+  drift = {
+    'missing': sorted(ref for ref in source_refs if ref not in destination_refs),
+    'stale': sorted(ref for ref in source_refs if ref in destination_refs and destination_refs[ref] != source_refs[ref]),
+    'extra': sorted(ref for ref in destination_refs if ref not in source_refs)
+  }
+  if not any(len(refs) > 0 for refs in drift.values()):
+    return None
+  return drift